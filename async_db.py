@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Asyncio facade for Cylinder Management System
+Awaitable versions of the customer, cylinder, dispatch and return operations
+for the service and batch jobs. Reads run on a dedicated thread pool that
+shares a fixed pool of connections; writes are group-committed through a
+WriteQueue so concurrent callers share transactions.
+
+    async with AsyncDatabase() as db:
+        customers = await db.get_all_customers()
+        dc_number = await db.dispatch_cylinders(customer_id, [1, 2], '01-01-2026', '')
+
+Every operation listed in backend.READ_OPERATIONS and backend.WRITE_OPERATIONS
+is available as a coroutine method with the same arguments.
+"""
+
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from backend import READ_OPERATIONS, WRITE_OPERATIONS
+from write_queue import WriteQueue, BATCH_WINDOW_MS
+
+POOL_SIZE = 4
+
+
+class ConnectionPool:
+    """Fixed set of connections handed out to executor threads."""
+    def __init__(self, size=POOL_SIZE):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(database.get_connection(check_same_thread=False))
+
+    def run(self, func, args, kwargs):
+        """Call func on a pooled connection."""
+        conn = self._connections.get()
+        try:
+            return func(*args, conn=conn, **kwargs)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._connections.put(conn)
+
+    def close(self):
+        """Close all pooled connections."""
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class AsyncDatabase:
+    """Awaitable database operations backed by a read pool and a write queue."""
+    def __init__(self, pool_size=POOL_SIZE, batch_window_ms=BATCH_WINDOW_MS):
+        self.pool_size = pool_size
+        self.batch_window_ms = batch_window_ms
+        self.pool = None
+        self.executor = None
+        self.write_queue = None
+
+    async def start(self):
+        """Open the connection pool and start the writer."""
+        database.enable_wal()
+        self.pool = ConnectionPool(self.pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='cms-read')
+        self.write_queue = WriteQueue(self.batch_window_ms).start()
+        return self
+
+    async def close(self):
+        """Finish queued writes and release the pool."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.write_queue.stop)
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def read(self, func, *args, **kwargs):
+        """Run a read function on a pooled connection."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.pool.run, func, args, kwargs)
+
+    async def write(self, func, *args, **kwargs):
+        """Queue a write function for group commit and wait for its own result."""
+        return await asyncio.wrap_future(self.write_queue.submit(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        if name in READ_OPERATIONS:
+            func, run = getattr(database, name), self.read
+        elif name in WRITE_OPERATIONS:
+            func, run = getattr(database, name), self.write
+        else:
+            raise AttributeError(name)
+
+        async def operation(*args, **kwargs):
+            return await run(func, *args, **kwargs)
+        operation.__name__ = name
+        return operation
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Backend selection for Cylinder Management System
+The GUI imports its data operations from here. When CMS_SERVICE_URL is set
+(e.g. http://127.0.0.1:8765) the operations are forwarded to a running
+service (see service.py); otherwise they call database.py directly.
+With CMS_GROUP_COMMIT=1, direct writes share transactions through the
+process-wide write queue (see write_queue.py). With CMS_REPLICA_FILE set,
+direct report reads go to that reporting replica, which is shipped in the
+background (see replica.py). With CMS_DEPOT set, direct access uses that
+depot's database file from the depot registry (see depots.py).
+"""
+
+import os
+
+import database
+
+READ_OPERATIONS = (
+    'authenticate_user',
+    'get_all_customers', 'search_customers',
+    'get_all_cylinders', 'get_cylinder_ids', 'search_cylinders', 'get_cylinders_by_status', 'get_cylinder', 'find_cylinder_id', 'resolve_cylinders', 'get_status_transitions',
+    'get_all_dispatches', 'get_dispatches_by_dc', 'get_dispatched_cylinders_by_dc', 'get_dispatches_by_customer',
+    'get_open_dispatches_for_cylinders', 'get_cylinders_with_last_dispatch', 'get_dispatch_history',
+    'get_bill_data_for_dc', 'get_bill_data_for_company', 'generate_dc_number',
+    'get_customer_holdings', 'get_holdings_totals',
+    'get_cylinder_aging', 'get_customer_aging_summary', 'get_rental_rates',
+    'get_work_batches', 'get_work_queue', 'get_work_queue_stats', 'get_work_queue_daily',
+    'get_turnaround_report', 'get_dashboard_counters', 'get_dc_numbers', 'get_delivery_challans',
+    'get_catalog_stats', 'get_replication_status', 'get_depot_transfers',
+)
+
+WRITE_OPERATIONS = (
+    'add_customer', 'update_customer', 'delete_customer',
+    'add_cylinder', 'add_cylinders', 'update_cylinder', 'update_cylinder_status', 'delete_cylinder', 'delete_cylinders',
+    'dispatch_cylinders', 'return_cylinders', 'return_dispatched_cylinders', 'delete_dispatch', 'archive_completed_dcs',
+    'set_rental_rate', 'check_holdings_consistency',
+    'create_work_batch', 'advance_work_batch',
+)
+
+SERVICE_URL = os.environ.get('CMS_SERVICE_URL', '')
+GROUP_COMMIT = os.environ.get('CMS_GROUP_COMMIT', '') not in ('', '0')
+REPLICA_FILE = os.environ.get('CMS_REPLICA_FILE', '')
+DEPOT = os.environ.get('CMS_DEPOT', '')
+replica_shipper = None
+
+if SERVICE_URL:
+    from service_client import ServiceClient
+    client = ServiceClient(SERVICE_URL)
+    for _name in READ_OPERATIONS + WRITE_OPERATIONS:
+        globals()[_name] = client.operation(_name)
+else:
+    client = None
+    for _name in READ_OPERATIONS:
+        globals()[_name] = getattr(database, _name)
+    if REPLICA_FILE:
+        import replica
+        for _name in replica.REPORT_OPERATIONS:
+            globals()[_name] = replica.reporting(getattr(database, _name), REPLICA_FILE)
+    if GROUP_COMMIT:
+        from write_queue import group_committed
+        for _name in WRITE_OPERATIONS:
+            globals()[_name] = group_committed(getattr(database, _name))
+    else:
+        for _name in WRITE_OPERATIONS:
+            globals()[_name] = getattr(database, _name)
+
+
+def init_backend():
+    """Prepare the database (and start shipping the replica), or check that the service is reachable in client mode."""
+    global replica_shipper
+    if client is not None:
+        client.health()
+    else:
+        if DEPOT:
+            import depots
+            database.DATABASE_FILE = depots.depot_file(DEPOT)
+        database.init_database()
+        if REPLICA_FILE and replica_shipper is None:
+            replica_shipper = replica.ReplicaShipper(REPLICA_FILE).start()
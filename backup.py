@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Online backup for Cylinder Management System
+Takes consistent snapshots of the live database with the SQLite backup API
+while terminals keep working. The copy runs PAGES_PER_STEP pages at a time
+and pauses between steps. In WAL mode (used by the service) it holds one read
+transaction for the whole copy, which never blocks writers and keeps the copy
+from restarting when they commit. With the rollback journal a read lock would
+block writers, so it is only held during each step; if commits keep
+restarting the copy it finishes in a single step instead.
+
+Each snapshot is checked with PRAGMA quick_check, gzip-compressed and
+recorded with its SHA-256 in manifest.json in the backup directory. A
+snapshot identical to the previous one is dropped, so scheduled runs only
+keep a new file when something changed. The newest KEEP snapshots are
+retained.
+
+    python backup.py snapshot [--db FILE] [--dir backups] [--keep 14]
+    python backup.py list [--dir backups]
+    python backup.py verify SNAPSHOT
+    python backup.py restore SNAPSHOT [--db FILE]
+    python backup.py prune [--dir backups] [--keep 14]
+
+The service takes scheduled snapshots with --backup-interval MINUTES.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import database
+
+BACKUP_DIR = 'backups'
+MANIFEST = 'manifest.json'
+KEEP = 14
+PAGES_PER_STEP = 256
+STEP_PAUSE_SECONDS = 0.005
+MAX_RESTARTS = 3
+BUSY_RETRY_SECONDS = 0.01
+
+# Tables counted when verifying a snapshot
+VERIFY_TABLES = ('customers', 'cylinders', 'dispatches', 'dispatch_archive')
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(directory=BACKUP_DIR):
+    """Snapshot entries of a backup directory, oldest first."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)['snapshots']
+    except FileNotFoundError:
+        return []
+
+
+def _write_manifest(directory, snapshots):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'snapshots': snapshots}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def copy_database(source, target_path, pages=PAGES_PER_STEP, pause=STEP_PAUSE_SECONDS):
+    """Back up source into target_path in steps; returns step statistics.
+
+    max_step_ms is the longest time between steps, including retries while a
+    writer held the lock.
+    """
+    wal = source.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    stats = {'steps': 0, 'restarts': 0, 'max_step_ms': 0.0, 'pages': 0, 'wal': wal}
+    last = {'copied': 0, 'time': time.perf_counter()}
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        stats['steps'] += 1
+        stats['pages'] = total
+        stats['max_step_ms'] = max(stats['max_step_ms'], (now - last['time']) * 1000)
+        if total - remaining < last['copied']:
+            stats['restarts'] += 1  # another connection committed and the copy started over
+            if stats['restarts'] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last['copied'] = total - remaining
+        if remaining and pause:
+            time.sleep(pause)
+        last['time'] = time.perf_counter()
+
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            if wal:
+                # Pin one consistent WAL snapshot for the whole copy
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            # sleep: retry soon when a writer holds the lock instead of the default 250 ms
+            source.backup(target, pages=pages, progress=progress, sleep=BUSY_RETRY_SECONDS)
+        except _TooManyRestarts:
+            start = time.perf_counter()
+            source.backup(target)
+            stats['steps'] += 1
+            stats['max_step_ms'] = max(stats['max_step_ms'], (time.perf_counter() - start) * 1000)
+            stats['single_step_fallback'] = True
+        finally:
+            if source.in_transaction:
+                source.rollback()
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        stats['schema_version'] = target.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        target.close()
+    if check != 'ok':
+        raise RuntimeError(f"Snapshot failed quick_check: {check}")
+    stats['max_step_ms'] = round(stats['max_step_ms'], 2)
+    return stats
+
+
+def create_snapshot(directory=BACKUP_DIR, keep=KEEP, compress=True, pages=PAGES_PER_STEP, pause=STEP_PAUSE_SECONDS):
+    """Snapshot the current database into directory and prune old snapshots.
+
+    Returns the manifest entry of the new snapshot, or of the previous one
+    with 'unchanged': True when nothing changed since.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(database.DATABASE_FILE))[0]
+    name = f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+    tmp_path = os.path.join(directory, name + '.tmp')
+    start = time.perf_counter()
+    source = database.get_connection()
+    try:
+        stats = copy_database(source, tmp_path, pages, pause)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+
+    snapshots = read_manifest(directory)
+    sha256 = _sha256(tmp_path)
+    if snapshots and snapshots[-1]['sha256'] == sha256 and os.path.exists(os.path.join(directory, snapshots[-1]['file'])):
+        os.remove(tmp_path)
+        return dict(snapshots[-1], unchanged=True)
+
+    if compress:
+        name += '.gz'
+        with open(tmp_path, 'rb') as src, gzip.open(os.path.join(directory, name), 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        size = os.path.getsize(tmp_path)
+        os.remove(tmp_path)
+    else:
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, os.path.join(directory, name))
+
+    entry = {
+        'file': name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'database': os.path.abspath(database.DATABASE_FILE),
+        'sha256': sha256,
+        'size': size,
+        'stored_size': os.path.getsize(os.path.join(directory, name)),
+        'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        **stats,
+    }
+    snapshots.append(entry)
+    _write_manifest(directory, snapshots)
+    prune(directory, keep)
+    return entry
+
+
+def prune(directory=BACKUP_DIR, keep=KEEP):
+    """Delete all but the newest keep snapshots; returns the deleted file names."""
+    snapshots = read_manifest(directory)
+    if len(snapshots) <= keep:
+        return []
+    expired, snapshots = snapshots[:len(snapshots) - keep], snapshots[len(snapshots) - keep:]
+    for entry in expired:
+        path = os.path.join(directory, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+    _write_manifest(directory, snapshots)
+    return [entry['file'] for entry in expired]
+
+
+def _manifest_entry(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    for entry in read_manifest(directory):
+        if entry['file'] == name:
+            return entry
+    return None
+
+
+def _expand(path):
+    """Path of an uncompressed copy of a snapshot (a temporary file for .gz) and whether it is temporary."""
+    if not path.endswith('.gz'):
+        return path, False
+    fd, tmp_path = tempfile.mkstemp(suffix='.db')
+    with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    return tmp_path, True
+
+
+def _verify_file(db_path, expected_sha256=None):
+    problems = []
+    if expected_sha256 and _sha256(db_path) != expected_sha256:
+        problems.append("SHA-256 does not match the manifest")
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        integrity = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if integrity != ['ok']:
+            problems.extend(integrity)
+        foreign_key_errors = conn.execute("PRAGMA foreign_key_check").fetchall()
+        if foreign_key_errors:
+            problems.append(f"{len(foreign_key_errors)} foreign key violation(s)")
+        schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        latest = database.MIGRATIONS[-1][0]
+        if schema_version > latest:
+            problems.append(f"schema version {schema_version} is newer than this program ({latest})")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in VERIFY_TABLES if table in tables}
+    finally:
+        conn.close()
+    return {'ok': not problems, 'problems': problems, 'schema_version': schema_version, 'counts': counts}
+
+
+def verify_snapshot(path):
+    """Check a snapshot: manifest checksum, integrity_check, foreign keys and schema version.
+
+    Returns {'ok', 'problems', 'schema_version', 'counts'}.
+    """
+    entry = _manifest_entry(path)
+    db_path, temporary = _expand(path)
+    try:
+        return _verify_file(db_path, entry['sha256'] if entry else None)
+    finally:
+        if temporary:
+            os.remove(db_path)
+
+
+def restore_snapshot(path, target=None):
+    """Verify a snapshot and copy it into target (default: the current database), online.
+
+    The copy uses the backup API, so running terminals see the restored data
+    on their next query. Returns the verification result; raises ValueError
+    and leaves target untouched when verification fails.
+    """
+    target = target or database.DATABASE_FILE
+    entry = _manifest_entry(path)
+    db_path, temporary = _expand(path)
+    try:
+        result = _verify_file(db_path, entry['sha256'] if entry else None)
+        if not result['ok']:
+            raise ValueError("Snapshot failed verification: " + "; ".join(result['problems']))
+        source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+    finally:
+        if temporary:
+            os.remove(db_path)
+    if os.path.abspath(target) == os.path.abspath(database.DATABASE_FILE):
+        database.cylinder_catalog.invalidate()
+    return result
+
+
+class BackupScheduler:
+    """Background thread taking a snapshot every interval seconds."""
+    def __init__(self, interval, directory=BACKUP_DIR, keep=KEEP):
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+        self.last = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cms-backup', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last = create_snapshot(self.directory, self.keep)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Backup failed: {self.last_error}", file=sys.stderr)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Cylinder Management System backups")
+    parser.add_argument('--db', default=database.DATABASE_FILE, help="database file")
+    parser.add_argument('--dir', default=BACKUP_DIR, help="backup directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot = commands.add_parser('snapshot', help="take a snapshot now")
+    snapshot.add_argument('--keep', type=int, default=KEEP, help="snapshots to retain")
+    snapshot.add_argument('--no-compress', action='store_true', help="store the snapshot uncompressed")
+    snapshot.add_argument('--pages', type=int, default=PAGES_PER_STEP, help="pages copied per step")
+    commands.add_parser('list', help="list snapshots")
+    verify = commands.add_parser('verify', help="verify a snapshot")
+    verify.add_argument('snapshot')
+    restore = commands.add_parser('restore', help="verify a snapshot and restore it into --db")
+    restore.add_argument('snapshot')
+    prune_parser = commands.add_parser('prune', help="delete old snapshots")
+    prune_parser.add_argument('--keep', type=int, default=KEEP, help="snapshots to retain")
+    args = parser.parse_args(argv)
+
+    database.DATABASE_FILE = args.db
+    if args.command == 'snapshot':
+        entry = create_snapshot(args.dir, args.keep, not args.no_compress, args.pages)
+        if entry.get('unchanged'):
+            print(f"No changes since {entry['file']}")
+        else:
+            print(f"{entry['file']}: {entry['size']} bytes ({entry['stored_size']} stored) in {entry['duration_ms']} ms, "
+                  f"{entry['steps']} steps, longest step {entry['max_step_ms']} ms")
+    elif args.command == 'list':
+        for entry in read_manifest(args.dir):
+            print(f"{entry['created']}  {entry['file']}  {entry['stored_size']} bytes  schema v{entry['schema_version']}")
+    elif args.command in ('verify', 'restore'):
+        try:
+            if args.command == 'verify':
+                result = verify_snapshot(args.snapshot)
+            else:
+                result = restore_snapshot(args.snapshot, args.db)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        counts = ", ".join(f"{table} {count}" for table, count in result['counts'].items())
+        print(f"{'OK' if result['ok'] else 'FAILED'}: schema v{result['schema_version']}, {counts}")
+        for problem in result['problems']:
+            print(f"  {problem}")
+        if not result['ok']:
+            return 1
+        if args.command == 'restore':
+            print(f"Restored into {args.db}")
+    elif args.command == 'prune':
+        for name in prune(args.dir, args.keep):
+            print(f"Deleted {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
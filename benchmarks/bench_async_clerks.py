@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark: concurrent clerks on the asyncio facade
+Simulates clerks that each repeatedly look up their cylinders, dispatch them,
+check the DC, return them and mark them refilled. Runs the same workload once with one thread per
+clerk calling database.py directly (a connection and a commit per call) and
+once with coroutines on AsyncDatabase (pooled reads, group-committed writes),
+against a fresh temporary database, and prints the throughput of both.
+
+    python benchmarks/bench_async_clerks.py [--clerks 100] [--cycles 10]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from async_db import AsyncDatabase, POOL_SIZE
+from write_queue import BATCH_WINDOW_MS
+
+CYLINDERS_PER_CLERK = 3
+DATE = '01-01-2026'
+
+
+def seed(path, clerks):
+    """Create a database with one customer and a few cylinders per clerk."""
+    database.DATABASE_FILE = path
+    database.init_database()
+    database.enable_wal()
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    workload = []
+    for clerk in range(clerks):
+        cursor.execute("INSERT INTO customers (name, contact_info, address, notes) VALUES (?, '', '', '')",
+                       (f"Customer {clerk}",))
+        customer_id = cursor.lastrowid
+        cylinder_ids = []
+        for n in range(CYLINDERS_PER_CLERK):
+            cursor.execute("INSERT INTO cylinders (cylinder_id, cylinder_type, status, location) VALUES (?, 'O2', 'available', '')",
+                           (f"B{clerk:03d}-{n}",))
+            cylinder_ids.append(cursor.lastrowid)
+        workload.append((customer_id, cylinder_ids))
+    conn.commit()
+    conn.close()
+    return workload
+
+
+def run_direct(workload, cycles):
+    """One thread per clerk calling database.py directly."""
+    errors = []
+
+    def clerk(customer_id, cylinder_ids):
+        for _ in range(cycles):
+            try:
+                for cylinder_id in cylinder_ids:
+                    database.get_cylinder(cylinder_id)
+                dc_number = database.dispatch_cylinders(customer_id, cylinder_ids, DATE, '', grade='A', vehicle_number='V')
+                database.get_dispatched_cylinders_by_dc(dc_number)
+                database.return_cylinders(dc_number, cylinder_ids, DATE, '')
+                database.update_cylinder_status(cylinder_ids, 'refill')
+                database.update_cylinder_status(cylinder_ids, 'available')
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=clerk, args=work) for work in workload]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+
+async def run_async(workload, cycles, pool_size, batch_window_ms):
+    """One coroutine per clerk on the asyncio facade."""
+    errors = []
+
+    async def clerk(db, customer_id, cylinder_ids):
+        for _ in range(cycles):
+            try:
+                await asyncio.gather(*(db.get_cylinder(cylinder_id) for cylinder_id in cylinder_ids))
+                dc_number = await db.dispatch_cylinders(customer_id, cylinder_ids, DATE, '', grade='A', vehicle_number='V')
+                await db.get_dispatched_cylinders_by_dc(dc_number)
+                await db.return_cylinders(dc_number, cylinder_ids, DATE, '')
+                await db.update_cylinder_status(cylinder_ids, 'refill')
+                await db.update_cylinder_status(cylinder_ids, 'available')
+            except Exception as e:
+                errors.append(e)
+
+    async with AsyncDatabase(pool_size, batch_window_ms) as db:
+        start = time.perf_counter()
+        await asyncio.gather(*(clerk(db, *work) for work in workload))
+        elapsed = time.perf_counter() - start
+        return elapsed, errors, db.write_queue.metrics.snapshot()
+
+
+def report(name, clerks, cycles, elapsed, errors):
+    operations = clerks * cycles * (CYLINDERS_PER_CLERK + 5)
+    print(f"{name:<28} {elapsed:8.2f} s  {operations / elapsed:10.1f} ops/s  "
+          f"{clerks * cycles / elapsed:8.1f} dispatch+return cycles/s  {len(errors)} errors")
+    if errors:
+        print(f"{'':<28} first error: {errors[0]!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent clerk benchmark for the asyncio facade")
+    parser.add_argument('--clerks', type=int, default=100)
+    parser.add_argument('--cycles', type=int, default=10, help="dispatch/return cycles per clerk")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE)
+    parser.add_argument('--batch-window-ms', type=float, default=BATCH_WINDOW_MS)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='cms_bench_')
+    try:
+        print(f"{args.clerks} clerks x {args.cycles} cycles, {CYLINDERS_PER_CLERK} cylinders each")
+        workload = seed(os.path.join(directory, 'direct.db'), args.clerks)
+        elapsed, errors = run_direct(workload, args.cycles)
+        report("direct (thread per clerk)", args.clerks, args.cycles, elapsed, errors)
+
+        workload = seed(os.path.join(directory, 'async.db'), args.clerks)
+        elapsed, errors, metrics = asyncio.run(run_async(workload, args.cycles, args.pool_size, args.batch_window_ms))
+        report("asyncio facade", args.clerks, args.cycles, elapsed, errors)
+        print(f"{'':<28} write queue: {metrics['batches']} batches, avg batch {metrics['avg_batch_size']}, "
+              f"max batch {metrics['max_batch_size']}, avg commit {metrics['avg_commit_ms']} ms, "
+              f"p95 commit {metrics['p95_commit_ms']} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
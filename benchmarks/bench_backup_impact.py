@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark: dispatch latency while online backups run
+A clerk thread dispatches and returns cylinders in a loop for a fixed time,
+first with no backup running and then while snapshots are taken back to
+back, against a fresh temporary database. Prints the dispatch latency
+percentiles of both runs and the snapshot step statistics.
+
+    python benchmarks/bench_backup_impact.py [--cylinders 20000] [--seconds 5] [--pages 256] [--no-wal]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup
+import database
+from turnaround import percentile
+
+DATE = '01-01-2026'
+CYLINDERS_PER_DISPATCH = 5
+
+
+def seed(path, cylinders, wal):
+    """Create a database with cylinders and some dispatch history to give it a realistic size."""
+    database.DATABASE_FILE = path
+    database.init_database()
+    if wal:
+        database.enable_wal()
+    customer_id = database.add_customer("Customer", '', '', '')
+    database.add_cylinders([(f"K{n:06d}", 'O2', 'available', f"Rack {n % 40}") for n in range(cylinders)])
+    cylinder_ids = [row[0] for row in database.get_cylinders_by_status('available')]
+    for start in range(0, len(cylinder_ids) // 2, 500):
+        chunk = cylinder_ids[start:start + 500]
+        dc_number = database.dispatch_cylinders(customer_id, chunk, DATE, 'seed', grade='A', vehicle_number='V')
+        database.return_cylinders(dc_number, chunk, DATE, '')
+        database.update_cylinder_status(chunk, 'refill')
+        database.update_cylinder_status(chunk, 'available')
+    return customer_id, cylinder_ids
+
+
+def clerk(customer_id, cylinder_ids, seconds, latencies, errors):
+    """Dispatch and return small batches until the time is up, recording dispatch latency."""
+    deadline = time.perf_counter() + seconds
+    offset = 0
+    while time.perf_counter() < deadline:
+        batch = cylinder_ids[offset:offset + CYLINDERS_PER_DISPATCH]
+        offset = (offset + CYLINDERS_PER_DISPATCH) % (len(cylinder_ids) - CYLINDERS_PER_DISPATCH)
+        try:
+            start = time.perf_counter()
+            dc_number = database.dispatch_cylinders(customer_id, batch, DATE, '', grade='A', vehicle_number='V')
+            latencies.append((time.perf_counter() - start) * 1000)
+            database.return_dispatched_cylinders(batch, DATE, '')
+            database.update_cylinder_status(batch, 'refill')
+            database.update_cylinder_status(batch, 'available')
+        except Exception as e:
+            errors.append(e)
+
+
+def run(name, workload, seconds, backup_dir=None, pages=backup.PAGES_PER_STEP):
+    latencies, errors, snapshots = [], [], []
+    stop = threading.Event()
+
+    def backups():
+        while not stop.is_set():
+            snapshots.append(backup.create_snapshot(backup_dir, keep=2, pages=pages))
+
+    backup_thread = threading.Thread(target=backups) if backup_dir else None
+    if backup_thread:
+        backup_thread.start()
+    clerk(*workload, seconds, latencies, errors)
+    stop.set()
+    if backup_thread:
+        backup_thread.join()
+    print(f"{name:<24} {len(latencies):6d} dispatches  p50 {percentile(latencies, 50):7.2f} ms  "
+          f"p95 {percentile(latencies, 95):7.2f} ms  max {max(latencies):8.2f} ms  {len(errors)} errors")
+    if errors:
+        print(f"{'':<24} first error: {errors[0]!r}")
+    if snapshots:
+        taken = [entry for entry in snapshots if not entry.get('unchanged')]
+        print(f"{'':<24} {len(snapshots)} snapshots ({len(taken)} kept before pruning), "
+              f"avg {sum(e['duration_ms'] for e in snapshots) / len(snapshots):.0f} ms, "
+              f"longest step {max(e['max_step_ms'] for e in snapshots):.2f} ms, "
+              f"restarts {sum(e.get('restarts', 0) for e in snapshots)}")
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dispatch latency during online backups")
+    parser.add_argument('--cylinders', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pages', type=int, default=backup.PAGES_PER_STEP, help="pages copied per backup step")
+    parser.add_argument('--no-wal', action='store_true', help="use the rollback journal instead of WAL")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='cms_bench_')
+    try:
+        workload = seed(os.path.join(directory, 'bench.db'), args.cylinders, not args.no_wal)
+        size = os.path.getsize(database.DATABASE_FILE)
+        print(f"{args.cylinders} cylinders, {size / 1e6:.1f} MB, {'rollback journal' if args.no_wal else 'WAL'}, "
+              f"{args.pages} pages per step")
+        baseline = run("no backup", workload, args.seconds)
+        during = run("continuous backups", workload, args.seconds, os.path.join(directory, 'backups'), args.pages)
+        print(f"{'':<24} p95 dispatch latency {percentile(during, 95) / percentile(baseline, 95):.2f}x baseline")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
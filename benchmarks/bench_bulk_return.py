@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark: returning many cylinders at once
+Dispatches the cylinders over several DCs, then returns all of them the way
+the dispatch tab used to (one open-DC lookup per cylinder, then one
+return_cylinders call per DC) and the current way (one lookup for the whole
+selection, then return_dispatched_cylinders in a single transaction), each
+against a fresh temporary database, and prints the time of both.
+
+    python benchmarks/bench_bulk_return.py [--cylinders 1000] [--dcs 50]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+CUSTOMERS = 10
+DATE = '01-01-2026'
+
+
+def seed(path, cylinders, dcs):
+    """Create a database with the cylinders dispatched over dcs DCs; returns the cylinder IDs."""
+    database.DATABASE_FILE = path
+    database.init_database()
+    database.enable_wal()
+    customer_ids = [database.add_customer(f"Customer {n}", '', '', '') for n in range(CUSTOMERS)]
+    database.add_cylinders([(f"R{n:05d}", 'O2' if n % 2 else 'N2', 'available', '') for n in range(cylinders)])
+    cylinder_ids = [row[0] for row in database.get_cylinders_by_status('available')]
+    per_dc = -(-len(cylinder_ids) // dcs)
+    for n, start in enumerate(range(0, len(cylinder_ids), per_dc)):
+        database.dispatch_cylinders(customer_ids[n % CUSTOMERS], cylinder_ids[start:start + per_dc], DATE, '',
+                                    grade='A', vehicle_number='V')
+    return cylinder_ids
+
+
+def open_dispatch_for_cylinder(cylinder_id):
+    """(dc_number, dispatch id) of the latest open dispatch of one cylinder, on its own connection."""
+    conn = database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT dc_number, id FROM dispatches
+            WHERE cylinder_id = ? AND status = 'dispatched'
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (cylinder_id,))
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def return_per_cylinder(cylinder_ids):
+    """The previous path: one open-DC query per cylinder, one transaction per DC."""
+    dc_groups = {}
+    for cylinder_id in cylinder_ids:
+        dc_number, dispatch_id = open_dispatch_for_cylinder(cylinder_id)
+        dc_groups.setdefault(dc_number, []).append(cylinder_id)
+    for dc_number, dc_cylinder_ids in dc_groups.items():
+        database.return_cylinders(dc_number, dc_cylinder_ids, DATE, '')
+
+
+def return_in_one_transaction(cylinder_ids):
+    """The current path: one open-DC lookup for the selection, one transaction."""
+    open_dispatches = database.get_open_dispatches_for_cylinders(cylinder_ids)
+    assert len(open_dispatches) == len(cylinder_ids)
+    database.return_dispatched_cylinders(cylinder_ids, DATE, '')
+
+
+def run(name, directory, returner, cylinders, dcs):
+    cylinder_ids = seed(os.path.join(directory, f"{returner.__name__}.db"), cylinders, dcs)
+    start = time.perf_counter()
+    returner(cylinder_ids)
+    elapsed = time.perf_counter() - start
+    returned = len(database.get_cylinders_by_status('returned'))
+    open_dcs = len(database.get_dc_numbers(open_only=True))
+    print(f"{name:<32} {elapsed * 1000:9.1f} ms  {returned / elapsed:10.1f} cylinders/s  "
+          f"{returned} returned, {open_dcs} DCs still open")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk return benchmark")
+    parser.add_argument('--cylinders', type=int, default=1000)
+    parser.add_argument('--dcs', type=int, default=50, help="DCs the cylinders are dispatched under")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='cms_bench_')
+    try:
+        print(f"returning {args.cylinders} cylinders dispatched under {args.dcs} DCs")
+        before = run("per cylinder, per DC", directory, return_per_cylinder, args.cylinders, args.dcs)
+        after = run("one query, one transaction", directory, return_in_one_transaction, args.cylinders, args.dcs)
+        print(f"{'':<32} {before / after:9.1f}x faster")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
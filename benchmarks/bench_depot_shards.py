@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark: depots sharing one database file versus one file per depot
+One clerk thread per depot dispatches, returns and refills cylinders for a fixed
+time, first with every depot in one shared file and then with each depot in
+its own file routed through DepotRouter, against fresh temporary databases.
+Prints dispatch throughput and latency of both layouts, then times the
+cross-depot aging summary run depot by depot and fanned out in parallel.
+
+    python benchmarks/bench_depot_shards.py [--depots 4] [--cylinders 5000] [--seconds 5]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from depots import DepotRouter
+from turnaround import percentile
+
+DATE = '01-01-2026'
+AS_OF = '01-06-2026'
+CYLINDERS_PER_DISPATCH = 5
+
+
+def seed(router, cylinders):
+    """Give every depot a customer and cylinders, half of them out; returns {depot: (customer_id, free cylinder IDs)}."""
+    workload = {}
+    for depot in router.depots:
+        customer_id = router.call(depot, 'add_customer', f"{depot} customer", '', '', '')
+        router.call(depot, 'add_cylinders', [(f"{depot}-{n:06d}", 'O2', 'available', depot) for n in range(cylinders)])
+        cylinder_ids = sorted(row[0] for row in router.call(depot, 'get_cylinders_by_status', 'available')
+                              if row[4] == depot)
+        half = len(cylinder_ids) // 2
+        for start in range(0, half, 100):
+            router.call(depot, 'dispatch_cylinders', customer_id, cylinder_ids[start:min(start + 100, half)], DATE, '',
+                        grade='A', vehicle_number='V')
+        workload[depot] = (customer_id, cylinder_ids[half:])
+    return workload
+
+
+def clerk(router, depot, customer_id, cylinder_ids, deadline, latencies, errors):
+    """Dispatch, return and refill small batches at one depot until the deadline, recording dispatch latency."""
+    offset = 0
+    while time.perf_counter() < deadline:
+        batch = cylinder_ids[offset:offset + CYLINDERS_PER_DISPATCH]
+        offset = (offset + CYLINDERS_PER_DISPATCH) % len(cylinder_ids)
+        try:
+            start = time.perf_counter()
+            router.call(depot, 'dispatch_cylinders', customer_id, batch, DATE, '', grade='A', vehicle_number='V')
+            latencies.append((time.perf_counter() - start) * 1000)
+            router.call(depot, 'return_dispatched_cylinders', batch, DATE, '')
+            # Refill the returned batch so it can go out again once the offset wraps
+            router.call(depot, 'update_cylinder_status', batch, 'refill')
+            router.call(depot, 'update_cylinder_status', batch, 'available')
+        except Exception as e:
+            errors.append(e)
+
+
+def run(name, depots, cylinders, seconds):
+    router = DepotRouter(depots)
+    for path in set(depots.values()):
+        database.init_database(path)
+        database.DATABASE_FILE = path
+        database.enable_wal()
+    workload = seed(router, cylinders)
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=clerk, args=(router, depot, *workload[depot], deadline, latencies, errors))
+               for depot in router.depots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f"{name}: {len(errors)} clerk errors, first: {errors[0]!r}")
+    print(f"{name:<18} {len(latencies) / seconds:7.1f} dispatches/s  p50 {percentile(latencies, 50):7.2f} ms  "
+          f"p95 {percentile(latencies, 95):7.2f} ms")
+    return router
+
+
+def time_reports(router):
+    start = time.perf_counter()
+    serial = sum(len(router.call(depot, 'get_customer_aging_summary', AS_OF)) for depot in router.depots)
+    serial_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    parallel = len(router.report('get_customer_aging_summary', AS_OF))
+    parallel_ms = (time.perf_counter() - start) * 1000
+    print(f"aging summary      depot by depot {serial_ms:8.1f} ms ({serial} rows)  "
+          f"fanned out {parallel_ms:8.1f} ms ({parallel} rows)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared database versus one database per depot")
+    parser.add_argument('--depots', type=int, default=4)
+    parser.add_argument('--cylinders', type=int, default=5000, help="cylinders per depot")
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='cms_bench_')
+    try:
+        names = [f"Depot{n + 1}" for n in range(args.depots)]
+        print(f"{args.depots} depots, {args.cylinders} cylinders each, one clerk per depot")
+        shared = os.path.join(directory, 'shared.db')
+        run("one shared file", {name: shared for name in names}, args.cylinders, args.seconds)
+        router = run("file per depot", {name: os.path.join(directory, f"{name}.db") for name in names},
+                     args.cylinders, args.seconds)
+        time_reports(router)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
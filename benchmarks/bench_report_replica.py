@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark: dispatch latency while reports run on the primary or a replica
+A clerk thread dispatches and returns cylinders in a loop for a fixed time
+while a reporting thread runs the aging summary and company bills back to
+back, first against the live database and then against a reporting replica
+shipped in the background, against a fresh temporary database. A run without
+reports (and without a replica registered) gives the baseline, and a run
+shipping a replica without reports shows the cost of change capture. Prints
+the dispatch latency percentiles of each run and the replica lag.
+
+    python benchmarks/bench_report_replica.py [--cylinders 20000] [--seconds 5] [--no-wal]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import replica
+from turnaround import percentile
+
+DATE = '01-01-2026'
+AS_OF = '01-06-2026'
+CUSTOMERS = 20
+CYLINDERS_PER_DISPATCH = 5
+
+
+def seed(path, cylinders, wal):
+    """Create a database with half of the cylinders out with customers for the reports to work on."""
+    database.DATABASE_FILE = path
+    database.init_database()
+    if wal:
+        database.enable_wal()
+    customer_ids = [database.add_customer(f"Customer {n}", '', '', '') for n in range(CUSTOMERS)]
+    database.add_cylinders([(f"K{n:06d}", 'O2' if n % 2 else 'N2', 'available', '') for n in range(cylinders)])
+    cylinder_ids = [row[0] for row in database.get_cylinders_by_status('available')]
+    half = len(cylinder_ids) // 2
+    for n, start in enumerate(range(0, half, 100)):
+        database.dispatch_cylinders(customer_ids[n % CUSTOMERS], cylinder_ids[start:start + 100], DATE, '',
+                                    grade='A', vehicle_number='V')
+    return customer_ids, cylinder_ids[half:]
+
+
+def clerk(customer_id, cylinder_ids, seconds, latencies, errors):
+    """Dispatch and return small batches until the time is up, recording dispatch latency."""
+    deadline = time.perf_counter() + seconds
+    offset = 0
+    while time.perf_counter() < deadline:
+        batch = cylinder_ids[offset:offset + CYLINDERS_PER_DISPATCH]
+        offset = (offset + CYLINDERS_PER_DISPATCH) % (len(cylinder_ids) - CYLINDERS_PER_DISPATCH)
+        try:
+            start = time.perf_counter()
+            database.dispatch_cylinders(customer_id, batch, DATE, '', grade='A', vehicle_number='V')
+            latencies.append((time.perf_counter() - start) * 1000)
+            database.return_dispatched_cylinders(batch, DATE, '')
+            database.update_cylinder_status(batch, 'refill')
+            database.update_cylinder_status(batch, 'available')
+        except Exception as e:
+            errors.append(e)
+
+
+def reports(customer_ids, stop, counts, aging, bill):
+    """Run the aging summary and every company bill until stopped."""
+    while not stop.is_set():
+        aging(AS_OF)
+        for customer_id in customer_ids:
+            bill(customer_id)
+        counts.append(1)
+
+
+def run(name, workload, seconds, replica_path=None, with_reports=True):
+    customer_ids, cylinder_ids = workload
+    latencies, errors, counts = [], [], []
+    stop = threading.Event()
+    aging, bill = database.get_customer_aging_summary, database.get_bill_data_for_company
+    shipper = None
+    if replica_path:
+        replica.ship(replica_path)
+        shipper = replica.ReplicaShipper(replica_path).start()
+        aging, bill = replica.reporting(aging, replica_path), replica.reporting(bill, replica_path)
+
+    reporter = threading.Thread(target=reports, args=(customer_ids, stop, counts, aging, bill)) if with_reports else None
+    if reporter:
+        reporter.start()
+    clerk(customer_ids[0], cylinder_ids, seconds, latencies, errors)
+    stop.set()
+    if reporter:
+        reporter.join()
+    lag = ''
+    if shipper:
+        status = database.get_replication_status()
+        shipper.stop()
+        lag = f"  replica {status[0][2]} changes / {status[0][3]:.1f} s behind"
+        replica.drop(replica_path)
+    print(f"{name:<22} {len(latencies):6d} dispatches  p50 {percentile(latencies, 50):7.2f} ms  "
+          f"p95 {percentile(latencies, 95):7.2f} ms  max {max(latencies):8.2f} ms  "
+          f"{len(counts)} report rounds  {len(errors)} errors{lag}")
+    if errors:
+        print(f"{'':<22} first error: {errors[0]!r}")
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dispatch latency with reports on the primary or a replica")
+    parser.add_argument('--cylinders', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--no-wal', action='store_true', help="use the rollback journal instead of WAL")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='cms_bench_')
+    try:
+        workload = seed(os.path.join(directory, 'bench.db'), args.cylinders, not args.no_wal)
+        print(f"{args.cylinders} cylinders, {'rollback journal' if args.no_wal else 'WAL'}")
+        replica_path = os.path.join(directory, 'replica.db')
+        baseline = run("no reports", workload, args.seconds, with_reports=False)
+        run("replica, no reports", workload, args.seconds, replica_path, with_reports=False)
+        primary = run("reports on primary", workload, args.seconds)
+        shipped = run("reports on replica", workload, args.seconds, replica_path)
+        for name, latencies in (("primary", primary), ("replica", shipped)):
+            print(f"{'':<22} reports on {name}: p95 dispatch latency "
+                  f"{percentile(latencies, 95) / percentile(baseline, 95):.2f}x baseline")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+PDF bills for Cylinder Management System
+Builds the DC and company bills from get_bill_data_for_dc() and
+get_bill_data_for_company() results. reportlab is imported only when a bill
+is written, so importing this module stays cheap for the GUI and the CLI.
+"""
+
+import importlib.util
+from datetime import datetime
+
+COMPANY_TITLE = "SPEC GASES & EQUIPMENTS"
+COMPANY_SUBTITLE = "Door No. 2-4, Plot No. 408, Near Ganesh Kaman, B.N. Reddy Nagar, Cherlapally, Hyderabad - 500 051. Mobile : 98491 28904, 99491 22206 E-mail : spec_equipe@rediffmail.com"
+
+
+def reportlab_available():
+    """True when reportlab is installed (checked without importing it)."""
+    return importlib.util.find_spec('reportlab') is not None
+
+
+def dc_bill_title(dc_number, bill_data):
+    return f"Bill for DC {dc_number} - {bill_data['customer_name']}"
+
+
+def company_bill_title(bill_data):
+    return f"Bill for {bill_data['customer_name']}"
+
+
+def default_filename(bill_data):
+    """Suggested file name for a bill, e.g. Acme_Gases_Bill_2026-01-31.pdf."""
+    return f"{bill_data['customer_name'].replace(' ', '_')}_Bill_{datetime.now().strftime('%Y-%m-%d')}.pdf"
+
+
+def write_pdf(file_path, bill_title, bill_data):
+    """Write a bill as a PDF file; returns the number of cylinders on it."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    doc = SimpleDocTemplate(file_path, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+
+    # Title
+    title_style = styles['Heading1']
+    title_style.alignment = 1  # Center
+    story.append(Paragraph(bill_title, title_style))
+    story.append(Spacer(1, 12))
+
+    # Company Title and Subtitle
+    story.append(Paragraph(COMPANY_TITLE, title_style))
+    story.append(Paragraph(COMPANY_SUBTITLE, styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Company Header
+    company_info = f"<b>Customer:</b> {bill_data['customer_name']}<br/>"
+    if bill_data['contact_info']:
+        company_info += f"<b>Contact:</b> {bill_data['contact_info']}<br/>"
+    if bill_data['address']:
+        company_info += f"<b>Address:</b> {bill_data['address']}<br/>"
+    story.append(Paragraph(company_info, styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Generated on
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Table data
+    data = [['DC Number', 'Cylinder ID', 'Type', 'Grade', 'Vehicle Number', 'Dispatch Date', 'Return Date', 'Status']]
+    total_cylinders = 0
+    dispatched_count = 0
+    returned_count = 0
+
+    for dc, disp_date, ret_date, status, cyl_id, cyl_type, grade, vehicle_number, disp_notes, ret_notes in bill_data['dispatches']:
+        data.append([dc, cyl_id, cyl_type, grade or '', vehicle_number or '', disp_date, ret_date or '', status])
+        total_cylinders += 1
+        if status == 'dispatched':
+            dispatched_count += 1
+        elif status == 'returned':
+            returned_count += 1
+
+    # Create table
+    table = Table(data)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(table)
+    story.append(Spacer(1, 12))
+
+    # Summary
+    summary = f"""
+    <b>Summary:</b><br/>
+    Total Cylinders: {total_cylinders}<br/>
+    Currently Dispatched: {dispatched_count}<br/>
+    Returned: {returned_count}
+    """
+    story.append(Paragraph(summary, styles['Normal']))
+
+    # Build PDF
+    doc.build(story)
+    return total_cylinders
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Cylinder catalog cache for Cylinder Management System
+Keeps every cylinder row in memory, keyed by database ID and by cylinder_id,
+with secondary indexes by status and by type, so lookups do not open a
+connection per call.
+
+database.py updates the cache write-through once its writes commit. Writes by
+other processes are noticed through PRAGMA data_version on a dedicated watcher
+connection, which changes whenever another connection commits; the cache is
+then reloaded in one query on the next lookup.
+
+data_version only tells that something changed since it was last read, not
+how often, so an own write is acknowledged only when nobody else committed
+around it: the watcher's version is stamped while the writing transaction
+holds the write lock and must match the cache's, and the writing connection's
+own data_version (which ignores its own commits) must not move between that
+stamp and the acknowledgement. Otherwise the cache is reloaded on the next
+lookup. Independently of that, rows are not served for longer than
+MAX_AGE_SECONDS without a reload.
+"""
+
+import threading
+import time
+
+MAX_AGE_SECONDS = 300
+
+# sqlite3.connect's default timeout, restored on the watcher after write stamps
+WATCHER_BUSY_TIMEOUT_MS = 5000
+
+# Rows per refresh query, keeping bound parameters under SQLite's 999 limit
+REFRESH_CHUNK_SIZE = 500
+
+
+class CylinderCatalog:
+    """Process-wide in-memory copy of the cylinders table."""
+    def __init__(self, database_file, connect, max_age=MAX_AGE_SECONDS):
+        self._database_file = database_file  # callable returning the current database path
+        self._connect = connect  # callable opening a connection usable from any thread
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._watched_file = None
+        self._loaded = False
+        self._version = None
+        self._acknowledged = None  # (version stamped, version acknowledged) of the last own write
+        self._loaded_at = 0.0
+        self._rows = {}
+        self._id_by_text = {}
+        self._by_status = {}
+        self._by_type = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Forget hit and reload counts."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.reloads = 0
+            self.external_changes = 0
+            self.write_through = 0
+
+    # Freshness
+    def _watch(self):
+        """The watcher connection, reopened (and the cache marked for reload) when the database file changed."""
+        path = self._database_file()
+        if self._watcher is None or self._watched_file != path:
+            if self._watcher is not None:
+                self._watcher.close()
+            self._watcher = self._connect()
+            self._watched_file = path
+            self._loaded = False
+        return self._watcher
+
+    def _data_version(self):
+        return self._watch().execute("PRAGMA data_version").fetchone()[0]
+
+    def _ensure_fresh(self):
+        """Reload when the cache is empty, stale or changed by another connection; count the lookup."""
+        version = self._data_version()
+        if self._loaded and version != self._version:
+            self.external_changes += 1
+        if not self._loaded or version != self._version or time.monotonic() - self._loaded_at > self.max_age:
+            self.misses += 1
+            self._load(version)
+        else:
+            self.hits += 1
+
+    def _load(self, version):
+        self._rows.clear()
+        self._id_by_text.clear()
+        self._by_status.clear()
+        self._by_type.clear()
+        for row in self._watcher.execute("SELECT * FROM cylinders"):
+            self._index(row)
+        self._version = version
+        self._loaded = True
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+
+    def _index(self, row):
+        self._unindex(row[0])
+        self._rows[row[0]] = row
+        self._id_by_text[row[1]] = row[0]
+        self._by_status.setdefault(row[3], set()).add(row[0])
+        self._by_type.setdefault(row[2], set()).add(row[0])
+
+    def _unindex(self, cylinder_id):
+        row = self._rows.pop(cylinder_id, None)
+        if row is not None:
+            self._id_by_text.pop(row[1], None)
+            self._by_status.get(row[3], set()).discard(cylinder_id)
+            self._by_type.get(row[2], set()).discard(cylinder_id)
+
+    def _sorted(self, ids):
+        return sorted((self._rows[cylinder_id] for cylinder_id in ids), key=lambda row: row[1])
+
+    # Lookups
+    def get(self, cylinder_id):
+        """Cylinder row by database ID, or None."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._rows.get(cylinder_id)
+
+    def find(self, input_id):
+        """Database ID for a database ID or cylinder_id text, or None (database ID first)."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._find(input_id)
+
+    def _find(self, input_id):
+        text = str(input_id).strip()
+        if text.isdecimal() and int(text) in self._rows:
+            return int(text)
+        return self._id_by_text.get(text)
+
+    def resolve(self, input_ids):
+        """(input_id, id, cylinder_id_text, cylinder_type, status) per input, None fields when unknown."""
+        with self._lock:
+            self._ensure_fresh()
+            resolved = []
+            for input_id in input_ids:
+                text = str(input_id).strip()
+                row = self._rows.get(self._find(text))
+                resolved.append((text, *row[:4]) if row else (text, None, None, None, None))
+            return resolved
+
+    def rows(self, status=None):
+        """All cylinder rows, or those with a status, ordered by cylinder_id."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._sorted(self._rows if status is None else self._by_status.get(status, ()))
+
+    def rows_by_type(self, cylinder_type):
+        """Cylinder rows of one type, ordered by cylinder_id."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._sorted(self._by_type.get(cylinder_type, ()))
+
+    def cylinder_ids(self):
+        """Set of all cylinder_id texts."""
+        with self._lock:
+            self._ensure_fresh()
+            return set(self._id_by_text)
+
+    # Write-through, called after the writing transaction has committed
+    def write_stamp(self, conn):
+        """Data versions to pass to put/remove/refresh, taken on conn after its transaction wrote.
+
+        The transaction then holds the write lock, so no other commit can land
+        until it commits. Returns None when they cannot be read, e.g. when the
+        transaction holds an exclusive lock in rollback journal mode; the
+        watcher does not wait for that lock, which only this commit releases.
+        """
+        with self._lock:
+            try:
+                watcher = self._watch()
+                watcher.execute("PRAGMA busy_timeout = 0")
+                try:
+                    version = watcher.execute("PRAGMA data_version").fetchone()[0]
+                finally:
+                    watcher.execute(f"PRAGMA busy_timeout = {WATCHER_BUSY_TIMEOUT_MS}")
+                return version, conn.execute("PRAGMA data_version").fetchone()[0]
+            except Exception:
+                return None
+
+    def _write_through(self, apply, conn, stamp):
+        """Apply an own committed write; on any failure fall back to a reload on the next lookup."""
+        with self._lock:
+            if not self._loaded:
+                return
+            try:
+                apply()
+                self._acknowledge(conn, stamp)
+            except Exception:
+                self._loaded = False
+
+    def _acknowledge(self, conn, stamp):
+        """Count an own write as applied so its commit does not look like an external change.
+
+        When another connection committed since the last lookup or after this
+        write, its changes are not in the cache, so it is marked for reload.
+        """
+        self.write_through += 1
+        if stamp is None:
+            self._loaded = False
+            return
+        version_before, conn_version_before = stamp
+        version = self._data_version()
+        # Read after the watcher: if nobody else committed up to now, the watcher saw only this commit
+        if conn.execute("PRAGMA data_version").fetchone()[0] != conn_version_before:
+            self._loaded = False
+        elif version_before == self._version or (version_before, version) == self._acknowledged:
+            # the second case is a further write of the transaction acknowledged last
+            self._acknowledged = (version_before, version)
+            self._version = version
+        else:
+            self._loaded = False
+
+    def put(self, rows, conn, stamp):
+        """Store changed or added cylinder rows."""
+        def apply():
+            for row in rows:
+                self._index(tuple(row))
+        self._write_through(apply, conn, stamp)
+
+    def remove(self, cylinder_ids, conn, stamp):
+        """Drop deleted cylinders."""
+        def apply():
+            for cylinder_id in cylinder_ids:
+                self._unindex(cylinder_id)
+        self._write_through(apply, conn, stamp)
+
+    def refresh(self, column, values, conn, stamp):
+        """Re-read the rows whose id or cylinder_id column is in values."""
+        assert column in ('id', 'cylinder_id')
+        values = list(values)
+
+        def apply():
+            self._watch()  # make sure the watcher points at the current database
+            found = set()
+            for start in range(0, len(values), REFRESH_CHUNK_SIZE):
+                chunk = values[start:start + REFRESH_CHUNK_SIZE]
+                for row in self._watcher.execute(
+                        f"SELECT * FROM cylinders WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk):
+                    self._index(row)
+                    found.add(row[0] if column == 'id' else row[1])
+            if column == 'id':
+                for cylinder_id in set(values) - found:
+                    self._unindex(cylinder_id)
+        self._write_through(apply, conn, stamp)
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        with self._lock:
+            self._loaded = False
+
+    # Metrics
+    def stats(self):
+        """Hit rate and reload counts as a JSON-serializable dictionary."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'cylinders': len(self._rows),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'reloads': self.reloads,
+                'external_changes': self.external_changes,
+                'write_through': self.write_through,
+            }
+
+    def to_prometheus(self):
+        """Render the cache metrics in the Prometheus text exposition format."""
+        stats = self.stats()
+        return (
+            '# HELP cms_catalog_lookups_total Cylinder catalog lookups by result.\n'
+            '# TYPE cms_catalog_lookups_total counter\n'
+            f'cms_catalog_lookups_total{{result="hit"}} {stats["hits"]}\n'
+            f'cms_catalog_lookups_total{{result="miss"}} {stats["misses"]}\n'
+            '# HELP cms_catalog_reloads_total Full reloads of the cylinder catalog.\n'
+            '# TYPE cms_catalog_reloads_total counter\n'
+            f'cms_catalog_reloads_total {stats["reloads"]}\n'
+            '# HELP cms_catalog_external_changes_total Commits by other connections noticed via data_version.\n'
+            '# TYPE cms_catalog_external_changes_total counter\n'
+            f'cms_catalog_external_changes_total {stats["external_changes"]}\n'
+            '# HELP cms_catalog_write_through_total Own writes applied to the catalog after commit.\n'
+            '# TYPE cms_catalog_write_through_total counter\n'
+            f'cms_catalog_write_through_total {stats["write_through"]}\n'
+            '# TYPE cms_catalog_cylinders gauge\n'
+            f'cms_catalog_cylinders {stats["cylinders"]}\n'
+        )
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Command line interface for Cylinder Management System
+Runs batch operations and reports without a display, e.g. from cron.
+
+    python -m cli [--db FILE | --depot NAME] COMMAND ...
+
+    dispatch FILE [--date DD-MM-YYYY] [--rejects FILE]
+    return FILE [--date DD-MM-YYYY] [--notes TEXT] [--rejects FILE]
+    intake FILE [--type PRODUCT] [--status STATUS] [--location TEXT] [--rejects FILE]
+    export {dispatches,cylinders} [--customer-id N] [--dc DC] [--status STATUS] [--output FILE.csv|FILE.xlsx]
+    bill (--dc DC | --customer-id N) [--output FILE.pdf]
+    aging [--as-of DD-MM-YYYY] [--customer-id N] [--open-only] [--summary] [--output FILE.csv]
+    analyze
+    vacuum
+    bench [NAME [ARG ...]]
+
+dispatch reads a CSV with a customer column (ID or name) and a cylinder ID
+column, and optional date, grade, vehicle, dc_number and notes columns.
+Consecutive rows with the same customer and DC details become one DC, so a
+file of any size is dispatched group by group. return and intake take a CSV
+with a cylinder ID column or a scanner dump, like the GUI's bulk intake.
+
+Exports and reports write CSV to standard output unless --output is given,
+row by row as they are read; progress and rejects go to standard error.
+The exit status is 0 on success, 1 on an error and 2 when some input rows
+were rejected. tkinter is never imported; openpyxl and reportlab only for
+.xlsx exports and bills. With CMS_SERVICE_URL set, operations go through
+the service like the GUI's.
+"""
+
+import argparse
+import csv
+import glob
+import importlib.util
+import os
+import sys
+from datetime import datetime
+from itertools import groupby
+
+import backend
+import database
+import intake
+
+RETURN_CHUNK_SIZE = 500
+
+CUSTOMER_COLUMNS = ('customer_id', 'customer id', 'customer')
+DATE_COLUMNS = ('dispatch_date', 'dispatch date', 'date')
+GRADE_COLUMNS = ('grade',)
+VEHICLE_COLUMNS = ('vehicle_number', 'vehicle number', 'vehicle')
+DC_COLUMNS = ('dc_number', 'dc number', 'dc')
+NOTES_COLUMNS = ('notes', 'dispatch_notes')
+
+DISPATCH_HEADER = ['id', 'dc_number', 'customer_id', 'cylinder_db_id', 'dispatch_date', 'return_date', 'dispatch_notes',
+                   'return_notes', 'status', 'grade', 'vehicle_number', 'created_at', 'customer', 'cylinder_id',
+                   'cylinder_type', 'source']
+CYLINDER_HEADER = ['id', 'cylinder_id', 'cylinder_type', 'status', 'location', 'created_at', 'updated_at']
+AGING_HEADER = ['dispatch_id', 'dc_number', 'customer_id', 'customer', 'cylinder_db_id', 'cylinder_id', 'cylinder_type',
+                'dispatch_date', 'return_date', 'status', 'days_out', 'bucket', 'rental_charge']
+AGING_SUMMARY_HEADER = (['customer_id', 'customer'] + [f"open_{label}_days" for label, _, _ in database.AGING_BUCKETS]
+                        + ['open_cylinders', 'total_days', 'rental_charges'])
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+
+def progress(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+class Rejects:
+    """Rejected input rows, reported on standard error and optionally written to a CSV file."""
+    def __init__(self):
+        self.rows = []
+
+    def add(self, line, cylinder_id, reason):
+        self.rows.append((line, cylinder_id, reason))
+        progress(f"line {line}: {cylinder_id}: {reason}")
+
+    def write(self, path):
+        if path:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['line', 'cylinder_id', 'reason'])
+                writer.writerows(self.rows)
+
+
+def open_output(path):
+    """Standard output for no path or '-', else the file."""
+    if not path or path == '-':
+        return sys.stdout
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def write_rows(path, header, rows, title='Sheet'):
+    """Write rows as CSV, or as an .xlsx workbook in write-only mode; returns the number written."""
+    count = 0
+    if path and path.lower().endswith('.xlsx'):
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(title)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(list(row))
+            count += 1
+        workbook.save(path)
+        return count
+    f = open_output(path)
+    try:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        else:
+            f.flush()
+    return count
+
+
+def read_dispatch_rows(lines):
+    """Parse a dispatch CSV into (line, customer, cylinder_id, date, grade, vehicle, dc_number, notes)."""
+    reader = csv.reader(lines)
+    header = next(reader, None) or []
+    customer_column = intake.find_column(header, CUSTOMER_COLUMNS)
+    id_column = intake.find_column(header, intake.ID_COLUMNS)
+    if customer_column is None or id_column is None:
+        raise ValueError("Dispatch CSV needs a customer column and a cylinder ID column")
+    columns = [customer_column, id_column] + [intake.find_column(header, names) for names in
+                                              (DATE_COLUMNS, GRADE_COLUMNS, VEHICLE_COLUMNS, DC_COLUMNS, NOTES_COLUMNS)]
+
+    def value(row, column):
+        if column is None or column >= len(row):
+            return ''
+        return row[column].strip()
+
+    for line_number, row in enumerate(reader, start=2):
+        if any(field.strip() for field in row):
+            yield (line_number, *(value(row, column) for column in columns))
+
+
+def _customer_lookup():
+    """Map customer IDs (as text) and lower-cased names to customer IDs, so rows may name the customer either way."""
+    customers = backend.get_all_customers()
+    lookup = {customer[1].strip().lower(): customer[0] for customer in customers}
+    lookup.update((str(customer[0]), customer[0]) for customer in customers)
+    return lookup
+
+
+def dispatch_from_csv(rows, default_date, rejects):
+    """Dispatch each group of consecutive rows with the same customer and DC details as one DC.
+
+    Prints one line per DC; returns the number of cylinders dispatched.
+    """
+    customers = _customer_lookup()
+    dispatched = 0
+    groups = groupby(rows, key=lambda row: (customers.get(row[1].lower()), *row[3:]))
+    for (customer_id, date, grade, vehicle, dc_number, notes), group in groups:
+        group = list(group)
+        if customer_id is None:
+            for line, customer, cylinder_id, *_ in group:
+                rejects.add(line, cylinder_id, f"unknown customer '{customer}'")
+            continue
+        accepted, seen = [], set()
+        resolved = backend.resolve_cylinders([row[2] for row in group])
+        for (line, _, cylinder_id, *_), (_, db_id, _, _, status) in zip(group, resolved):
+            if db_id is None:
+                rejects.add(line, cylinder_id, "unknown cylinder")
+            elif db_id in seen:
+                rejects.add(line, cylinder_id, "duplicate in input")
+            elif status != 'available':
+                rejects.add(line, cylinder_id, f"not available ({status})")
+            else:
+                seen.add(db_id)
+                accepted.append((line, cylinder_id, db_id))
+        if not accepted:
+            continue
+        try:
+            dc = backend.dispatch_cylinders(customer_id, [db_id for _, _, db_id in accepted], date or default_date,
+                                            notes, dc_number=dc_number or None, grade=grade, vehicle_number=vehicle)
+        except ValueError as e:
+            for line, cylinder_id, _ in accepted:
+                rejects.add(line, cylinder_id, str(e))
+            continue
+        dispatched += len(accepted)
+        print(f"{dc}\t{group[0][1]}\t{len(accepted)} cylinders", flush=True)
+    return dispatched
+
+
+def return_from_file(rows, return_date, notes, rejects):
+    """Return the listed cylinders from whatever DCs they are open under, RETURN_CHUNK_SIZE per transaction.
+
+    Prints one line per DC and chunk; returns the number of cylinders returned.
+    """
+    returned = 0
+    rows = iter(rows)
+    while True:
+        chunk = [(line, cylinder_id) for line, cylinder_id, *_ in _take(rows, RETURN_CHUNK_SIZE)]
+        if not chunk:
+            return returned
+        accepted, seen = [], set()
+        for (line, cylinder_id), (_, db_id, _, _, status) in zip(chunk, backend.resolve_cylinders([row[1] for row in chunk])):
+            if db_id is None:
+                rejects.add(line, cylinder_id, "unknown cylinder")
+            elif db_id in seen:
+                rejects.add(line, cylinder_id, "duplicate in input")
+            elif status != 'dispatched':
+                rejects.add(line, cylinder_id, f"not dispatched ({status})")
+            else:
+                seen.add(db_id)
+                accepted.append((line, cylinder_id, db_id))
+        if not accepted:
+            continue
+        try:
+            by_dc = backend.return_dispatched_cylinders([db_id for _, _, db_id in accepted], return_date, notes)
+        except ValueError as e:
+            for line, cylinder_id, _ in accepted:
+                rejects.add(line, cylinder_id, str(e))
+            continue
+        returned += len(accepted)
+        for dc, cylinder_ids in by_dc.items():
+            print(f"{dc}\t{len(cylinder_ids)} cylinders returned", flush=True)
+
+
+def _take(iterator, count):
+    for _, item in zip(range(count), iterator):
+        yield item
+
+
+def cmd_dispatch(args):
+    rejects = Rejects()
+    with open(args.file, newline='', encoding='utf-8-sig') as f:
+        dispatched = dispatch_from_csv(read_dispatch_rows(f), args.date, rejects)
+    rejects.write(args.rejects)
+    progress(f"{dispatched} cylinder(s) dispatched, {len(rejects.rows)} rejected")
+    return 2 if rejects.rows else 0
+
+
+def cmd_return(args):
+    rejects = Rejects()
+    returned = return_from_file(intake.read_file(args.file), args.date, args.notes, rejects)
+    rejects.write(args.rejects)
+    progress(f"{returned} cylinder(s) returned, {len(rejects.rows)} rejected")
+    return 2 if rejects.rows else 0
+
+
+def cmd_intake(args):
+    result = intake.bulk_intake(intake.read_file(args.file), args.type, args.status, args.location,
+                                progress=lambda processed: progress(f"{processed} rows processed"))
+    for line, cylinder_id, reason in result.rejected:
+        progress(f"line {line}: {cylinder_id}: {reason}")
+    if args.rejects:
+        intake.write_rejects(result, args.rejects)
+    progress(result.summary())
+    return 2 if result.rejected else 0
+
+
+def cmd_export(args):
+    if args.table == 'dispatches':
+        if backend.client is None:
+            rows = database.iter_dispatch_history(customer_id=args.customer_id, dc_number=args.dc)
+        else:
+            rows = backend.get_dispatch_history(customer_id=args.customer_id, dc_number=args.dc)
+        count = write_rows(args.output, DISPATCH_HEADER, rows, 'Dispatch History')
+    else:
+        rows = backend.get_cylinders_by_status(args.status) if args.status else backend.get_all_cylinders()
+        count = write_rows(args.output, CYLINDER_HEADER, rows, 'Cylinders')
+    progress(f"{count} {args.table} exported")
+    return 0
+
+
+def cmd_bill(args):
+    import bills
+    if args.dc:
+        bill_data = backend.get_bill_data_for_dc(args.dc)
+        title = bills.dc_bill_title(args.dc, bill_data) if bill_data else None
+    else:
+        bill_data = backend.get_bill_data_for_company(args.customer_id)
+        title = bills.company_bill_title(bill_data) if bill_data else None
+    if not bill_data:
+        raise ValueError("No dispatches found for the bill")
+    path = args.output or bills.default_filename(bill_data)
+    count = bills.write_pdf(path, title, bill_data)
+    progress(f"{title}: {count} cylinders, saved to {path}")
+    return 0
+
+
+def cmd_aging(args):
+    if args.summary:
+        count = write_rows(args.output, AGING_SUMMARY_HEADER, backend.get_customer_aging_summary(args.as_of), 'Aging Summary')
+    else:
+        rows = backend.get_cylinder_aging(args.as_of, customer_id=args.customer_id, open_only=args.open_only)
+        count = write_rows(args.output, AGING_HEADER, rows, 'Aging')
+    progress(f"{count} rows")
+    return 0
+
+
+def cmd_analyze(args):
+    database.analyze_database()
+    progress(f"Analyzed {database.DATABASE_FILE}")
+    return 0
+
+
+def cmd_vacuum(args):
+    before, after = database.vacuum_database()
+    progress(f"Vacuumed {database.DATABASE_FILE}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return 0
+
+
+def benchmarks():
+    """{name: path} of the scripts in benchmarks/ (bench_async_clerks.py is 'async_clerks')."""
+    paths = sorted(glob.glob(os.path.join(BENCHMARKS_DIR, 'bench_*.py')))
+    return {os.path.basename(path)[len('bench_'):-len('.py')]: path for path in paths}
+
+
+def cmd_bench(args):
+    available = benchmarks()
+    if not args.name:
+        for name, path in available.items():
+            print(f"{name:<20} {os.path.relpath(path)}")
+        return 0
+    if args.name not in available:
+        raise ValueError(f"Unknown benchmark '{args.name}' (one of {', '.join(available)})")
+    spec = importlib.util.spec_from_file_location(f"bench_{args.name}", available[args.name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.main(args.args) or 0
+
+
+COMMANDS = {
+    'dispatch': cmd_dispatch, 'return': cmd_return, 'intake': cmd_intake, 'export': cmd_export, 'bill': cmd_bill,
+    'aging': cmd_aging, 'analyze': cmd_analyze, 'vacuum': cmd_vacuum, 'bench': cmd_bench,
+}
+
+
+def build_parser():
+    today = datetime.now().strftime('%d-%m-%Y')
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Cylinder Management System batch operations and reports")
+    parser.add_argument('--db', help="database file")
+    parser.add_argument('--depot', help="use this depot's database from the depot registry")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dispatch = commands.add_parser('dispatch', help="dispatch the cylinders listed in a CSV")
+    dispatch.add_argument('file')
+    dispatch.add_argument('--date', default=today, help="dispatch date for rows without one (DD-MM-YYYY)")
+    dispatch.add_argument('--rejects', help="write rejected rows to this CSV")
+
+    return_parser = commands.add_parser('return', help="return the listed cylinders")
+    return_parser.add_argument('file')
+    return_parser.add_argument('--date', default=today, help="return date (DD-MM-YYYY)")
+    return_parser.add_argument('--notes', default='', help="return notes")
+    return_parser.add_argument('--rejects', help="write rejected rows to this CSV")
+
+    intake_parser = commands.add_parser('intake', help="add cylinders from a CSV or scanner dump")
+    intake_parser.add_argument('file')
+    intake_parser.add_argument('--type', default='', help="product for rows without one")
+    intake_parser.add_argument('--status', default='available', choices=intake.INTAKE_STATUSES)
+    intake_parser.add_argument('--location', default='')
+    intake_parser.add_argument('--rejects', help="write rejected rows to this CSV")
+
+    export = commands.add_parser('export', help="export dispatch history or cylinders")
+    export.add_argument('table', choices=['dispatches', 'cylinders'])
+    export.add_argument('--customer-id', type=int, help="dispatches of one customer")
+    export.add_argument('--dc', help="dispatches of one DC")
+    export.add_argument('--status', help="cylinders with this status")
+    export.add_argument('--output', help="CSV or .xlsx file (default standard output)")
+
+    bill = commands.add_parser('bill', help="write a PDF bill")
+    target = bill.add_mutually_exclusive_group(required=True)
+    target.add_argument('--dc', help="bill one DC")
+    target.add_argument('--customer-id', type=int, help="bill every dispatch of a customer")
+    bill.add_argument('--output', help="PDF file (default <customer>_Bill_<date>.pdf)")
+
+    aging = commands.add_parser('aging', help="cylinder aging and rental charges")
+    aging.add_argument('--as-of', help="as-of date (DD-MM-YYYY, default today)")
+    aging.add_argument('--customer-id', type=int)
+    aging.add_argument('--open-only', action='store_true', help="only cylinders not returned by the as-of date")
+    aging.add_argument('--summary', action='store_true', help="one row per customer")
+    aging.add_argument('--output', help="CSV or .xlsx file (default standard output)")
+
+    commands.add_parser('analyze', help="refresh query planner statistics")
+    commands.add_parser('vacuum', help="rebuild the database file to reclaim space")
+
+    bench = commands.add_parser('bench', help="list benchmarks or run one")
+    bench.add_argument('name', nargs='?')
+    bench.add_argument('args', nargs=argparse.REMAINDER, help="arguments for the benchmark")
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point."""
+    args = build_parser().parse_args(argv)
+    try:
+        if args.command != 'bench':
+            if args.depot:
+                import depots
+                database.DATABASE_FILE = depots.depot_file(args.depot)
+            elif args.db:
+                database.DATABASE_FILE = args.db
+            backend.init_backend()
+        return COMMANDS[args.command](args)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except ImportError as e:
+        print(f"Error: {e.name} is required for this command (pip install {e.name})", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,33 +6,160 @@ Handles SQLite database operations and schema management.
 
 import sqlite3
 import os
+from contextlib import contextmanager
 from datetime import datetime
+import instrumentation
+import turnaround
+import catalog
+import migrations
 
 DATABASE_FILE = "cylinder_management.db"
 
-def get_connection():
-    """Get database connection."""
-    return sqlite3.connect(DATABASE_FILE)
+# Allowed cylinder status changes, enforced by triggers on the cylinders table.
+# 'new' lists the statuses a cylinder may be added with. Existing databases
+# only pick up changes here through a new migration step.
+CYLINDER_STATUS_TRANSITIONS = [
+    ('new', 'available'), ('new', 'returned'), ('new', 'refill'), ('new', 'maintenance'),
+    ('available', 'dispatched'),
+    ('dispatched', 'returned'),
+    ('returned', 'refill'), ('returned', 'maintenance'),
+    ('refill', 'available'), ('maintenance', 'available'),
+    ('available', 'in_transit'), ('in_transit', 'available'),
+    ('in_transit', 'transferred'), ('transferred', 'in_transit'),
+]
 
-def generate_dc_number():
-    """Generate the next available DC number as the highest existing incremented by 1."""
+# Dispatch and return dates are stored as zero-padded DD-MM-YYYY text
+PADDED_DATE_GLOB = '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]'
+
+# Statuses tracked as refill/maintenance work queue stages
+WORK_STAGES = ('refill', 'maintenance')
+
+# Tables of the change capture log itself, never replicated
+REPLICATION_TABLES = ('replicas', 'change_log')
+
+def get_connection(database_file=None, **kwargs):
+    """Get database connection (instrumented when CMS_QUERY_STATS is set).
+
+    database_file defaults to DATABASE_FILE; depots.py passes a depot's file.
+    """
+    if instrumentation.ENABLED:
+        return instrumentation.connect(database_file or DATABASE_FILE, **kwargs)
+    return sqlite3.connect(database_file or DATABASE_FILE, **kwargs)
+
+def enable_wal():
+    """Switch the database to WAL journaling so readers do not wait for the writer."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT dc_number FROM dispatches WHERE dc_number LIKE 'DC%' ORDER BY CAST(SUBSTR(dc_number, 3) AS INTEGER) DESC LIMIT 1")
-    result = cursor.fetchone()
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.close()
-    if result:
-        dc_str = result[0]
-        try:
-            num = int(dc_str[2:])
-            return f"DC{num + 1:03d}"
-        except ValueError:
-            pass
-    return "DC001"
 
-def init_database():
-    """Initialize database and create tables if they don't exist."""
+# Callbacks waiting for the transaction on a connection to commit (cache write-through)
+_commit_callbacks = {}
+
+def _after_commit(conn, callback):
+    """Run callback once conn's current transaction has committed; it is dropped on rollback."""
+    _commit_callbacks.setdefault(conn, []).append(callback)
+
+def commit_callback_mark(conn):
+    """Number of callbacks waiting on conn, for rolling back to a savepoint."""
+    return len(_commit_callbacks.get(conn, ()))
+
+def discard_commit_callbacks(conn, mark=0):
+    """Drop the callbacks registered on conn after mark (after ROLLBACK or ROLLBACK TO)."""
+    callbacks = _commit_callbacks.get(conn)
+    if callbacks is not None:
+        del callbacks[mark:]
+        if not callbacks:
+            del _commit_callbacks[conn]
+
+def run_commit_callbacks(conn):
+    """Run the callbacks waiting on conn; call right after its transaction commits."""
+    for callback in _commit_callbacks.pop(conn, []):
+        callback()
+
+@contextmanager
+def _transaction(conn=None):
+    """Yield a connection for an operation.
+
+    When the caller passes its own connection (e.g. the service writer or a
+    pooled connection) the work joins the caller's transaction and is neither
+    committed nor closed here; otherwise a new connection is opened, committed
+    on success and closed (rolling back) on error.
+    """
+    if conn is not None:
+        yield conn
+        return
     conn = get_connection()
+    try:
+        yield conn
+        conn.commit()
+        run_commit_callbacks(conn)
+    finally:
+        discard_commit_callbacks(conn)
+        conn.close()
+
+# Cylinder catalog cache (see catalog.py), disabled with CMS_CATALOG_CACHE=0
+CATALOG_ENABLED = os.environ.get('CMS_CATALOG_CACHE', '1') != '0'
+cylinder_catalog = catalog.CylinderCatalog(lambda: DATABASE_FILE, lambda: get_connection(check_same_thread=False))
+
+def _catalog_for(conn):
+    """The catalog when it may answer a read on conn (no transaction in progress), else None."""
+    if CATALOG_ENABLED and (conn is None or not conn.in_transaction):
+        return cylinder_catalog
+    return None
+
+def _catalog_put(conn, rows):
+    if CATALOG_ENABLED and rows:
+        stamp = cylinder_catalog.write_stamp(conn)
+        _after_commit(conn, lambda: cylinder_catalog.put(rows, conn, stamp))
+
+def _catalog_remove(conn, cylinder_ids):
+    if CATALOG_ENABLED and cylinder_ids:
+        stamp = cylinder_catalog.write_stamp(conn)
+        _after_commit(conn, lambda: cylinder_catalog.remove(cylinder_ids, conn, stamp))
+
+def _catalog_refresh(conn, column, values):
+    if CATALOG_ENABLED and values:
+        stamp = cylinder_catalog.write_stamp(conn)
+        _after_commit(conn, lambda: cylinder_catalog.refresh(column, values, conn, stamp))
+
+def get_catalog_stats(conn=None):
+    """Get the cylinder catalog cache hit rate and reload counts."""
+    return cylinder_catalog.stats()
+
+def generate_dc_number(conn=None):
+    """Generate the next DC number as the highest ever issued incremented by 1.
+
+    Archived DCs count too (through dc_counter), so their numbers are not reissued.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MAX(COALESCE((SELECT last_seq FROM dc_counter), 0),
+                       COALESCE((SELECT MAX(dc_seq) FROM delivery_challans), 0))
+        ''')
+        result = cursor.fetchone()
+    return f"DC{result[0] + 1:03d}"
+
+def init_database(database_file=None):
+    """Create or upgrade the database schema; a current database costs one pragma read."""
+    conn = get_connection(database_file)
+    try:
+        migrations.migrate(conn, MIGRATIONS)
+    finally:
+        conn.close()
+
+def get_schema_version(conn=None):
+    """Get (current, latest) schema versions."""
+    with _transaction(conn) as conn:
+        return migrations.schema_version(conn), MIGRATIONS[-1][0]
+
+# Schema migrations, applied in order by init_database (see migrations.py).
+# Databases created before versioning start at 0 and run every step, so each
+# step is idempotent. Never edit a released step; append a new one instead.
+# A step that creates a table must also call _capture_changes on it so
+# reporting replicas receive its rows.
+def _migrate_core_tables(conn):
+    """Customers, cylinders, dispatches and users with the default admin user."""
     cursor = conn.cursor()
 
     # Create customers table
@@ -75,31 +202,12 @@ def init_database():
             status TEXT NOT NULL DEFAULT 'dispatched',
             grade TEXT NOT NULL DEFAULT '',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (dc_number) REFERENCES delivery_challans (dc_number),
             FOREIGN KEY (customer_id) REFERENCES customers (id),
             FOREIGN KEY (cylinder_id) REFERENCES cylinders (id)
         )
     ''')
 
-    # Update existing NULL grades to empty string
-    cursor.execute("UPDATE dispatches SET grade = '' WHERE grade IS NULL")
-
-    # Add grade column with NOT NULL if it doesn't exist (for existing databases)
-    try:
-        cursor.execute("ALTER TABLE dispatches ADD COLUMN grade TEXT NOT NULL DEFAULT ''")
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-        # Ensure NOT NULL constraint by recreating table if needed
-        try:
-            cursor.execute("UPDATE dispatches SET grade = '' WHERE grade IS NULL")
-        except:
-            pass
-
-    # Add vehicle_number column if it doesn't exist
-    try:
-        cursor.execute("ALTER TABLE dispatches ADD COLUMN vehicle_number TEXT NOT NULL DEFAULT ''")
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-
     # Create users table for authentication
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -118,317 +226,1889 @@ def init_database():
         cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
                       ('admin', 'admin123', 'admin'))
 
-    conn.commit()
-    conn.close()
+def _migrate_dispatch_columns(conn):
+    """Add the grade and vehicle_number columns to dispatches of old databases."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(dispatches)")
+    existing = {row[1] for row in cursor.fetchall()}
+    if 'grade' not in existing:
+        cursor.execute("ALTER TABLE dispatches ADD COLUMN grade TEXT NOT NULL DEFAULT ''")
+    if 'vehicle_number' not in existing:
+        cursor.execute("ALTER TABLE dispatches ADD COLUMN vehicle_number TEXT NOT NULL DEFAULT ''")
 
-# Customer operations
-def add_customer(name, contact_info, address, notes):
-    """Add a new customer."""
-    conn = get_connection()
+def _migrate_blank_grades(conn):
+    """Replace NULL grades left by old databases with empty strings, in resumable chunks."""
+    migrations.backfill(conn, 'dispatches', "grade = ''", "grade IS NULL")
+
+def _migrate_delivery_challans(conn):
+    """DC header table with its triggers; rebuilds dispatches of old databases to reference it."""
     cursor = conn.cursor()
+
+    # Create delivery challan headers (one row per DC in dispatches, kept current by triggers)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'delivery_challans'")
+    challans_exist = cursor.fetchone() is not None
     cursor.execute('''
-        INSERT INTO customers (name, contact_info, address, notes)
-        VALUES (?, ?, ?, ?)
-    ''', (name, contact_info, address, notes))
-    customer_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return customer_id
+        CREATE TABLE IF NOT EXISTS delivery_challans (
+            dc_number TEXT PRIMARY KEY,
+            dc_seq INTEGER,
+            customer_id INTEGER NOT NULL,
+            vehicle_number TEXT NOT NULL DEFAULT '',
+            grade TEXT NOT NULL DEFAULT '',
+            dispatch_date DATE,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            open_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (customer_id) REFERENCES customers (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_delivery_challans_seq ON delivery_challans (dc_seq, dc_number)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_delivery_challans_open ON delivery_challans (dc_seq, dc_number) WHERE open_count > 0")
+    cursor.execute("PRAGMA foreign_key_list(dispatches)")
+    if 'delivery_challans' not in [row[2] for row in cursor.fetchall()]:
+        _rebuild_dispatches_table(cursor)
+    if not challans_exist:
+        _rebuild_delivery_challans(cursor)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dispatches_dc_number ON dispatches (dc_number)")
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS dispatches_challan_insert
+        BEFORE INSERT ON dispatches
+        BEGIN
+            INSERT INTO delivery_challans (dc_number, dc_seq, customer_id, vehicle_number, grade, dispatch_date, line_count, open_count)
+            VALUES (NEW.dc_number, {_dc_seq_sql('NEW.dc_number')}, NEW.customer_id, COALESCE(NEW.vehicle_number, ''),
+                    COALESCE(NEW.grade, ''), NEW.dispatch_date, 1, NEW.status = 'dispatched')
+            ON CONFLICT(dc_number) DO UPDATE SET line_count = line_count + 1, open_count = open_count + excluded.open_count;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dispatches_challan_update
+        AFTER UPDATE OF status ON dispatches
+        WHEN NEW.status IS NOT OLD.status
+        BEGIN
+            UPDATE delivery_challans
+            SET open_count = open_count + (NEW.status = 'dispatched') - (OLD.status = 'dispatched')
+            WHERE dc_number = NEW.dc_number;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dispatches_challan_delete
+        AFTER DELETE ON dispatches
+        BEGIN
+            UPDATE delivery_challans
+            SET line_count = line_count - 1, open_count = open_count - (OLD.status = 'dispatched')
+            WHERE dc_number = OLD.dc_number;
+            DELETE FROM delivery_challans WHERE dc_number = OLD.dc_number AND line_count <= 0;
+        END
+    ''')
 
-def get_all_customers():
-    """Get all customers."""
-    conn = get_connection()
+def _migrate_dispatch_archive(conn):
+    """Archive table for completed DCs."""
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM customers ORDER BY name")
-    customers = cursor.fetchall()
-    conn.close()
-    return customers
 
-def update_customer(customer_id, name, contact_info, address, notes):
-    """Update customer information."""
-    conn = get_connection()
+    # Create dispatch archive table (completed DCs, append-only, scanned sequentially)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dispatch_archive (
+            id INTEGER PRIMARY KEY,
+            dc_number TEXT NOT NULL,
+            customer_id INTEGER NOT NULL,
+            cylinder_id INTEGER NOT NULL,
+            dispatch_date DATE NOT NULL,
+            return_date DATE,
+            dispatch_notes TEXT,
+            return_notes TEXT,
+            status TEXT NOT NULL,
+            grade TEXT NOT NULL DEFAULT '',
+            vehicle_number TEXT NOT NULL DEFAULT '',
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migrate_customer_holdings(conn):
+    """Customer holdings ledger, seeded from dispatches."""
     cursor = conn.cursor()
+
+    # Create customer holdings ledger (cylinders currently held per customer and type)
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'customer_holdings'")
+    holdings_exist = cursor.fetchone()[0] > 0
     cursor.execute('''
-        UPDATE customers
-        SET name = ?, contact_info = ?, address = ?, notes = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (name, contact_info, address, notes, customer_id))
-    conn.commit()
-    conn.close()
+        CREATE TABLE IF NOT EXISTS customer_holdings (
+            customer_id INTEGER NOT NULL,
+            cylinder_type TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (customer_id, cylinder_type)
+        ) WITHOUT ROWID
+    ''')
+    if not holdings_exist:
+        _rebuild_customer_holdings(cursor)
 
-def delete_customer(customer_id):
-    """Delete a customer."""
-    conn = get_connection()
+def _migrate_rental_rates(conn):
+    """Daily rental rates per cylinder type."""
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM customers WHERE id = ?", (customer_id,))
-    conn.commit()
-    conn.close()
 
-def search_customers(query):
-    """Search customers by name or contact info."""
-    conn = get_connection()
+    # Create rental rates table (daily rental charged per cylinder type)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rental_rates (
+            cylinder_type TEXT PRIMARY KEY,
+            daily_rate REAL NOT NULL DEFAULT 0,
+            free_days INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migrate_status_transitions(conn):
+    """Cylinder status state machine enforced by triggers."""
     cursor = conn.cursor()
+
+    # Create cylinder status state machine
     cursor.execute('''
-        SELECT * FROM customers
-        WHERE name LIKE ? OR contact_info LIKE ?
-        ORDER BY name
-    ''', (f'%{query}%', f'%{query}%'))
-    customers = cursor.fetchall()
-    conn.close()
-    return customers
+        CREATE TABLE IF NOT EXISTS cylinder_status_transitions (
+            from_status TEXT NOT NULL,
+            to_status TEXT NOT NULL,
+            PRIMARY KEY (from_status, to_status)
+        ) WITHOUT ROWID
+    ''')
+    cursor.executemany("INSERT OR IGNORE INTO cylinder_status_transitions (from_status, to_status) VALUES (?, ?)",
+                       CYLINDER_STATUS_TRANSITIONS)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cylinders_status_insert
+        BEFORE INSERT ON cylinders
+        WHEN NOT EXISTS (SELECT 1 FROM cylinder_status_transitions WHERE from_status = 'new' AND to_status = NEW.status)
+        BEGIN
+            SELECT RAISE(ABORT, 'Invalid initial cylinder status');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cylinders_status_update
+        BEFORE UPDATE OF status ON cylinders
+        WHEN NOT EXISTS (SELECT 1 FROM cylinder_status_transitions WHERE from_status = OLD.status AND to_status = NEW.status)
+        BEGIN
+            SELECT RAISE(ABORT, 'Invalid cylinder status transition');
+        END
+    ''')
+
+def _migrate_work_queue(conn):
+    """Status event log and refill/maintenance work queue."""
+    cursor = conn.cursor()
+
+    # Create status event log and refill/maintenance work queue
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'cylinder_status_events'")
+    new_event_log = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cylinder_status_events (
+            id INTEGER PRIMARY KEY,
+            cylinder_id INTEGER NOT NULL,
+            from_status TEXT,
+            to_status TEXT NOT NULL,
+            event_time TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_events_cylinder ON cylinder_status_events (cylinder_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_events_to_status ON cylinder_status_events (to_status, event_time)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS work_queue_stats (
+            stage TEXT PRIMARY KEY,
+            depth INTEGER NOT NULL DEFAULT 0,
+            entered INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            wait_seconds REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.executemany("INSERT OR IGNORE INTO work_queue_stats (stage) VALUES (?)", [(stage,) for stage in WORK_STAGES])
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS work_queue_daily (
+            day TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            entered INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            wait_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, stage)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS work_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stage TEXT NOT NULL,
+            notes TEXT,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+            completed_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS work_batch_items (
+            batch_id INTEGER NOT NULL,
+            cylinder_id INTEGER NOT NULL,
+            PRIMARY KEY (batch_id, cylinder_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_work_batch_items_cylinder ON work_batch_items (cylinder_id)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cylinders_status_event_insert
+        AFTER INSERT ON cylinders
+        BEGIN
+            INSERT INTO cylinder_status_events (cylinder_id, from_status, to_status) VALUES (NEW.id, 'new', NEW.status);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cylinders_status_event_update
+        AFTER UPDATE OF status ON cylinders
+        WHEN NEW.status IS NOT OLD.status
+        BEGIN
+            INSERT INTO cylinder_status_events (cylinder_id, from_status, to_status) VALUES (NEW.id, OLD.status, NEW.status);
+        END
+    ''')
+    # Keep the work queue aggregates up to date one event at a time
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS status_events_work_queue
+        AFTER INSERT ON cylinder_status_events
+        BEGIN
+            UPDATE work_queue_stats SET depth = depth + 1, entered = entered + 1 WHERE stage = NEW.to_status;
+            INSERT INTO work_queue_daily (day, stage, entered)
+            SELECT date(NEW.event_time), NEW.to_status, 1 WHERE NEW.to_status IN (SELECT stage FROM work_queue_stats)
+            ON CONFLICT(day, stage) DO UPDATE SET entered = entered + 1;
+
+            UPDATE work_queue_stats SET depth = depth - 1, completed = completed + 1,
+                wait_seconds = wait_seconds + {_stage_wait_sql()}
+            WHERE stage = NEW.from_status;
+            INSERT INTO work_queue_daily (day, stage, completed, wait_seconds)
+            SELECT date(NEW.event_time), NEW.from_status, 1, {_stage_wait_sql()}
+            WHERE NEW.from_status IN (SELECT stage FROM work_queue_stats)
+            ON CONFLICT(day, stage) DO UPDATE SET completed = completed + 1, wait_seconds = wait_seconds + excluded.wait_seconds;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cylinders_delete_work_queue
+        AFTER DELETE ON cylinders
+        BEGIN
+            UPDATE work_queue_stats SET depth = depth - 1 WHERE stage = OLD.status;
+            DELETE FROM work_batch_items WHERE cylinder_id = OLD.id;
+        END
+    ''')
+    if new_event_log:
+        # Start the log from the current status of every cylinder
+        cursor.execute("INSERT INTO cylinder_status_events (cylinder_id, from_status, to_status) SELECT id, NULL, status FROM cylinders")
+
+def _migrate_dashboard_counters(conn):
+    """Dashboard counters maintained by triggers."""
+    cursor = conn.cursor()
+
+    # Create dashboard counters, kept current by triggers on cylinders and dispatches
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'dashboard_counters'")
+    counters_exist = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_counters (
+            counter TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (counter, key)
+        ) WITHOUT ROWID
+    ''')
+    counter_triggers = {
+        'cylinders_counters_insert': ('AFTER INSERT ON cylinders', None, [
+            ('status', 'NEW.status', 1), ('type', 'NEW.cylinder_type', 1)]),
+        'cylinders_counters_delete': ('AFTER DELETE ON cylinders', None, [
+            ('status', 'OLD.status', -1), ('type', 'OLD.cylinder_type', -1)]),
+        'cylinders_counters_update': ('AFTER UPDATE OF status, cylinder_type ON cylinders', None, [
+            ('status', 'NEW.status', 1), ('status', 'OLD.status', -1),
+            ('type', 'NEW.cylinder_type', 1), ('type', 'OLD.cylinder_type', -1)]),
+        'dispatches_counters_open_insert': ('AFTER INSERT ON dispatches', "NEW.status = 'dispatched'", [
+            ('customer_out', 'NEW.customer_id', 1)]),
+        'dispatches_counters_open_delete': ('AFTER DELETE ON dispatches', "OLD.status = 'dispatched'", [
+            ('customer_out', 'OLD.customer_id', -1)]),
+        'dispatches_counters_open_update': ('AFTER UPDATE OF status ON dispatches', "NEW.status IS NOT OLD.status", [
+            ('customer_out', "CASE WHEN NEW.status = 'dispatched' THEN NEW.customer_id END", 1),
+            ('customer_out', "CASE WHEN OLD.status = 'dispatched' THEN OLD.customer_id END", -1)]),
+    }
+    for name, (event, condition, changes) in counter_triggers.items():
+        body = "\n".join(_counter_change_sql(counter, key, delta) for counter, key, delta in changes)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            {f"WHEN {condition}" if condition else ""}
+            BEGIN
+                {body}
+            END
+        ''')
+    if not counters_exist:
+        _rebuild_dashboard_counters(cursor)
+
+def _migrate_open_dispatch_index(conn):
+    """Index open dispatches by cylinder for return lookups."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dispatches_open_cylinder ON dispatches (cylinder_id) WHERE status = 'dispatched'")
+
+def _capture_changes(cursor, table):
+    """Log the primary key of every row changed in table while a replica is registered (see replica.py)."""
+    keys = [row[1] for row in sorted(cursor.execute(f"PRAGMA table_info({table})").fetchall(), key=lambda row: row[5]) if row[5]]
+    if not keys:
+        return
+
+    def key_sql(prefix):
+        return f"json_array({', '.join(f'{prefix}.{key}' for key in keys)})"
+
+    log = "INSERT INTO change_log (table_name, row_key)"
+    for name, event, body in (
+            ('insert', 'AFTER INSERT', f"{log} VALUES ('{table}', {key_sql('NEW')});"),
+            ('update', 'AFTER UPDATE', f"{log} VALUES ('{table}', {key_sql('OLD')});\n"
+                                       f"{log} SELECT '{table}', {key_sql('NEW')} WHERE {key_sql('NEW')} IS NOT {key_sql('OLD')};"),
+            ('delete', 'AFTER DELETE', f"{log} VALUES ('{table}', {key_sql('OLD')});")):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_capture_{name}
+            {event} ON {table}
+            WHEN EXISTS (SELECT 1 FROM replicas)
+            BEGIN
+                {body}
+            END
+        ''')
+
+def _migrate_change_log(conn):
+    """Change capture log for reporting replicas."""
+    cursor = conn.cursor()
+
+    # Create the change log; rows are only logged while a replica is registered
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS replicas (
+            path TEXT PRIMARY KEY,
+            applied_seq INTEGER NOT NULL DEFAULT 0,
+            shipped_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT IN (?, ?)",
+                   REPLICATION_TABLES)
+    for (table,) in cursor.fetchall():
+        _capture_changes(cursor, table)
+
+def _migrate_depot_transfers(conn):
+    """Two-phase cylinder transfers between depot databases."""
+    cursor = conn.cursor()
+
+    # Cylinders are held 'in_transit' while a transfer is prepared and left 'transferred' at the sending depot
+    cursor.executemany("INSERT OR IGNORE INTO cylinder_status_transitions (from_status, to_status) VALUES (?, ?)",
+                       CYLINDER_STATUS_TRANSITIONS)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS depot_transfers (
+            transfer_id TEXT PRIMARY KEY,
+            direction TEXT NOT NULL CHECK (direction IN ('out', 'in')),
+            depot TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'prepared' CHECK (state IN ('prepared', 'committed', 'aborted')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS depot_transfer_items (
+            transfer_id TEXT NOT NULL REFERENCES depot_transfers (transfer_id),
+            cylinder_id INTEGER NOT NULL,
+            previous_status TEXT,
+            PRIMARY KEY (transfer_id, cylinder_id)
+        ) WITHOUT ROWID
+    ''')
+    _capture_changes(cursor, 'depot_transfers')
+    _capture_changes(cursor, 'depot_transfer_items')
+
+def _migrate_dc_counter(conn):
+    """Last DCnnn number issued, kept when archiving deletes a DC's header."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dc_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO dc_counter (id, last_seq)
+        SELECT 1, COALESCE(MAX(seq), 0) FROM (
+            SELECT dc_seq AS seq FROM delivery_challans
+            UNION ALL
+            SELECT {_dc_seq_sql('dc_number')} FROM dispatch_archive
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS delivery_challans_dc_counter
+        AFTER INSERT ON delivery_challans
+        WHEN NEW.dc_seq IS NOT NULL
+        BEGIN
+            UPDATE dc_counter SET last_seq = NEW.dc_seq WHERE NEW.dc_seq > last_seq;
+        END
+    ''')
+    _capture_changes(cursor, 'dc_counter')
+
+def _migrate_padded_dates(conn):
+    """Zero-pad DD-MM-YYYY dates stored unpadded before dates were normalized on write (1-2-2026)."""
+    cursor = conn.cursor()
+    for table, column in (('dispatches', 'dispatch_date'), ('dispatches', 'return_date'),
+                          ('dispatch_archive', 'dispatch_date'), ('dispatch_archive', 'return_date'),
+                          ('delivery_challans', 'dispatch_date')):
+        cursor.execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} != '' AND {column} NOT GLOB ?",
+                       (PADDED_DATE_GLOB,))
+        for (value,) in cursor.fetchall():
+            try:
+                padded = datetime.strptime(value, "%d-%m-%Y").strftime("%d-%m-%Y")
+            except (TypeError, ValueError):
+                continue  # not a date this application wrote; leave it alone
+            cursor.execute(f"UPDATE {table} SET {column} = ? WHERE {column} = ?", (padded, value))
+
+def _migrate_transferred_counters(conn):
+    """Leave cylinders transferred to another depot out of the per-type dashboard counts."""
+    cursor = conn.cursor()
+    kept_type = "CASE WHEN {0}.status != 'transferred' THEN {0}.cylinder_type END"
+    counter_triggers = {
+        'cylinders_counters_insert': ('AFTER INSERT ON cylinders', [
+            ('status', 'NEW.status', 1), ('type', kept_type.format('NEW'), 1)]),
+        'cylinders_counters_delete': ('AFTER DELETE ON cylinders', [
+            ('status', 'OLD.status', -1), ('type', kept_type.format('OLD'), -1)]),
+        'cylinders_counters_update': ('AFTER UPDATE OF status, cylinder_type ON cylinders', [
+            ('status', 'NEW.status', 1), ('status', 'OLD.status', -1),
+            ('type', kept_type.format('NEW'), 1), ('type', kept_type.format('OLD'), -1)]),
+    }
+    for name, (event, changes) in counter_triggers.items():
+        body = "\n".join(_counter_change_sql(counter, key, delta) for counter, key, delta in changes)
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f'''
+            CREATE TRIGGER {name}
+            {event}
+            BEGIN
+                {body}
+            END
+        ''')
+    _rebuild_dashboard_counters(cursor)
+
+MIGRATIONS = [
+    (1, 'core tables', _migrate_core_tables),
+    (2, 'dispatch grade and vehicle columns', _migrate_dispatch_columns),
+    (3, 'blank NULL dispatch grades', _migrate_blank_grades),
+    (4, 'delivery challan headers', _migrate_delivery_challans),
+    (5, 'dispatch archive', _migrate_dispatch_archive),
+    (6, 'customer holdings ledger', _migrate_customer_holdings),
+    (7, 'rental rates', _migrate_rental_rates),
+    (8, 'cylinder status state machine', _migrate_status_transitions),
+    (9, 'status event log and work queue', _migrate_work_queue),
+    (10, 'dashboard counters', _migrate_dashboard_counters),
+    (11, 'open dispatch index', _migrate_open_dispatch_index),
+    (12, 'change capture log', _migrate_change_log),
+    (13, 'depot transfers', _migrate_depot_transfers),
+    (14, 'dc number counter', _migrate_dc_counter),
+    (15, 'zero-padded dispatch dates', _migrate_padded_dates),
+    (16, 'dashboard counters without transferred cylinders', _migrate_transferred_counters),
+]
+
+# Customer operations
+def add_customer(name, contact_info, address, notes, conn=None):
+    """Add a new customer."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO customers (name, contact_info, address, notes)
+            VALUES (?, ?, ?, ?)
+        ''', (name, contact_info, address, notes))
+        return cursor.lastrowid
+
+def get_all_customers(conn=None):
+    """Get all customers."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM customers ORDER BY name")
+        customers = cursor.fetchall()
+        return customers
+
+def update_customer(customer_id, name, contact_info, address, notes, conn=None):
+    """Update customer information."""
+    with _transaction(conn) as conn:
+        conn.execute('''
+            UPDATE customers
+            SET name = ?, contact_info = ?, address = ?, notes = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (name, contact_info, address, notes, customer_id))
+
+def delete_customer(customer_id, conn=None):
+    """Delete a customer."""
+    with _transaction(conn) as conn:
+        conn.execute("DELETE FROM customers WHERE id = ?", (customer_id,))
+
+def search_customers(query, conn=None):
+    """Search customers by name or contact info."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM customers
+            WHERE name LIKE ? OR contact_info LIKE ?
+            ORDER BY name
+        ''', (f'%{query}%', f'%{query}%'))
+        customers = cursor.fetchall()
+        return customers
 
 # Cylinder operations
-def add_cylinder(cylinder_id, cylinder_type, status, location):
+def add_cylinder(cylinder_id, cylinder_type, status, location, conn=None):
     """Add a new cylinder."""
     if not cylinder_id or not cylinder_type:
         raise ValueError("Cylinder ID and type are required")
 
-    conn = get_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            INSERT INTO cylinders (cylinder_id, cylinder_type, status, location)
-            VALUES (?, ?, ?, ?)
-        ''', (cylinder_id, cylinder_type, status, location))
-        cylinder_db_id = cursor.lastrowid
-        conn.commit()
-        return cylinder_db_id
+        with _transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO cylinders (cylinder_id, cylinder_type, status, location)
+                VALUES (?, ?, ?, ?)
+                RETURNING *
+            ''', (cylinder_id, cylinder_type, status, location))
+            row = cursor.fetchone()
+            _catalog_put(conn, [row])
+            return row[0]
     except sqlite3.IntegrityError as e:
         if "UNIQUE constraint failed" in str(e):
             raise ValueError(f"Cylinder ID '{cylinder_id}' already exists")
+        if "Invalid initial cylinder status" in str(e):
+            raise ValueError(f"A new cylinder cannot have status '{status}'")
         raise
-    finally:
-        conn.close()
 
-def get_all_cylinders():
+def add_cylinders(rows, conn=None):
+    """Add many cylinders from (cylinder_id, cylinder_type, status, location) rows in one transaction.
+
+    Raises ValueError when any cylinder ID already exists; nothing is added in that case.
+    """
+    rows = list(rows)
+    try:
+        with _transaction(conn) as conn:
+            conn.executemany('''
+                INSERT INTO cylinders (cylinder_id, cylinder_type, status, location)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+            _catalog_refresh(conn, 'cylinder_id', [row[0] for row in rows])
+            return len(rows)
+    except sqlite3.IntegrityError as e:
+        if "UNIQUE constraint failed" in str(e):
+            raise ValueError("One or more cylinder IDs already exist")
+        if "Invalid initial cylinder status" in str(e):
+            raise ValueError("One or more cylinders have a status a new cylinder cannot have")
+        raise
+
+def get_cylinder_ids(conn=None):
+    """Get the set of all cylinder_id values."""
+    cache = _catalog_for(conn)
+    if cache:
+        return cache.cylinder_ids()
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT cylinder_id FROM cylinders")
+        return {row[0] for row in cursor.fetchall()}
+
+def get_all_cylinders(conn=None):
     """Get all cylinders."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM cylinders ORDER BY cylinder_id")
-    cylinders = cursor.fetchall()
-    conn.close()
-    return cylinders
+    cache = _catalog_for(conn)
+    if cache:
+        return cache.rows()
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM cylinders ORDER BY cylinder_id")
+        cylinders = cursor.fetchall()
+        return cylinders
 
-def update_cylinder(cylinder_id, cylinder_type, status, location):
+def update_cylinder(cylinder_id, cylinder_type, status, location, conn=None):
     """Update cylinder information."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE cylinders
-        SET cylinder_type = ?, status = ?, location = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (cylinder_type, status, location, cylinder_id))
-    conn.commit()
-    conn.close()
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        # Move a held cylinder to its new type in the holdings ledger
+        cursor.execute('''
+            SELECT d.customer_id, cy.cylinder_type FROM dispatches d
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            WHERE d.cylinder_id = ? AND d.status = 'dispatched'
+        ''', (cylinder_id,))
+        held = cursor.fetchone()
+        if held and held[1] != cylinder_type:
+            _adjust_customer_holdings(cursor, held[0], [cylinder_id], -1)
+        cursor.execute('''
+            UPDATE cylinders
+            SET cylinder_type = ?, location = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (cylinder_type, location, cylinder_id))
+        # Write the status only when it changes; the status triggers check the transition
+        cursor.execute("SELECT status FROM cylinders WHERE id = ?", (cylinder_id,))
+        current = cursor.fetchone()
+        if current and current[0] != status:
+            try:
+                cursor.execute("UPDATE cylinders SET status = ? WHERE id = ?", (status, cylinder_id))
+            except sqlite3.IntegrityError as e:
+                if "Invalid cylinder status transition" in str(e):
+                    raise ValueError(f"Cannot change cylinder status from '{current[0]}' to '{status}'")
+                raise
+        if held and held[1] != cylinder_type:
+            _adjust_customer_holdings(cursor, held[0], [cylinder_id], 1)
+        _catalog_refresh(conn, 'id', [cylinder_id])
 
-def delete_cylinder(cylinder_id):
+def delete_cylinder(cylinder_id, conn=None):
     """Delete a cylinder."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM cylinders WHERE id = ?", (cylinder_id,))
-    conn.commit()
-    conn.close()
+    with _transaction(conn) as conn:
+        conn.execute("DELETE FROM cylinders WHERE id = ?", (cylinder_id,))
+        _catalog_remove(conn, [cylinder_id])
+
+def update_cylinder_status(cylinder_ids, new_status, allowed_from=None, conn=None):
+    """Set new_status on the given cylinders that may move to it from their current status.
+
+    allowed_from optionally narrows the current statuses that are changed further.
+    Returns the IDs that changed; all other cylinders are left untouched.
+    """
+    cylinder_ids = list(cylinder_ids)
+    if not cylinder_ids:
+        return []
+    params = [new_status] + cylinder_ids + [new_status]
+    from_filter = ''
+    if allowed_from is not None:
+        allowed_from = list(allowed_from)
+        if not allowed_from:
+            return []
+        from_filter = f"AND status IN ({', '.join('?' * len(allowed_from))})"
+        params += allowed_from
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE cylinders
+            SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id IN ({', '.join('?' * len(cylinder_ids))})
+              AND status IN (SELECT from_status FROM cylinder_status_transitions WHERE to_status = ?)
+              {from_filter}
+            RETURNING *
+        ''', params)
+        rows = cursor.fetchall()
+        _catalog_put(conn, rows)
+        return sorted(row[0] for row in rows)
+
+def get_status_transitions(conn=None):
+    """Get the allowed status changes as {from_status: [to_status, ...]}, including 'new'."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT from_status, to_status FROM cylinder_status_transitions ORDER BY from_status, to_status")
+        transitions = {}
+        for from_status, to_status in cursor.fetchall():
+            transitions.setdefault(from_status, []).append(to_status)
+        return transitions
+
+def delete_cylinders(cylinder_ids, allowed_from=('available',), conn=None):
+    """Delete the given cylinders whose current status is in allowed_from.
+
+    Returns the IDs that were deleted.
+    """
+    cylinder_ids = list(cylinder_ids)
+    allowed_from = list(allowed_from)
+    if not cylinder_ids or not allowed_from:
+        return []
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            DELETE FROM cylinders
+            WHERE id IN ({', '.join('?' * len(cylinder_ids))})
+              AND status IN ({', '.join('?' * len(allowed_from))})
+            RETURNING id
+        ''', cylinder_ids + allowed_from)
+        deleted = sorted(row[0] for row in cursor.fetchall())
+        _catalog_remove(conn, deleted)
+        return deleted
 
-def search_cylinders(query):
+def search_cylinders(query, conn=None):
     """Search cylinders by ID, type, or status."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM cylinders
-        WHERE cylinder_id LIKE ? OR cylinder_type LIKE ? OR status LIKE ?
-        ORDER BY cylinder_id
-    ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
-    cylinders = cursor.fetchall()
-    conn.close()
-    return cylinders
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM cylinders
+            WHERE cylinder_id LIKE ? OR cylinder_type LIKE ? OR status LIKE ?
+            ORDER BY cylinder_id
+        ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
+        cylinders = cursor.fetchall()
+        return cylinders
 
-def get_cylinders_by_status(status):
+def get_cylinders_by_status(status, conn=None):
     """Get cylinders by status."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM cylinders WHERE status = ? ORDER BY cylinder_id", (status,))
-    cylinders = cursor.fetchall()
-    conn.close()
-    return cylinders
+    cache = _catalog_for(conn)
+    if cache:
+        return cache.rows(status)
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM cylinders WHERE status = ? ORDER BY cylinder_id", (status,))
+        cylinders = cursor.fetchall()
+        return cylinders
+
+def get_cylinder(cylinder_id, conn=None):
+    """Get a cylinder row by database ID, or None."""
+    cache = _catalog_for(conn)
+    if cache:
+        return cache.get(cylinder_id)
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM cylinders WHERE id = ?", (cylinder_id,))
+        cylinder = cursor.fetchone()
+        return cylinder
+
+def find_cylinder_id(input_id, conn=None):
+    """Resolve a database ID or cylinder_id text to the cylinder's database ID, or None."""
+    cache = _catalog_for(conn)
+    if cache:
+        return cache.find(input_id)
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        # Try as integer ID
+        try:
+            cylinder_id = int(input_id)
+            cursor.execute("SELECT id FROM cylinders WHERE id = ?", (cylinder_id,))
+            if cursor.fetchone():
+                return cylinder_id
+        except ValueError:
+            pass
+
+        # Try as cylinder_id text
+        cursor.execute("SELECT id FROM cylinders WHERE cylinder_id = ?", (input_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+# Inputs per resolve query, keeping the bound parameters under SQLite's 999 limit
+RESOLVE_CHUNK_SIZE = 400
+
+def resolve_cylinders(input_ids, conn=None):
+    """Resolve many database IDs or cylinder_id texts at once, like find_cylinder_id.
+
+    Returns one (input_id, id, cylinder_id_text, cylinder_type, status) row per
+    input in input order; the last four are None when nothing matches.
+    """
+    cache = _catalog_for(conn)
+    if cache:
+        return cache.resolve(input_ids)
+    inputs = [str(input_id).strip() for input_id in input_ids]
+    resolved = []
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(inputs), RESOLVE_CHUNK_SIZE):
+            chunk = inputs[start:start + RESOLVE_CHUNK_SIZE]
+            values = ', '.join(['(?, ?)'] * len(chunk))
+            params = [value for pos, token in enumerate(chunk) for value in (pos, token)]
+            cursor.execute(f'''
+                WITH input(pos, token) AS (VALUES {values})
+                SELECT input.token, cy.id, cy.cylinder_id, cy.cylinder_type, cy.status
+                FROM input
+                LEFT JOIN cylinders cy ON cy.id = COALESCE(
+                    (SELECT id FROM cylinders
+                     WHERE input.token != '' AND input.token NOT GLOB '*[^0-9]*' AND id = CAST(input.token AS INTEGER)),
+                    (SELECT id FROM cylinders WHERE cylinder_id = input.token)
+                )
+                ORDER BY input.pos
+            ''', params)
+            resolved.extend(cursor.fetchall())
+    return resolved
 
 # Dispatch operations
-def dispatch_cylinders(customer_id, cylinder_ids, dispatch_date, dispatch_notes, dc_number=None, grade=None, vehicle_number=None):
+def _padded_date(value, kind):
+    """Validate a DD-MM-YYYY date and return it zero-padded, so SQL can compare and convert it by position."""
+    try:
+        return datetime.strptime(value, "%d-%m-%Y").strftime("%d-%m-%Y")
+    except ValueError:
+        raise ValueError(f"Invalid {kind} date format. Use DD-MM-YYYY")
+
+def dispatch_cylinders(customer_id, cylinder_ids, dispatch_date, dispatch_notes, dc_number=None, grade=None, vehicle_number=None, conn=None):
     """Dispatch multiple cylinders to a customer with a DC number."""
+    # A cylinder selected twice is dispatched once, matching the holdings ledger
+    cylinder_ids = list(dict.fromkeys(cylinder_ids))
     if not cylinder_ids:
         raise ValueError("At least one cylinder must be selected")
 
-    # Validate date format
-    try:
-        datetime.strptime(dispatch_date, "%d-%m-%Y")
-    except ValueError:
-        raise ValueError("Invalid dispatch date format. Use DD-MM-YYYY")
+    # Validate the date and store it zero-padded
+    dispatch_date = _padded_date(dispatch_date, 'dispatch')
 
-    conn = get_connection()
-    cursor = conn.cursor()
+    try:
+        with _transaction(conn) as conn:
+            cursor = conn.cursor()
 
-    if dc_number:
-        # Check if custom DC number already exists
-        cursor.execute("SELECT customer_id FROM dispatches WHERE dc_number = ?", (dc_number,))
-        existing = cursor.fetchone()
-        if existing:
-            if existing[0] != customer_id:
-                # Check if all dispatches under this DC have been returned (have return_date)
-                cursor.execute("SELECT COUNT(*) FROM dispatches WHERE dc_number = ? AND return_date IS NULL", (dc_number,))
-                unreturned_count = cursor.fetchone()[0]
-                if unreturned_count > 0:
-                    conn.close()
-                    raise ValueError(f"DC number {dc_number} has unreturned cylinders. Please choose a different DC number.")
-                # All returned, delete the old dispatches to allow reuse
-                cursor.execute("DELETE FROM dispatches WHERE dc_number = ?", (dc_number,))
-            else:
-                # Same customer, check if it has any dispatched cylinders
-                cursor.execute("SELECT COUNT(*) FROM dispatches WHERE dc_number = ? AND status = 'dispatched'", (dc_number,))
-                dispatched_count = cursor.fetchone()[0]
-                if dispatched_count == 0:
-                    # No dispatched cylinders, remove existing dispatches under this DC
-                    cursor.execute("DELETE FROM dispatches WHERE dc_number = ?", (dc_number,))
-                    dc_number = None  # Force generation of new DC number
+            if dc_number:
+                # Check if custom DC number already exists
+                cursor.execute("SELECT customer_id, open_count FROM delivery_challans WHERE dc_number = ?", (dc_number,))
+                existing = cursor.fetchone()
+                if existing:
+                    if existing[0] != customer_id:
+                        # Check if all dispatches under this DC have been returned
+                        if existing[1] > 0:
+                            raise ValueError(f"DC number {dc_number} has unreturned cylinders. Please choose a different DC number.")
+                        # All returned, archive the old dispatches to allow reuse
+                        _archive_dc(cursor, dc_number)
+                    else:
+                        # Same customer, check if it has any dispatched cylinders
+                        if existing[1] == 0:
+                            # No dispatched cylinders, archive existing dispatches under this DC
+                            _archive_dc(cursor, dc_number)
+                            dc_number = None  # Force generation of new DC number
 
-    if not dc_number:
-        dc_number = generate_dc_number()
+            if not dc_number:
+                dc_number = generate_dc_number(conn)
 
-    # Now proceed to add new dispatches
+            # Mark all cylinders dispatched at once; the status triggers reject any that are not available
+            placeholders = ', '.join('?' * len(cylinder_ids))
+            try:
+                cursor.execute(f"UPDATE cylinders SET status = 'dispatched' WHERE id IN ({placeholders}) RETURNING *",
+                               list(cylinder_ids))
+                dispatched = cursor.fetchall()
+            except sqlite3.IntegrityError:
+                cursor.execute(f"SELECT id, status FROM cylinders WHERE id IN ({placeholders}) AND status != 'available' ORDER BY id",
+                               list(cylinder_ids))
+                unavailable = cursor.fetchone()
+                if unavailable is None:
+                    raise ValueError("The selected cylinders changed while dispatching; please try again")
+                raise ValueError(f"Cylinder {unavailable[0]} is not available (current status: {unavailable[1]})")
+            if len(dispatched) != len(cylinder_ids):
+                cursor.execute(f"SELECT id FROM cylinders WHERE id IN ({placeholders})", list(cylinder_ids))
+                found = {row[0] for row in cursor.fetchall()}
+                missing = next(cylinder_id for cylinder_id in cylinder_ids if cylinder_id not in found)
+                raise ValueError(f"Cylinder with ID {missing} does not exist")
 
-    try:
-        # First, verify all cylinders are available
-        for cylinder_id in cylinder_ids:
-            cursor.execute("SELECT status FROM cylinders WHERE id = ?", (cylinder_id,))
-            result = cursor.fetchone()
-            if not result:
-                raise ValueError(f"Cylinder with ID {cylinder_id} does not exist")
-            if result[0] != 'available':
-                raise ValueError(f"Cylinder {cylinder_id} is not available (current status: {result[0]})")
-
-        # Now dispatch all cylinders
-        for cylinder_id in cylinder_ids:
-            cursor.execute('''
+            cursor.executemany('''
                 INSERT INTO dispatches (dc_number, customer_id, cylinder_id, dispatch_date, dispatch_notes, status, grade, vehicle_number)
                 VALUES (?, ?, ?, ?, ?, 'dispatched', ?, ?)
-            ''', (dc_number, customer_id, cylinder_id, dispatch_date, dispatch_notes, grade, vehicle_number))
-            # Update cylinder status
-            cursor.execute("UPDATE cylinders SET status = 'dispatched' WHERE id = ?", (cylinder_id,))
-        conn.commit()
-        return dc_number
+            ''', [(dc_number, customer_id, cylinder_id, dispatch_date, dispatch_notes, grade, vehicle_number)
+                  for cylinder_id in cylinder_ids])
+            _adjust_customer_holdings(cursor, customer_id, cylinder_ids, 1)
+            _catalog_put(conn, dispatched)
+            return dc_number
     except sqlite3.IntegrityError as e:
-        conn.rollback()
         raise ValueError(f"Database error during dispatch: {str(e)}")
-    finally:
-        conn.close()
 
-def return_cylinders(dc_number, cylinder_ids, return_date, return_notes):
+def return_cylinders(dc_number, cylinder_ids, return_date, return_notes, conn=None):
     """Return specific cylinders under a DC number."""
     if not cylinder_ids:
         raise ValueError("At least one cylinder must be selected for return")
 
-    # Validate date format
-    try:
-        datetime.strptime(return_date, "%d-%m-%Y")
-    except ValueError:
-        raise ValueError("Invalid return date format. Use DD-MM-YYYY")
+    # Validate the date and store it zero-padded
+    return_date = _padded_date(return_date, 'return')
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        open_dispatches = _open_dispatches(cursor, cylinder_ids, dc_number)
         for cylinder_id in cylinder_ids:
-            # Check if cylinder is dispatched under this DC number
-            cursor.execute("""
-                SELECT id, status FROM dispatches
-                WHERE dc_number = ? AND cylinder_id = ? AND status = 'dispatched'
-            """, (dc_number, cylinder_id))
-            result = cursor.fetchone()
-            if not result:
+            if cylinder_id not in open_dispatches:
                 raise ValueError(f"Cylinder {cylinder_id} is not dispatched under DC {dc_number} or already returned")
+        _return_dispatches(cursor, conn, open_dispatches, return_date, return_notes)
 
-            dispatch_id = result[0]
-            # Update dispatch
-            cursor.execute('''
-                UPDATE dispatches
-                SET return_date = ?, return_notes = ?, status = 'returned'
-                WHERE id = ?
-            ''', (return_date, return_notes, dispatch_id))
-            # Update cylinder status to returned
-            cursor.execute("UPDATE cylinders SET status = 'returned' WHERE id = ?", (cylinder_id,))
-        # Check if all dispatches for this DC are returned
-        cursor.execute("SELECT COUNT(*) FROM dispatches WHERE dc_number = ? AND status != 'returned'", (dc_number,))
-        count_dispatched = cursor.fetchone()[0]
-        if count_dispatched == 0:
-            # All returned, delete the dispatches
-            cursor.execute("DELETE FROM dispatches WHERE dc_number = ?", (dc_number,))
-        conn.commit()
-    finally:
-        conn.close()
+def return_dispatched_cylinders(cylinder_ids, return_date, return_notes, conn=None):
+    """Return cylinders from whichever DCs they are open under, in one transaction.
 
-def get_all_dispatches():
-    """Get all dispatches with customer and cylinder info."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    Returns {dc_number: [cylinder ids]}. Raises ValueError naming the
+    cylinders that are not currently dispatched; nothing is returned then.
+    """
+    if not cylinder_ids:
+        raise ValueError("At least one cylinder must be selected for return")
+
+    return_date = _padded_date(return_date, 'return')
+
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        open_dispatches = _open_dispatches(cursor, cylinder_ids)
+        missing = [str(cylinder_id) for cylinder_id in cylinder_ids if cylinder_id not in open_dispatches]
+        if missing:
+            raise ValueError(f"Cylinders not currently dispatched: {', '.join(missing)}")
+        return _return_dispatches(cursor, conn, open_dispatches, return_date, return_notes)
+
+def _open_dispatches(cursor, cylinder_ids, dc_number=None):
+    """{cylinder_id: (dispatch id, dc_number, customer_id)} of the latest open dispatch per cylinder."""
+    cylinder_ids = list(dict.fromkeys(cylinder_ids))
+    open_dispatches = {}
+    for start in range(0, len(cylinder_ids), RESOLVE_CHUNK_SIZE):
+        chunk = cylinder_ids[start:start + RESOLVE_CHUNK_SIZE]
+        cursor.execute(f'''
+            SELECT cylinder_id, id, dc_number, customer_id FROM dispatches
+            WHERE status = 'dispatched' AND cylinder_id IN ({', '.join('?' * len(chunk))})
+              AND (? IS NULL OR dc_number = ?)
+            ORDER BY {_iso_date_sql('dispatch_date')}, id
+        ''', (*chunk, dc_number, dc_number))
+        for cylinder_id, dispatch_id, dispatch_dc, customer_id in cursor.fetchall():
+            open_dispatches[cylinder_id] = (dispatch_id, dispatch_dc, customer_id)
+    return open_dispatches
+
+def _return_dispatches(cursor, conn, open_dispatches, return_date, return_notes):
+    """Mark open dispatches returned, in the caller's transaction; archive DCs left with nothing open.
+
+    open_dispatches is {cylinder_id: (dispatch id, dc_number, customer_id)};
+    returns {dc_number: [cylinder ids]}.
+    """
+    returned_by_dc = {}
+    returned_by_customer = {}
+    for cylinder_id, (dispatch_id, dc_number, customer_id) in open_dispatches.items():
+        returned_by_dc.setdefault(dc_number, []).append(cylinder_id)
+        returned_by_customer.setdefault(customer_id, []).append(cylinder_id)
+    items = list(open_dispatches.items())
+    returned_rows = []
+    for start in range(0, len(items), RESOLVE_CHUNK_SIZE):
+        chunk = items[start:start + RESOLVE_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'''
+            UPDATE dispatches
+            SET return_date = ?, return_notes = ?, status = 'returned'
+            WHERE id IN ({placeholders})
+        ''', (return_date, return_notes, *(dispatch[0] for cylinder_id, dispatch in chunk)))
+        cursor.execute(f"UPDATE cylinders SET status = 'returned' WHERE id IN ({placeholders}) RETURNING *",
+                       [cylinder_id for cylinder_id, dispatch in chunk])
+        returned_rows.extend(cursor.fetchall())
+    for customer_id, returned_ids in returned_by_customer.items():
+        for start in range(0, len(returned_ids), RESOLVE_CHUNK_SIZE):
+            _adjust_customer_holdings(cursor, customer_id, returned_ids[start:start + RESOLVE_CHUNK_SIZE], -1)
+    _catalog_put(conn, returned_rows)
+    # Move DCs whose cylinders have all been returned to the archive
+    for dc_number in returned_by_dc:
+        cursor.execute("SELECT open_count FROM delivery_challans WHERE dc_number = ?", (dc_number,))
+        if cursor.fetchone()[0] == 0:
+            _archive_dc(cursor, dc_number)
+    return returned_by_dc
+
+def delete_dispatch(dispatch_id, conn=None):
+    """Delete a single dispatch record.
+
+    The cylinder of an open dispatch is marked returned, the state it can
+    re-enter service from through refill or maintenance.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT customer_id, cylinder_id, status FROM dispatches WHERE id = ?", (dispatch_id,))
+        dispatch = cursor.fetchone()
+        cursor.execute("DELETE FROM dispatches WHERE id = ?", (dispatch_id,))
+        # Keep the holdings ledger and the cylinder's status in step with the remaining dispatched rows
+        if dispatch and dispatch[2] == 'dispatched':
+            _adjust_customer_holdings(cursor, dispatch[0], [dispatch[1]], -1)
+            update_cylinder_status([dispatch[1]], 'returned', allowed_from=['dispatched'], conn=conn)
+
+# Refill and maintenance work queue
+def _stage_wait_sql():
+    """SQL (inside the events trigger) for the seconds NEW's cylinder spent in NEW.from_status."""
+    return '''COALESCE((
+        SELECT (julianday(NEW.event_time) - julianday(e.event_time)) * 86400
+        FROM cylinder_status_events e
+        WHERE e.cylinder_id = NEW.cylinder_id AND e.to_status = NEW.from_status AND e.id < NEW.id
+        ORDER BY e.id DESC LIMIT 1
+    ), 0)'''
+
+def create_work_batch(cylinder_ids, stage, notes='', conn=None):
+    """Move cylinders into a refill/maintenance stage together as one batch.
+
+    Only cylinders allowed to enter the stage are moved and added to the batch.
+    Returns (batch_id, moved_ids); batch_id is None when nothing moved.
+    """
+    if stage not in WORK_STAGES:
+        raise ValueError(f"Unknown work stage '{stage}'")
+    with _transaction(conn) as conn:
+        moved = update_cylinder_status(cylinder_ids, stage, conn=conn)
+        if not moved:
+            return None, []
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO work_batches (stage, notes) VALUES (?, ?)", (stage, notes))
+        batch_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO work_batch_items (batch_id, cylinder_id) VALUES (?, ?)",
+                           [(batch_id, cylinder_id) for cylinder_id in moved])
+        return batch_id, moved
+
+def advance_work_batch(batch_id, next_status='available', conn=None):
+    """Move the cylinders of a batch still in its stage on to next_status.
+
+    The batch is marked completed once none of its cylinders remain in the stage.
+    Returns the moved IDs.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT stage FROM work_batches WHERE id = ?", (batch_id,))
+        batch = cursor.fetchone()
+        if not batch:
+            raise ValueError(f"Work batch {batch_id} does not exist")
+        cursor.execute('''
+            SELECT i.cylinder_id FROM work_batch_items i
+            JOIN cylinders cy ON cy.id = i.cylinder_id
+            WHERE i.batch_id = ? AND cy.status = ?
+        ''', (batch_id, batch[0]))
+        waiting = [row[0] for row in cursor.fetchall()]
+        moved = update_cylinder_status(waiting, next_status, conn=conn)
+        if len(moved) == len(waiting):
+            cursor.execute("UPDATE work_batches SET completed_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = ?",
+                           (batch_id,))
+        return moved
+
+def get_work_batches(open_only=True, conn=None):
+    """Get work batches as (id, stage, notes, created_at, completed_at, cylinders, still_in_stage)."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT b.id, b.stage, b.notes, b.created_at, b.completed_at, COUNT(i.cylinder_id),
+                   SUM(CASE WHEN cy.status = b.stage THEN 1 ELSE 0 END)
+            FROM work_batches b
+            LEFT JOIN work_batch_items i ON i.batch_id = b.id
+            LEFT JOIN cylinders cy ON cy.id = i.cylinder_id
+            {"WHERE b.completed_at IS NULL" if open_only else ""}
+            GROUP BY b.id
+            ORDER BY b.id DESC
+        ''')
+        return cursor.fetchall()
+
+def get_work_queue(stage, conn=None):
+    """Get cylinders waiting in a stage as (id, cylinder_id, cylinder_type, entered_at, waiting_hours, batch_id), longest waiting first."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT cy.id, cy.cylinder_id, cy.cylinder_type, e.event_time,
+                   ROUND((julianday('now', 'localtime') - julianday(e.event_time)) * 24, 1),
+                   (SELECT MAX(i.batch_id) FROM work_batch_items i WHERE i.cylinder_id = cy.id)
+            FROM cylinders cy
+            LEFT JOIN cylinder_status_events e ON e.id = (
+                SELECT MAX(id) FROM cylinder_status_events WHERE cylinder_id = cy.id AND to_status = cy.status
+            )
+            WHERE cy.status = ?
+            ORDER BY e.event_time
+        ''', (stage,))
+        return cursor.fetchall()
+
+def get_work_queue_stats(conn=None):
+    """Get (stage, depth, entered, completed, avg_wait_hours) per stage from the running aggregates."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT stage, depth, entered, completed,
+                   CASE WHEN completed > 0 THEN ROUND(wait_seconds / completed / 3600, 1) ELSE 0 END
+            FROM work_queue_stats
+            ORDER BY stage
+        ''')
+        return cursor.fetchall()
+
+def get_work_queue_daily(days=14, conn=None):
+    """Get (day, stage, entered, completed, avg_wait_hours) for the last days, newest first."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT day, stage, entered, completed,
+                   CASE WHEN completed > 0 THEN ROUND(wait_seconds / completed / 3600, 1) ELSE 0 END
+            FROM work_queue_daily
+            WHERE day > date('now', 'localtime', ?)
+            ORDER BY day DESC, stage
+        ''', (f'-{int(days)} days',))
+        return cursor.fetchall()
+
+# Turnaround analytics
+def get_turnaround_report(conn=None):
+    """Get cycle times per cylinder and type and return speed per customer (see turnaround.py).
+
+    The report is cached and only rebuilt once status events, dispatches,
+    cylinder IDs or types, or customer names have changed.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, cylinder_id, cylinder_type FROM cylinders")
+        cylinders = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        cursor.execute("SELECT id, name FROM customers")
+        customers = cursor.fetchall()
+        cursor.execute('''
+            SELECT (SELECT MAX(id) FROM cylinder_status_events), (SELECT COUNT(*) FROM cylinder_status_events),
+                   (SELECT MAX(id) FROM dispatches), (SELECT COUNT(*) FROM dispatches),
+                   (SELECT MAX(id) FROM dispatch_archive), (SELECT COUNT(*) FROM dispatch_archive)
+        ''')
+        version = (cursor.fetchone(), hash(frozenset(cylinders.items())), hash(frozenset(customers)))
+
+        def build():
+            cursor.execute(f'''
+                SELECT d.customer_id, c.name,
+                       julianday({_iso_date_sql('d.return_date')}) - julianday({_iso_date_sql('d.dispatch_date')})
+                FROM ({_dispatch_history_sql()}) d
+                JOIN customers c ON d.customer_id = c.id
+                WHERE d.return_date IS NOT NULL AND d.return_date != ''
+            ''')
+            returns = cursor.fetchall()
+            # Stream the event log in index order (cylinder, id) in one pass
+            events = conn.execute(
+                "SELECT cylinder_id, to_status, julianday(event_time) FROM cylinder_status_events ORDER BY cylinder_id, id"
+            )
+            return turnaround.build_report(events, cylinders, returns)
+
+        return turnaround.report_cache.get(DATABASE_FILE, version, build)
+
+# Delivery challan headers
+def _dc_seq_sql(column):
+    """SQL giving the number of a DCnnn style DC number, or NULL for custom DC numbers."""
+    return f"(CASE WHEN {column} GLOB 'DC[0-9]*' THEN CAST(SUBSTR({column}, 3) AS INTEGER) END)"
+
+def _rebuild_dispatches_table(cursor):
+    """Recreate dispatches with its reference to delivery_challans, keeping every row and id."""
+    columns = "id, dc_number, customer_id, cylinder_id, dispatch_date, return_date, dispatch_notes, return_notes, status, grade, created_at, vehicle_number"
     cursor.execute('''
-        SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, c.name as customer_name, cy.cylinder_id as cylinder_id_text, cy.cylinder_type as cylinder_type
-        FROM dispatches d
-        JOIN customers c ON d.customer_id = c.id
-        JOIN cylinders cy ON d.cylinder_id = cy.id
-        ORDER BY d.dc_number DESC, d.dispatch_date DESC
+        CREATE TABLE dispatches_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dc_number TEXT NOT NULL,
+            customer_id INTEGER NOT NULL,
+            cylinder_id INTEGER NOT NULL,
+            dispatch_date DATE NOT NULL,
+            return_date DATE,
+            dispatch_notes TEXT,
+            return_notes TEXT,
+            status TEXT NOT NULL DEFAULT 'dispatched',
+            grade TEXT NOT NULL DEFAULT '',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            vehicle_number TEXT NOT NULL DEFAULT '',
+            FOREIGN KEY (dc_number) REFERENCES delivery_challans (dc_number),
+            FOREIGN KEY (customer_id) REFERENCES customers (id),
+            FOREIGN KEY (cylinder_id) REFERENCES cylinders (id)
+        )
     ''')
-    dispatches = cursor.fetchall()
-    conn.close()
-    return dispatches
+    cursor.execute(f"INSERT INTO dispatches_new ({columns}) SELECT {columns} FROM dispatches ORDER BY id")
+    # Dropping the old table also drops its triggers and indexes; the migration steps recreate them
+    cursor.execute("DROP TABLE dispatches")
+    cursor.execute("ALTER TABLE dispatches_new RENAME TO dispatches")
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'dashboard_counters'")
+    if cursor.fetchone():
+        # DC lists now come from delivery_challans
+        cursor.execute("DELETE FROM dashboard_counters WHERE counter IN ('dc', 'open_dc')")
 
-def get_dispatches_by_dc(dc_number):
-    """Get all dispatches for a specific DC number."""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _rebuild_delivery_challans(cursor):
+    """Recompute the DC headers from dispatches in the caller's transaction."""
+    cursor.execute("DELETE FROM delivery_challans")
+    cursor.execute(f'''
+        INSERT INTO delivery_challans (dc_number, dc_seq, customer_id, vehicle_number, grade, dispatch_date, line_count, open_count, created_at)
+        SELECT dc_number, {_dc_seq_sql('dc_number')}, customer_id, vehicle_number, grade, dispatch_date,
+               COUNT(*), SUM(status = 'dispatched'), MIN(created_at)
+        FROM (SELECT * FROM dispatches ORDER BY id)
+        GROUP BY dc_number
+    ''')
+
+def get_dc_numbers(open_only=False, conn=None):
+    """Get DC numbers in dispatches (only those with cylinders out when open_only), highest number first."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT dc_number FROM delivery_challans
+            {"WHERE open_count > 0" if open_only else ""}
+            ORDER BY dc_seq DESC, dc_number DESC
+        ''')
+        return [row[0] for row in cursor.fetchall()]
+
+def get_delivery_challans(open_only=False, conn=None):
+    """Get DC headers as (dc_number, customer_id, customer_name, vehicle_number, grade, dispatch_date, cylinders, open_cylinders, created_at)."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT dc.dc_number, dc.customer_id, c.name, dc.vehicle_number, dc.grade, dc.dispatch_date,
+                   dc.line_count, dc.open_count, dc.created_at
+            FROM delivery_challans dc
+            JOIN customers c ON dc.customer_id = c.id
+            {"WHERE dc.open_count > 0" if open_only else ""}
+            ORDER BY dc.dc_seq DESC, dc.dc_number DESC
+        ''')
+        return cursor.fetchall()
+
+# Dashboard counters
+def _counter_change_sql(counter, key_sql, delta):
+    """Trigger statements adding delta to a dashboard counter; rows are dropped at zero and a NULL key is ignored."""
+    if delta > 0:
+        return f'''
+            INSERT INTO dashboard_counters (counter, key, value) SELECT '{counter}', {key_sql}, {delta} WHERE {key_sql} IS NOT NULL
+            ON CONFLICT(counter, key) DO UPDATE SET value = value + {delta};'''
+    return f'''
+            UPDATE dashboard_counters SET value = value + ({delta}) WHERE counter = '{counter}' AND key = {key_sql};
+            DELETE FROM dashboard_counters WHERE counter = '{counter}' AND key = {key_sql} AND value <= 0;'''
+
+def _rebuild_dashboard_counters(cursor):
+    """Recompute all dashboard counters from cylinders and dispatches in the caller's transaction."""
+    cursor.execute("DELETE FROM dashboard_counters")
     cursor.execute('''
-        SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, c.name as customer_name, cy.cylinder_id as cylinder_id_text, cy.cylinder_type as cylinder_type
+        INSERT INTO dashboard_counters (counter, key, value)
+        SELECT 'status', status, COUNT(*) FROM cylinders GROUP BY status
+        UNION ALL
+        SELECT 'type', cylinder_type, COUNT(*) FROM cylinders WHERE status != 'transferred' GROUP BY cylinder_type
+        UNION ALL
+        SELECT 'customer_out', customer_id, COUNT(*) FROM dispatches WHERE status = 'dispatched' GROUP BY customer_id
+    ''')
+
+def get_dashboard_counters(conn=None):
+    """Get the materialized counts without scanning cylinders or dispatches.
+
+    Returns a dictionary with 'status' and 'type' ({name: cylinders}), 'total'
+    cylinders, 'open_dcs' (number of DCs with cylinders out) and
+    'customers_out' ({customer_id: cylinders out}). Cylinders transferred to
+    another depot appear under their 'transferred' status only, not in
+    'type' or 'total', so counters summed over depots count real stock.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT counter, key, value FROM dashboard_counters WHERE counter IN ('status', 'type', 'customer_out')")
+        counters = {'status': {}, 'type': {}, 'customers_out': {}}
+        for counter, key, value in cursor.fetchall():
+            if counter == 'customer_out':
+                counters['customers_out'][int(key)] = value
+            else:
+                counters[counter][key] = value
+        cursor.execute("SELECT COUNT(*) FROM delivery_challans WHERE open_count > 0")
+        counters['open_dcs'] = cursor.fetchone()[0]
+        counters['total'] = sum(value for status, value in counters['status'].items() if status != 'transferred')
+        return counters
+
+
+# Customer holdings ledger
+def _adjust_customer_holdings(cursor, customer_id, cylinder_ids, delta):
+    """Add delta per cylinder to the customer's holdings, grouped by cylinder type, in the caller's transaction."""
+    placeholders = ', '.join('?' * len(cylinder_ids))
+    cursor.execute(f'''
+        INSERT INTO customer_holdings (customer_id, cylinder_type, quantity)
+        SELECT ?, cylinder_type, ? * COUNT(*) FROM cylinders
+        WHERE id IN ({placeholders})
+        GROUP BY cylinder_type
+        ON CONFLICT(customer_id, cylinder_type) DO UPDATE
+        SET quantity = quantity + excluded.quantity, updated_at = CURRENT_TIMESTAMP
+    ''', [customer_id, delta] + list(cylinder_ids))
+    if delta < 0:
+        cursor.execute("DELETE FROM customer_holdings WHERE customer_id = ? AND quantity <= 0", (customer_id,))
+
+def _actual_holdings_sql():
+    """SQL recomputing current holdings from dispatched rows in dispatches."""
+    return '''
+        SELECT d.customer_id, cy.cylinder_type, COUNT(*) AS quantity
         FROM dispatches d
-        JOIN customers c ON d.customer_id = c.id
         JOIN cylinders cy ON d.cylinder_id = cy.id
-        WHERE d.dc_number = ?
-        ORDER BY d.dispatch_date DESC
+        WHERE d.status = 'dispatched'
+        GROUP BY d.customer_id, cy.cylinder_type
+    '''
+
+def _rebuild_customer_holdings(cursor):
+    """Recompute the whole holdings ledger from dispatches in the caller's transaction."""
+    cursor.execute("DELETE FROM customer_holdings")
+    cursor.execute(f"INSERT INTO customer_holdings (customer_id, cylinder_type, quantity) {_actual_holdings_sql()}")
+
+def get_customer_holdings(customer_id, conn=None):
+    """Get (cylinder_type, quantity) currently held by a customer."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT cylinder_type, quantity FROM customer_holdings
+            WHERE customer_id = ? AND quantity > 0
+            ORDER BY cylinder_type
+        ''', (customer_id,))
+        holdings = cursor.fetchall()
+        return holdings
+
+def get_holdings_totals(conn=None):
+    """Get a dict of customer_id to total cylinders currently held."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT customer_id, SUM(quantity) FROM customer_holdings GROUP BY customer_id")
+        totals = dict(cursor.fetchall())
+        return totals
+
+def check_holdings_consistency(repair=False, conn=None):
+    """Compare the holdings ledger with dispatches and optionally rebuild it.
+
+    Returns a list of (customer_id, cylinder_type, recorded, actual) for every drifted entry.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            WITH actual AS ({_actual_holdings_sql()}),
+            keys AS (
+                SELECT customer_id, cylinder_type FROM customer_holdings
+                UNION
+                SELECT customer_id, cylinder_type FROM actual
+            )
+            SELECT k.customer_id, k.cylinder_type, COALESCE(h.quantity, 0), COALESCE(a.quantity, 0)
+            FROM keys k
+            LEFT JOIN customer_holdings h ON h.customer_id = k.customer_id AND h.cylinder_type = k.cylinder_type
+            LEFT JOIN actual a ON a.customer_id = k.customer_id AND a.cylinder_type = k.cylinder_type
+            WHERE COALESCE(h.quantity, 0) != COALESCE(a.quantity, 0)
+            ORDER BY k.customer_id, k.cylinder_type
+        ''')
+        drift = cursor.fetchall()
+        if drift and repair:
+            _rebuild_customer_holdings(cursor)
+        return drift
+
+# Columns shared by dispatches and dispatch_archive, in archive order
+DISPATCH_HISTORY_COLUMNS = "id, dc_number, customer_id, cylinder_id, dispatch_date, return_date, dispatch_notes, return_notes, status, grade, vehicle_number, created_at"
+
+def _archive_dc(cursor, dc_number):
+    """Move all dispatch rows of a DC into dispatch_archive within the caller's transaction."""
+    cursor.execute(f'''
+        INSERT INTO dispatch_archive ({DISPATCH_HISTORY_COLUMNS})
+        SELECT {DISPATCH_HISTORY_COLUMNS} FROM dispatches
+        WHERE dc_number = ?
+        ORDER BY id
     ''', (dc_number,))
-    dispatches = cursor.fetchall()
-    conn.close()
-    return dispatches
+    cursor.execute("DELETE FROM dispatches WHERE dc_number = ?", (dc_number,))
 
-def get_dispatched_cylinders_by_dc(dc_number):
-    """Get cylinders currently dispatched under a DC number."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT cy.id, cy.cylinder_id
-        FROM dispatches d
+def archive_completed_dcs(conn=None):
+    """Move every DC whose cylinders have all been returned into the archive in one transaction."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TEMP TABLE completed_dcs AS
+            SELECT dc_number FROM dispatches
+            GROUP BY dc_number
+            HAVING SUM(CASE WHEN status = 'dispatched' THEN 1 ELSE 0 END) = 0
+        ''')
+        cursor.execute(f'''
+            INSERT INTO dispatch_archive ({DISPATCH_HISTORY_COLUMNS})
+            SELECT {DISPATCH_HISTORY_COLUMNS} FROM dispatches
+            WHERE dc_number IN (SELECT dc_number FROM completed_dcs)
+            ORDER BY id
+        ''')
+        archived = cursor.rowcount
+        cursor.execute("DELETE FROM dispatches WHERE dc_number IN (SELECT dc_number FROM completed_dcs)")
+        cursor.execute("DROP TABLE completed_dcs")
+        return archived
+
+def _dispatch_history_sql():
+    """SQL selecting open and archived dispatch rows together with a source column."""
+    return f'''
+        SELECT {DISPATCH_HISTORY_COLUMNS}, 'open' AS source FROM dispatches
+        UNION ALL
+        SELECT {DISPATCH_HISTORY_COLUMNS}, 'archive' AS source FROM dispatch_archive
+    '''
+
+def _dispatch_history_query(customer_id=None, dc_number=None, cylinder_id=None):
+    """SQL and parameters of get_dispatch_history."""
+    conditions = []
+    params = []
+    if customer_id is not None:
+        conditions.append("d.customer_id = ?")
+        params.append(customer_id)
+    if dc_number is not None:
+        conditions.append("d.dc_number = ?")
+        params.append(dc_number)
+    if cylinder_id is not None:
+        conditions.append("d.cylinder_id = ?")
+        params.append(cylinder_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f'''
+        SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, c.name as customer_name, cy.cylinder_id as cylinder_id_text, cy.cylinder_type as cylinder_type, d.source
+        FROM ({_dispatch_history_sql()}) d
+        JOIN customers c ON d.customer_id = c.id
         JOIN cylinders cy ON d.cylinder_id = cy.id
-        WHERE d.dc_number = ? AND d.status = 'dispatched'
-    ''', (dc_number,))
-    cylinders = cursor.fetchall()
-    conn.close()
-    return cylinders
+        {where}
+        ORDER BY d.id DESC
+    ''', params
 
-def get_dispatches_by_customer(customer_id):
+def get_dispatch_history(customer_id=None, dc_number=None, cylinder_id=None, conn=None):
+    """Get open and archived dispatches with customer and cylinder info.
+
+    Rows match get_all_dispatches() with a trailing source column ('open' or 'archive').
+    """
+    sql, params = _dispatch_history_query(customer_id, dc_number, cylinder_id)
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        dispatches = cursor.fetchall()
+        return dispatches
+
+def iter_dispatch_history(customer_id=None, dc_number=None, cylinder_id=None, batch_size=1000):
+    """Yield the rows of get_dispatch_history without holding them all in memory (exports)."""
+    sql, params = _dispatch_history_query(customer_id, dc_number, cylinder_id)
+    conn = get_connection()
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        conn.close()
+
+def get_all_dispatches(conn=None):
+    """Get all dispatches with customer and cylinder info."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, c.name as customer_name, cy.cylinder_id as cylinder_id_text, cy.cylinder_type as cylinder_type
+            FROM dispatches d
+            JOIN customers c ON d.customer_id = c.id
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            ORDER BY d.dc_number DESC, d.dispatch_date DESC
+        ''')
+        dispatches = cursor.fetchall()
+        return dispatches
+
+def get_dispatches_by_dc(dc_number, conn=None):
+    """Get all dispatches for a specific DC number."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, c.name as customer_name, cy.cylinder_id as cylinder_id_text, cy.cylinder_type as cylinder_type
+            FROM dispatches d
+            JOIN customers c ON d.customer_id = c.id
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            WHERE d.dc_number = ?
+            ORDER BY d.dispatch_date DESC
+        ''', (dc_number,))
+        dispatches = cursor.fetchall()
+        return dispatches
+
+def get_dispatched_cylinders_by_dc(dc_number, conn=None):
+    """Get (id, cylinder_id, cylinder_type) of cylinders currently dispatched under a DC number."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT cy.id, cy.cylinder_id, cy.cylinder_type
+            FROM dispatches d
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            WHERE d.dc_number = ? AND d.status = 'dispatched'
+        ''', (dc_number,))
+        cylinders = cursor.fetchall()
+        return cylinders
+
+def get_dispatches_by_customer(customer_id, conn=None):
     """Get dispatches for a specific customer."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, cy.cylinder_id as cylinder_id_text
+            FROM dispatches d
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            WHERE d.customer_id = ?
+            ORDER BY d.dispatch_date DESC
+        ''', (customer_id,))
+        dispatches = cursor.fetchall()
+        return dispatches
+
+def get_open_dispatches_for_cylinders(cylinder_ids, conn=None):
+    """Get {cylinder_id: (dc_number, dispatch id)} of the latest open dispatch of each cylinder, in one query per chunk."""
+    with _transaction(conn) as conn:
+        return {cylinder_id: (dc_number, dispatch_id)
+                for cylinder_id, (dispatch_id, dc_number, customer_id) in _open_dispatches(conn.cursor(), cylinder_ids).items()}
+
+def get_cylinders_with_last_dispatch(status=None, cylinder_ids=None, conn=None):
+    """Get cylinders with their most recent open or archived dispatch.
+
+    Returns rows of (id, cylinder_id, cylinder_type, status, location, last_dc,
+    last_customer_id, last_customer, last_dispatch_date, last_return_date,
+    last_grade); the last_* columns are None for cylinders never dispatched.
+    With cylinder_ids, only those cylinders are read (used to update the
+    history index after a dispatch or return).
+    """
+    if cylinder_ids is not None:
+        cylinder_ids = list(cylinder_ids)
+        chunks = [cylinder_ids[start:start + RESOLVE_CHUNK_SIZE]
+                  for start in range(0, len(cylinder_ids), RESOLVE_CHUNK_SIZE)]
+    else:
+        chunks = [None]
+    cylinders = []
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        for chunk in chunks:
+            if chunk is None:
+                history_filter = cylinder_filter = ''
+                chunk = []
+            else:
+                placeholders = ', '.join('?' * len(chunk))
+                history_filter = f'WHERE d.cylinder_id IN ({placeholders})'
+                cylinder_filter = f'AND cy.id IN ({placeholders})'
+            cursor.execute(f'''
+                WITH ranked AS (
+                    SELECT d.cylinder_id, d.dc_number, c.id AS customer_id, c.name, d.dispatch_date, d.return_date, d.grade,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY d.cylinder_id
+                               ORDER BY {_iso_date_sql('d.dispatch_date')} DESC, d.id DESC
+                           ) AS rn
+                    FROM ({_dispatch_history_sql()}) d
+                    JOIN customers c ON d.customer_id = c.id
+                    {history_filter}
+                )
+                SELECT cy.id, cy.cylinder_id, cy.cylinder_type, cy.status, cy.location,
+                       r.dc_number, r.customer_id, r.name, r.dispatch_date, r.return_date, r.grade
+                FROM cylinders cy
+                LEFT JOIN ranked r ON r.cylinder_id = cy.id AND r.rn = 1
+                WHERE (? IS NULL OR cy.status = ?) {cylinder_filter}
+                ORDER BY cy.cylinder_id
+            ''', (*chunk, status, status, *chunk))
+            cylinders.extend(cursor.fetchall())
+    return cylinders
+
+def get_bill_data_for_dc(dc_number, conn=None):
+    """Get customer details and dispatch lines for a bill of one DC, or None."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        # Get customer info from the DC header
+        cursor.execute('''
+            SELECT c.id, c.name, c.contact_info, c.address
+            FROM delivery_challans dc
+            JOIN customers c ON dc.customer_id = c.id
+            WHERE dc.dc_number = ?
+        ''', (dc_number,))
+        customer_row = cursor.fetchone()
+        if not customer_row:
+            return None
+        customer_id, customer_name, contact_info, address = customer_row
+
+        # Get dispatches
+        cursor.execute('''
+            SELECT d.dc_number, d.dispatch_date, d.return_date, d.status, cy.cylinder_id, cy.cylinder_type, d.grade, d.vehicle_number, d.dispatch_notes, d.return_notes
+            FROM dispatches d
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            WHERE d.dc_number = ?
+            ORDER BY d.dispatch_date DESC
+        ''', (dc_number,))
+        dispatches = cursor.fetchall()
+
+        return {
+            'customer_id': customer_id,
+            'customer_name': customer_name,
+            'contact_info': contact_info,
+            'address': address,
+            'dispatches': dispatches
+        }
+
+def get_bill_data_for_company(customer_id, conn=None):
+    """Get customer details and dispatch lines for a bill of one customer, or None."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        # Get customer info
+        cursor.execute('SELECT name, contact_info, address FROM customers WHERE id = ?', (customer_id,))
+        customer_row = cursor.fetchone()
+        if not customer_row:
+            return None
+        customer_name, contact_info, address = customer_row
+
+        # Get dispatches
+        cursor.execute('''
+            SELECT d.dc_number, d.dispatch_date, d.return_date, d.status, cy.cylinder_id, cy.cylinder_type, d.grade, d.vehicle_number, d.dispatch_notes, d.return_notes
+            FROM dispatches d
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+            WHERE d.customer_id = ?
+            ORDER BY d.dc_number DESC, d.dispatch_date DESC
+        ''', (customer_id,))
+        dispatches = cursor.fetchall()
+
+        return {
+            'customer_id': customer_id,
+            'customer_name': customer_name,
+            'contact_info': contact_info,
+            'address': address,
+            'dispatches': dispatches
+        }
+
+# Rental and aging operations
+AGING_BUCKETS = [
+    ('0-7', 0, 7),
+    ('8-30', 8, 30),
+    ('31-90', 31, 90),
+    ('90+', 91, None),
+]
+
+def _iso_date_sql(column):
+    """SQL expression converting a zero-padded DD-MM-YYYY text column (see _padded_date) to YYYY-MM-DD."""
+    return f"(substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2))"
+
+def _aging_bucket_sql(column):
+    """SQL CASE expression mapping a day count to its AGING_BUCKETS label."""
+    cases = []
+    for label, low, high in AGING_BUCKETS:
+        if high is None:
+            cases.append(f"WHEN {column} >= {low} THEN '{label}'")
+        else:
+            cases.append(f"WHEN {column} BETWEEN {low} AND {high} THEN '{label}'")
+    return "CASE " + " ".join(cases) + " END"
+
+def _aging_sql():
+    """SQL computing days out, aging bucket and rental charge for every open and archived dispatch row.
+
+    Takes a single named parameter :as_of (YYYY-MM-DD) and reports as of that
+    date: later dispatches are left out, and cylinders returned after it count
+    as still held (return_date NULL, status 'dispatched') up to it.
+    """
+    return f'''
+        WITH as_of AS (
+            SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date,
+                   CASE WHEN {_iso_date_sql("NULLIF(d.return_date, '')")} <= :as_of THEN d.return_date END AS return_date,
+                   CASE WHEN {_iso_date_sql("NULLIF(d.return_date, '')")} <= :as_of THEN d.status ELSE 'dispatched' END AS status
+            FROM ({_dispatch_history_sql()}) d
+            WHERE {_iso_date_sql('d.dispatch_date')} <= :as_of
+        ),
+        held AS (
+            SELECT d.id, d.dc_number, d.customer_id, c.name AS customer_name, d.cylinder_id,
+                   cy.cylinder_id AS cylinder_id_text, cy.cylinder_type, d.dispatch_date, d.return_date, d.status,
+                   CAST(julianday(COALESCE({_iso_date_sql('d.return_date')}, :as_of))
+                        - julianday({_iso_date_sql('d.dispatch_date')}) AS INTEGER) AS days_out
+            FROM as_of d
+            JOIN customers c ON d.customer_id = c.id
+            JOIN cylinders cy ON d.cylinder_id = cy.id
+        ),
+        aged AS (
+            SELECT held.*,
+                   {_aging_bucket_sql('held.days_out')} AS bucket,
+                   MAX(held.days_out - COALESCE(r.free_days, 0), 0) * COALESCE(r.daily_rate, 0) AS rental_charge
+            FROM held
+            LEFT JOIN rental_rates r ON r.cylinder_type = held.cylinder_type
+        )
+    '''
+
+def _as_of_param(as_of_date):
+    """Validate a DD-MM-YYYY as-of date (default today) and return it as YYYY-MM-DD."""
+    if not as_of_date:
+        return datetime.now().strftime("%Y-%m-%d")
+    try:
+        return datetime.strptime(as_of_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError("Invalid as-of date format. Use DD-MM-YYYY")
+
+def get_cylinder_aging(as_of_date=None, customer_id=None, open_only=False, conn=None):
+    """Get days out, aging bucket and rental charge for each dispatched cylinder.
+
+    Returns rows of (dispatch id, dc_number, customer_id, customer_name, cylinder db id,
+    cylinder_id_text, cylinder_type, dispatch_date, return_date, status, days_out,
+    bucket, rental_charge), longest held first.
+    """
+    params = {'as_of': _as_of_param(as_of_date)}
+    conditions = []
+    if customer_id is not None:
+        conditions.append("customer_id = :customer_id")
+        params['customer_id'] = customer_id
+    if open_only:
+        conditions.append("return_date IS NULL")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            {_aging_sql()}
+            SELECT id, dc_number, customer_id, customer_name, cylinder_id, cylinder_id_text, cylinder_type,
+                   dispatch_date, return_date, status, days_out, bucket, rental_charge
+            FROM aged
+            {where}
+            ORDER BY days_out DESC, dc_number
+        ''', params)
+        aging = cursor.fetchall()
+        return aging
+
+def get_customer_aging_summary(as_of_date=None, conn=None):
+    """Get aging buckets of cylinders held on the as-of date and total rental per customer.
+
+    Returns rows of (customer_id, customer_name, one open-cylinder count per
+    AGING_BUCKETS entry, open_cylinders, total_days, rental_charges). The
+    bucket and open counts cover cylinders held on the as-of date; total_days
+    and rental_charges cover every dispatch up to it, returned ones included.
+    """
+    bucket_columns = ", ".join(
+        f"SUM(CASE WHEN return_date IS NULL AND bucket = '{label}' THEN 1 ELSE 0 END)"
+        for label, _, _ in AGING_BUCKETS
+    )
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            {_aging_sql()}
+            SELECT customer_id, customer_name, {bucket_columns},
+                   SUM(CASE WHEN return_date IS NULL THEN 1 ELSE 0 END) AS open_cylinders,
+                   SUM(COALESCE(days_out, 0)) AS total_days,
+                   SUM(COALESCE(rental_charge, 0)) AS rental_charges
+            FROM aged
+            GROUP BY customer_id, customer_name
+            ORDER BY rental_charges DESC, customer_name
+        ''', {'as_of': _as_of_param(as_of_date)})
+        summary = cursor.fetchall()
+        return summary
+
+def get_rental_rates(conn=None):
+    """Get all rental rates."""
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT cylinder_type, daily_rate, free_days FROM rental_rates ORDER BY cylinder_type")
+        rates = cursor.fetchall()
+        return rates
+
+def set_rental_rate(cylinder_type, daily_rate, free_days=0, conn=None):
+    """Create or update the daily rental rate for a cylinder type."""
+    if not cylinder_type:
+        raise ValueError("Cylinder type is required")
+    if daily_rate < 0 or free_days < 0:
+        raise ValueError("Rate and free days cannot be negative")
+
+    with _transaction(conn) as conn:
+        conn.execute('''
+            INSERT INTO rental_rates (cylinder_type, daily_rate, free_days)
+            VALUES (?, ?, ?)
+            ON CONFLICT(cylinder_type) DO UPDATE
+            SET daily_rate = excluded.daily_rate, free_days = excluded.free_days, updated_at = CURRENT_TIMESTAMP
+        ''', (cylinder_type, daily_rate, free_days))
+
+# Depot transfers, prepared and finished at both depots by depots.py
+def _chunks(values):
+    for start in range(0, len(values), RESOLVE_CHUNK_SIZE):
+        yield values[start:start + RESOLVE_CHUNK_SIZE]
+
+def prepare_transfer_out(transfer_id, target_depot, cylinder_ids, conn=None):
+    """Phase one at the sending depot: hold the cylinders in transit for the transfer.
+
+    cylinder_ids are database IDs or cylinder_id texts, which must all be
+    available (ValueError otherwise). Returns (cylinder_id, cylinder_type,
+    location) rows for prepare_transfer_in at the receiving depot.
+    """
+    with _transaction(conn) as conn:
+        resolved = resolve_cylinders(cylinder_ids, conn=conn)
+        missing = [input_id for input_id, cylinder_id, *_ in resolved if cylinder_id is None]
+        if missing:
+            raise ValueError(f"Unknown cylinders: {', '.join(missing)}")
+        ids = sorted({row[1] for row in resolved})
+        moved = set()
+        for chunk in _chunks(ids):
+            moved.update(update_cylinder_status(chunk, 'in_transit', allowed_from=('available',), conn=conn))
+        held = sorted({text for _, cylinder_id, text, *_ in resolved if cylinder_id not in moved})
+        if held:
+            raise ValueError(f"Cylinders not available for transfer: {', '.join(held)}")
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO depot_transfers (transfer_id, direction, depot) VALUES (?, 'out', ?)",
+                       (transfer_id, target_depot))
+        cursor.executemany("INSERT INTO depot_transfer_items (transfer_id, cylinder_id, previous_status) VALUES (?, ?, 'available')",
+                           [(transfer_id, cylinder_id) for cylinder_id in ids])
+        rows = []
+        for chunk in _chunks(ids):
+            cursor.execute(f"SELECT cylinder_id, cylinder_type, location FROM cylinders WHERE id IN ({', '.join('?' * len(chunk))})",
+                           chunk)
+            rows.extend(cursor.fetchall())
+        return sorted(rows)
+
+def prepare_transfer_in(transfer_id, source_depot, rows, location=None, conn=None):
+    """Phase one at the receiving depot: add the cylinders of a transfer in transit.
+
+    rows come from prepare_transfer_out; location replaces their location when
+    given. A cylinder that left this depot earlier ('transferred') is taken
+    back; any other cylinder_id already here raises ValueError.
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        texts = [row[0] for row in rows]
+        existing = {}
+        for chunk in _chunks(texts):
+            cursor.execute(f"SELECT cylinder_id, id, status FROM cylinders WHERE cylinder_id IN ({', '.join('?' * len(chunk))})",
+                           chunk)
+            existing.update((text, (cylinder_id, status)) for text, cylinder_id, status in cursor.fetchall())
+        clashes = sorted(text for text, (_, status) in existing.items() if status != 'transferred')
+        if clashes:
+            raise ValueError(f"Cylinders already at this depot: {', '.join(clashes)}")
+        items, added = [], []
+        for text, cylinder_type, source_location in rows:
+            new_location = source_location if location is None else location
+            if text in existing:
+                cylinder_id, previous_status = existing[text][0], 'transferred'
+                cursor.execute("UPDATE cylinders SET cylinder_type = ?, location = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                               (cylinder_type, new_location, cylinder_id))
+            else:
+                cursor.execute("INSERT INTO cylinders (cylinder_id, cylinder_type, status, location) VALUES (?, ?, 'available', ?) RETURNING id",
+                               (text, cylinder_type, new_location))
+                cylinder_id, previous_status = cursor.fetchone()[0], None
+            cursor.execute("UPDATE cylinders SET status = 'in_transit' WHERE id = ? RETURNING *", (cylinder_id,))
+            added.append(cursor.fetchone())
+            items.append((transfer_id, cylinder_id, previous_status))
+        cursor.execute("INSERT INTO depot_transfers (transfer_id, direction, depot) VALUES (?, 'in', ?)",
+                       (transfer_id, source_depot))
+        cursor.executemany("INSERT INTO depot_transfer_items (transfer_id, cylinder_id, previous_status) VALUES (?, ?, ?)", items)
+        _catalog_put(conn, added)
+        return len(items)
+
+def finish_transfer(transfer_id, commit, conn=None):
+    """Phase two at either depot: commit or abort a prepared transfer.
+
+    Committing leaves sent cylinders 'transferred' and makes received ones
+    available; aborting puts every cylinder back as it was. Returns False when
+    the transfer is not prepared here (already finished or unknown).
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT direction FROM depot_transfers WHERE transfer_id = ? AND state = 'prepared'", (transfer_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        cursor.execute("SELECT cylinder_id, previous_status FROM depot_transfer_items WHERE transfer_id = ?", (transfer_id,))
+        items = cursor.fetchall()
+        if row[0] == 'out':
+            moves = [(cylinder_id, 'transferred' if commit else 'available') for cylinder_id, _ in items]
+        elif commit:
+            moves = [(cylinder_id, 'available') for cylinder_id, _ in items]
+        else:
+            moves = [(cylinder_id, previous_status) for cylinder_id, previous_status in items if previous_status]
+            added = [cylinder_id for cylinder_id, previous_status in items if previous_status is None]
+            for chunk in _chunks(added):
+                delete_cylinders(chunk, allowed_from=('in_transit',), conn=conn)
+        for status in {status for _, status in moves}:
+            for chunk in _chunks([cylinder_id for cylinder_id, to_status in moves if to_status == status]):
+                update_cylinder_status(chunk, status, allowed_from=('in_transit',), conn=conn)
+        cursor.execute("UPDATE depot_transfers SET state = ?, finished_at = CURRENT_TIMESTAMP WHERE transfer_id = ?",
+                       ('committed' if commit else 'aborted', transfer_id))
+        return True
+
+def get_depot_transfers(state=None, transfer_id=None, conn=None):
+    """Get (transfer_id, direction, depot, state, cylinders, created_at, finished_at) rows, newest first."""
+    conditions, params = [], []
+    if state is not None:
+        conditions.append("t.state = ?")
+        params.append(state)
+    if transfer_id is not None:
+        conditions.append("t.transfer_id = ?")
+        params.append(transfer_id)
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT t.transfer_id, t.direction, t.depot, t.state,
+                   (SELECT COUNT(*) FROM depot_transfer_items i WHERE i.transfer_id = t.transfer_id),
+                   t.created_at, t.finished_at
+            FROM depot_transfers t
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            ORDER BY t.created_at DESC, t.transfer_id DESC
+        ''', params)
+        return cursor.fetchall()
+
+# Reporting replicas
+def _replica_position(path):
+    """(applied_seq, applied_at) recorded in a replica file, or None when it cannot be read."""
+    if not os.path.exists(path):
+        return None
+    try:
+        replica = sqlite3.connect(path)
+        try:
+            return replica.execute("SELECT applied_seq, applied_at FROM replica_state").fetchone()
+        finally:
+            replica.close()
+    except sqlite3.Error:
+        return None
+
+def get_replication_status(conn=None):
+    """Get (path, applied_seq, pending_changes, lag_seconds, applied_at) for each registered replica.
+
+    lag_seconds is the age of the oldest change not yet applied (0 when caught up).
+    """
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT path, applied_seq, shipped_at FROM replicas ORDER BY path")
+        status = []
+        for path, applied_seq, shipped_at in cursor.fetchall():
+            applied_seq, applied_at = _replica_position(path) or (applied_seq, shipped_at)
+            cursor.execute('''
+                SELECT COUNT(*), COALESCE(ROUND((julianday('now') - julianday(MIN(changed_at))) * 86400, 1), 0)
+                FROM change_log WHERE seq > ?
+            ''', (applied_seq,))
+            status.append((path, applied_seq, *cursor.fetchone(), applied_at))
+    return status
+
+# Maintenance
+def analyze_database():
+    """Refresh the query planner statistics."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT d.id, d.dc_number, d.customer_id, d.cylinder_id, d.dispatch_date, d.return_date, d.dispatch_notes, d.return_notes, d.status, d.grade, d.vehicle_number, d.created_at, cy.cylinder_id as cylinder_id_text
-        FROM dispatches d
-        JOIN cylinders cy ON d.cylinder_id = cy.id
-        WHERE d.customer_id = ?
-        ORDER BY d.dispatch_date DESC
-    ''', (customer_id,))
-    dispatches = cursor.fetchall()
-    conn.close()
-    return dispatches
+    try:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+    finally:
+        conn.close()
+
+def vacuum_database():
+    """Rebuild the database file to reclaim free pages; returns (bytes before, bytes after)."""
+    before = os.path.getsize(DATABASE_FILE)
+    conn = get_connection()
+    try:
+        conn.execute("VACUUM")
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return before, os.path.getsize(DATABASE_FILE)
 
 # Authentication
-def authenticate_user(username, password):
+def authenticate_user(username, password, conn=None):
     """Authenticate user."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ? AND password_hash = ?", (username, password))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    with _transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE username = ? AND password_hash = ?", (username, password))
+        user = cursor.fetchone()
+        return user
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Depot routing for Cylinder Management System
+Each depot keeps its own database file, listed in the depot registry
+(DEPOTS_FILE, a JSON object of depot name to database file). A terminal or
+service works in one depot by pointing DATABASE_FILE at that depot's file
+(CMS_DEPOT for the GUI, --depot for the service).
+
+DepotRouter sends an operation for a depot to that depot's file, fans
+cross-depot reports out to every depot in parallel and merges the results,
+and moves cylinders between depots as two-phase transfers:
+
+1. prepare: the sending depot holds the cylinders 'in_transit' and records
+   the transfer; then the receiving depot adds them 'in_transit' and records
+   it too. If the receiving side fails, the sending side is aborted.
+2. finish: once both sides are prepared the transfer is committed at the
+   receiving depot and then at the sending depot.
+
+A transfer interrupted between the steps stays prepared on one or both sides.
+recover_transfers() commits it when both depots have it and aborts it
+otherwise; run it while no transfer is in progress.
+
+    python depots.py add NAME FILE
+    python depots.py list
+    python depots.py report OPERATION [ARG ...]
+    python depots.py transfer SOURCE TARGET CYLINDER [CYLINDER ...] [--location TEXT]
+    python depots.py transfers
+    python depots.py recover
+"""
+
+import argparse
+import json
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import database
+from backend import READ_OPERATIONS, WRITE_OPERATIONS
+
+DEPOTS_FILE = os.environ.get('CMS_DEPOTS_FILE', 'depots.json')
+
+
+def load_depots(path=None):
+    """The registered depots as {name: database file}; empty when there is no registry."""
+    path = path or DEPOTS_FILE
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_depots(depots, path=None):
+    """Write the registry atomically."""
+    path = path or DEPOTS_FILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(depots, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def depot_file(name, path=None):
+    """The database file of a registered depot."""
+    depots = load_depots(path)
+    if name not in depots:
+        raise ValueError(f"Unknown depot '{name}'")
+    return depots[name]
+
+
+class DepotRouter:
+    """Runs database operations against per-depot database files."""
+    def __init__(self, depots=None):
+        self.depots = dict(load_depots() if depots is None else depots)
+
+    def path(self, depot):
+        if depot not in self.depots:
+            raise ValueError(f"Unknown depot '{depot}'")
+        return self.depots[depot]
+
+    def init(self):
+        """Create or upgrade every depot's schema."""
+        for path in self.depots.values():
+            database.init_database(path)
+
+    def _run(self, depot, func, *args, write=False, **kwargs):
+        """Run func in one transaction on the depot's database.
+
+        The explicit transaction also keeps the operation off the cylinder
+        catalog, which caches DATABASE_FILE only; its write-through callbacks
+        run only when the depot is that file.
+        """
+        path = self.path(depot)
+        conn = database.get_connection(path)
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                result = func(*args, conn=conn, **kwargs)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if os.path.abspath(path) == os.path.abspath(database.DATABASE_FILE):
+                database.run_commit_callbacks(conn)
+            return result
+        finally:
+            database.discard_commit_callbacks(conn)
+            conn.close()
+
+    def call(self, depot, operation, *args, **kwargs):
+        """Run a backend read or write operation for one depot."""
+        if operation not in READ_OPERATIONS and operation not in WRITE_OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}")
+        return self._run(depot, getattr(database, operation), *args, write=operation in WRITE_OPERATIONS, **kwargs)
+
+    def fan_out(self, operation, *args, **kwargs):
+        """Run a read operation on every depot in parallel; returns {depot: result} in registry order."""
+        if operation not in READ_OPERATIONS:
+            raise ValueError(f"Not a read operation: {operation}")
+        with ThreadPoolExecutor(max_workers=max(1, len(self.depots))) as pool:
+            futures = {depot: pool.submit(self.call, depot, operation, *args, **kwargs) for depot in self.depots}
+            return {depot: future.result() for depot, future in futures.items()}
+
+    def report(self, operation, *args, key=None, **kwargs):
+        """Fan a row-returning read out to every depot and merge the rows, each prefixed with its depot.
+
+        Rows keep each depot's order, depot after depot, unless key sorts the merged rows.
+        """
+        rows = [(depot, *row) for depot, result in self.fan_out(operation, *args, **kwargs).items() for row in result]
+        return sorted(rows, key=key) if key else rows
+
+    def dashboard_counters(self):
+        """get_dashboard_counters summed over every depot; customers_out is keyed by (depot, customer_id)."""
+        merged = {'status': {}, 'type': {}, 'customers_out': {}, 'open_dcs': 0, 'total': 0}
+        for depot, counters in self.fan_out('get_dashboard_counters').items():
+            for counter in ('status', 'type'):
+                for name, value in counters[counter].items():
+                    merged[counter][name] = merged[counter].get(name, 0) + value
+            for customer_id, value in counters['customers_out'].items():
+                merged['customers_out'][(depot, customer_id)] = value
+            merged['open_dcs'] += counters['open_dcs']
+            merged['total'] += counters['total']
+        return merged
+
+    def transfer_cylinders(self, source, target, cylinder_ids, location=None):
+        """Move available cylinders from source to target depot in two phases; returns the transfer ID.
+
+        location replaces the cylinders' location at the target when given.
+        Raises ValueError (with nothing moved) when a cylinder is unknown or
+        not available at the source, or its cylinder_id is in use at the target.
+        """
+        if source == target:
+            raise ValueError("Source and target depot are the same")
+        self.path(target)
+        transfer_id = f"T{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        rows = self._run(source, database.prepare_transfer_out, transfer_id, target, cylinder_ids, write=True)
+        try:
+            self._run(target, database.prepare_transfer_in, transfer_id, source, rows, location, write=True)
+        except BaseException:
+            self._run(source, database.finish_transfer, transfer_id, False, write=True)
+            raise
+        self._run(target, database.finish_transfer, transfer_id, True, write=True)
+        self._run(source, database.finish_transfer, transfer_id, True, write=True)
+        return transfer_id
+
+    def _transfer_state(self, depot, transfer_id):
+        rows = self._run(depot, database.get_depot_transfers, transfer_id=transfer_id)
+        return rows[0][3] if rows else None
+
+    def recover_transfers(self):
+        """Finish the transfers left prepared by an interruption; returns [(transfer_id, committed)]."""
+        recovered = []
+        for depot in self.depots:
+            for transfer_id, direction, other, *_ in self._run(depot, database.get_depot_transfers, state='prepared'):
+                if self._transfer_state(depot, transfer_id) != 'prepared':
+                    continue  # finished while resolving its other side
+                source, target = (depot, other) if direction == 'out' else (other, depot)
+                states = {source: self._transfer_state(source, transfer_id),
+                          target: self._transfer_state(target, transfer_id)}
+                commit = all(state in ('prepared', 'committed') for state in states.values())
+                for side in (target, source):
+                    if states[side] == 'prepared':
+                        self._run(side, database.finish_transfer, transfer_id, commit, write=True)
+                recovered.append((transfer_id, commit))
+        return recovered
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Cylinder Management System depots")
+    parser.add_argument('--depots', default=DEPOTS_FILE, help="depot registry file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="register a depot and create its database")
+    add.add_argument('name')
+    add.add_argument('file')
+    commands.add_parser('list', help="list depots with their cylinder counts")
+    report = commands.add_parser('report', help="run a read operation on every depot and merge the rows")
+    report.add_argument('operation')
+    report.add_argument('args', nargs='*')
+    transfer = commands.add_parser('transfer', help="move available cylinders between depots")
+    transfer.add_argument('source')
+    transfer.add_argument('target')
+    transfer.add_argument('cylinders', nargs='+', help="cylinder IDs at the source depot")
+    transfer.add_argument('--location', help="location of the cylinders at the target depot")
+    commands.add_parser('transfers', help="list transfers at every depot")
+    commands.add_parser('recover', help="finish transfers left prepared by an interruption")
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        depots = load_depots(args.depots)
+        depots[args.name] = args.file
+        database.init_database(args.file)
+        save_depots(depots, args.depots)
+        print(f"Depot {args.name}: {args.file}")
+        return 0
+
+    router = DepotRouter(load_depots(args.depots))
+    if not router.depots:
+        print(f"No depots registered in {args.depots}", file=sys.stderr)
+        return 1
+    router.init()
+    try:
+        if args.command == 'list':
+            for depot, counters in router.fan_out('get_dashboard_counters').items():
+                print(f"{depot:<16} {router.depots[depot]:<32} {counters['total']:6d} cylinders  "
+                      f"{counters['status'].get('available', 0):6d} available  {counters['open_dcs']:4d} open DCs")
+        elif args.command == 'report':
+            for row in router.report(args.operation, *args.args):
+                print("\t".join('' if value is None else str(value) for value in row))
+        elif args.command == 'transfer':
+            transfer_id = router.transfer_cylinders(args.source, args.target, args.cylinders, args.location)
+            print(f"Transferred {len(args.cylinders)} cylinders from {args.source} to {args.target} ({transfer_id})")
+        elif args.command == 'transfers':
+            for row in router.report('get_depot_transfers', key=lambda row: row[6] or ''):
+                depot, transfer_id, direction, other, state, cylinders, created_at, finished_at = row
+                print(f"{created_at}  {transfer_id}  {depot} {'->' if direction == 'out' else '<-'} {other}  "
+                      f"{cylinders} cylinders  {state}")
+        elif args.command == 'recover':
+            recovered = router.recover_transfers()
+            for transfer_id, committed in recovered:
+                print(f"{transfer_id}: {'committed' if committed else 'aborted'}")
+            print(f"{len(recovered)} transfers recovered")
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,8 @@ Customer Management Frame for Cylinder Management System
 
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-from database import add_customer, get_all_customers, update_customer, delete_customer, search_customers
+from backend import add_customer, get_all_customers, update_customer, delete_customer, search_customers
+from backend import get_customer_holdings, get_holdings_totals, check_holdings_consistency
 from models.customer import Customer
 
 class CustomerManagementFrame(ttk.Frame):
@@ -56,6 +57,19 @@ class CustomerManagementFrame(ttk.Frame):
                  bg='#2196F3', fg='white', relief='raised', bd=1, padx=15, pady=5,
                  command=self.load_customers).pack(side=tk.LEFT, padx=5)
 
+        tk.Button(buttons_frame, text="Verify Holdings", font=("Arial", 9, "bold"),
+                 bg='#607D8B', fg='white', relief='raised', bd=1, padx=15, pady=5,
+                 command=self.verify_holdings).pack(side=tk.LEFT, padx=5)
+
+        # Holdings panel for the selected customer
+        holdings_frame = tk.LabelFrame(self, text="Current Holdings",
+                                      font=("Arial", 10, "bold"), bg='#f8f9fa',
+                                      fg='#2c3e50', relief='solid', bd=1)
+        holdings_frame.pack(fill=tk.X, padx=15, pady=(0, 5))
+        self.holdings_label = tk.Label(holdings_frame, text="Select a customer to see cylinders currently held",
+                                       font=("Arial", 9), bg='#f8f9fa', fg='#2c3e50', anchor='w', justify=tk.LEFT)
+        self.holdings_label.pack(fill=tk.X, padx=10, pady=5)
+
         # Customer list frame
         list_frame = tk.LabelFrame(self, text="Customer List",
                                   font=("Arial", 10, "bold"), bg='#ffffff',
@@ -63,7 +77,7 @@ class CustomerManagementFrame(ttk.Frame):
         list_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=(0, 15))
 
         # Treeview for customers
-        columns = ('ID', 'Name', 'Contact Info', 'Address', 'Notes')
+        columns = ('ID', 'Name', 'Contact Info', 'Address', 'Notes', 'Cylinders Held')
         self.tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=18)
 
         # Style the treeview
@@ -81,6 +95,8 @@ class CustomerManagementFrame(ttk.Frame):
                 self.tree.column(col, width=150)
             elif col == 'Address':
                 self.tree.column(col, width=200)
+            elif col == 'Cylinders Held':
+                self.tree.column(col, width=110, anchor='center')
             else:  # Notes
                 self.tree.column(col, width=200)
 
@@ -102,6 +118,8 @@ class CustomerManagementFrame(ttk.Frame):
 
         # Bind double-click to edit
         self.tree.bind('<Double-1>', lambda e: self.edit_customer())
+        # Show holdings of the selected customer
+        self.tree.bind('<<TreeviewSelect>>', self.on_customer_select)
 
     def load_customers(self):
         """Load customers from database."""
@@ -109,9 +127,11 @@ class CustomerManagementFrame(ttk.Frame):
             self.tree.delete(item)
 
         self.customers = get_all_customers()
+        holdings_totals = get_holdings_totals()
         for customer_row in self.customers:
             customer = Customer.from_db_row(customer_row)
-            values = (customer.id, customer.name, customer.contact_info, customer.address, customer.notes)
+            values = (customer.id, customer.name, customer.contact_info, customer.address, customer.notes,
+                      holdings_totals.get(customer.id, 0))
             self.tree.insert('', tk.END, values=values)
 
     def on_search(self, event=None):
@@ -124,13 +144,45 @@ class CustomerManagementFrame(ttk.Frame):
 
             # Load search results
             search_results = search_customers(query)
+            holdings_totals = get_holdings_totals()
             for customer_row in search_results:
                 customer = Customer.from_db_row(customer_row)
-                values = (customer.id, customer.name, customer.contact_info, customer.address, customer.notes)
+                values = (customer.id, customer.name, customer.contact_info, customer.address, customer.notes,
+                          holdings_totals.get(customer.id, 0))
                 self.tree.insert('', tk.END, values=values)
         else:
             self.load_customers()
 
+    def on_customer_select(self, event=None):
+        """Show the cylinders currently held by the selected customer."""
+        selected_item = self.tree.selection()
+        if not selected_item:
+            return
+        values = self.tree.item(selected_item[0])['values']
+        holdings = get_customer_holdings(values[0])
+        if holdings:
+            balance = ", ".join(f"{cylinder_type}: {quantity}" for cylinder_type, quantity in holdings)
+            self.holdings_label.config(text=f"{values[1]} holds {sum(q for _, q in holdings)} cylinder(s) - {balance}")
+        else:
+            self.holdings_label.config(text=f"{values[1]} holds no cylinders")
+
+    def verify_holdings(self):
+        """Check the holdings ledger against dispatch records and offer to repair drift."""
+        try:
+            drift = check_holdings_consistency()
+            if not drift:
+                messagebox.showinfo("Holdings Verified", "Customer holdings match dispatch records.")
+                return
+            names = {row[0]: row[1] for row in self.customers}
+            details = "\n".join(f"{names.get(customer_id, customer_id)} / {cylinder_type}: recorded {recorded}, actual {actual}"
+                                for customer_id, cylinder_type, recorded, actual in drift)
+            if messagebox.askyesno("Holdings Drift", f"Found {len(drift)} mismatched holding(s):\n{details}\n\nRebuild holdings from dispatch records?"):
+                check_holdings_consistency(repair=True)
+                self.load_customers()
+                messagebox.showinfo("Success", "Customer holdings rebuilt.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to verify holdings: {e}")
+
     def add_customer(self):
         """Add new customer dialog."""
         dialog = CustomerDialog(self, "Add Customer")
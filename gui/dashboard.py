@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Dashboard Frame for Cylinder Management System
+Shows the refill and maintenance work queue: depth, average wait and daily
+throughput, and moves batches of cylinders through the stages.
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+from backend import (get_cylinders_by_status, get_all_customers, get_dashboard_counters, get_work_queue_stats, get_work_queue_daily,
+                     get_work_batches, create_work_batch, advance_work_batch, get_turnaround_report)
+
+# How often the live counters are re-read while the dashboard is visible
+LIVE_REFRESH_MS = 5000
+
+COUNTER_STATUSES = ['available', 'dispatched', 'returned', 'refill', 'maintenance']
+
+class DashboardFrame(ttk.Frame):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.customer_names = {}
+        self.create_widgets()
+        self.load_dashboard()
+        self.after(LIVE_REFRESH_MS, self.live_refresh)
+
+    def _tree(self, parent, columns, widths, height):
+        tree = ttk.Treeview(parent, columns=columns, show='headings', height=height)
+        for col, width in zip(columns, widths):
+            tree.heading(col, text=col)
+            tree.column(col, width=width, anchor='center')
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        return tree
+
+    def create_widgets(self):
+        """Create dashboard widgets."""
+        title_label = tk.Label(self, text="Refill & Maintenance Dashboard",
+                              font=("Arial", 14, "bold"), fg='#2c3e50', bg='#f8f8f8')
+        title_label.pack(pady=10)
+
+        counts_frame = tk.LabelFrame(self, text="Live Counts", font=("Arial", 10, "bold"),
+                                    bg='#f8f9fa', fg='#2c3e50', relief='solid', bd=1)
+        counts_frame.pack(fill=tk.X, padx=15, pady=5)
+        self.count_labels = {}
+        for key in ['total'] + COUNTER_STATUSES + ['open_dcs']:
+            title = {'total': 'Total', 'open_dcs': 'Open DCs'}.get(key, key.capitalize())
+            box = tk.Frame(counts_frame, bg='#f8f9fa')
+            box.pack(side=tk.LEFT, padx=12, pady=5)
+            tk.Label(box, text=title, font=("Arial", 9), bg='#f8f9fa', fg='#2c3e50').pack()
+            self.count_labels[key] = tk.Label(box, text="0", font=("Arial", 14, "bold"), bg='#f8f9fa', fg='#1976D2')
+            self.count_labels[key].pack()
+        self.products_tree = self._tree(counts_frame, ('Product', 'Cylinders'), (110, 80), 4)
+        self.products_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.customers_out_tree = self._tree(counts_frame, ('Customer', 'Cylinders Out'), (160, 100), 4)
+        self.customers_out_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        top_frame = tk.Frame(self, bg='#f8f8f8')
+        top_frame.pack(fill=tk.X, padx=15, pady=5)
+
+        stats_frame = tk.LabelFrame(top_frame, text="Work Queue", font=("Arial", 10, "bold"),
+                                   bg='#f8f9fa', fg='#2c3e50', relief='solid', bd=1)
+        stats_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 5))
+        self.stats_tree = self._tree(stats_frame, ('Stage', 'In Queue', 'Entered', 'Completed', 'Avg Wait (h)'),
+                                     (110, 80, 80, 80, 100), 3)
+
+        daily_frame = tk.LabelFrame(top_frame, text="Daily Throughput (last 14 days)", font=("Arial", 10, "bold"),
+                                   bg='#f8f9fa', fg='#2c3e50', relief='solid', bd=1)
+        daily_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5, 0))
+        self.daily_tree = self._tree(daily_frame, ('Date', 'Stage', 'Entered', 'Completed', 'Avg Wait (h)'),
+                                     (100, 110, 80, 80, 100), 6)
+
+        bottom_frame = tk.Frame(self, bg='#f8f8f8')
+        bottom_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+
+        returned_frame = tk.LabelFrame(bottom_frame, text="Returned Cylinders", font=("Arial", 10, "bold"),
+                                      bg='#f8f9fa', fg='#2c3e50', relief='solid', bd=1)
+        returned_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 5))
+        self.returned_tree = self._tree(returned_frame, ('ID', 'Cylinder ID', 'Product', 'Location'),
+                                        (50, 120, 120, 150), 12)
+        returned_buttons = tk.Frame(returned_frame, bg='#f8f9fa')
+        returned_buttons.pack(fill=tk.X, padx=10, pady=5)
+        tk.Button(returned_buttons, text="Send to Refill", font=("Arial", 9, "bold"),
+                 bg='#009688', fg='white', relief='raised', bd=1, padx=10, pady=3,
+                 command=lambda: self.create_batch('refill')).pack(side=tk.LEFT, padx=5)
+        tk.Button(returned_buttons, text="Send to Maintenance", font=("Arial", 9, "bold"),
+                 bg='#FF9800', fg='white', relief='raised', bd=1, padx=10, pady=3,
+                 command=lambda: self.create_batch('maintenance')).pack(side=tk.LEFT, padx=5)
+
+        batches_frame = tk.LabelFrame(bottom_frame, text="Open Batches", font=("Arial", 10, "bold"),
+                                     bg='#f8f9fa', fg='#2c3e50', relief='solid', bd=1)
+        batches_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5, 0))
+        self.batches_tree = self._tree(batches_frame, ('Batch', 'Stage', 'Cylinders', 'Waiting', 'Created', 'Notes'),
+                                       (60, 100, 80, 70, 150, 150), 12)
+        batch_buttons = tk.Frame(batches_frame, bg='#f8f9fa')
+        batch_buttons.pack(fill=tk.X, padx=10, pady=5)
+        tk.Button(batch_buttons, text="Complete Batch", font=("Arial", 9, "bold"),
+                 bg='#4CAF50', fg='white', relief='raised', bd=1, padx=10, pady=3,
+                 command=self.complete_batch).pack(side=tk.LEFT, padx=5)
+        tk.Button(batch_buttons, text="Refresh", font=("Arial", 9, "bold"),
+                 bg='#2196F3', fg='white', relief='raised', bd=1, padx=10, pady=3,
+                 command=self.load_dashboard).pack(side=tk.LEFT, padx=5)
+        tk.Button(batch_buttons, text="Turnaround Report", font=("Arial", 9, "bold"),
+                 bg='#9C27B0', fg='white', relief='raised', bd=1, padx=10, pady=3,
+                 command=self.show_turnaround).pack(side=tk.LEFT, padx=5)
+
+    def load_counters(self):
+        """Show the materialized counters."""
+        counters = get_dashboard_counters()
+        for status in COUNTER_STATUSES:
+            self.count_labels[status].config(text=str(counters['status'].get(status, 0)))
+        self.count_labels['total'].config(text=str(counters['total']))
+        self.count_labels['open_dcs'].config(text=str(counters['open_dcs']))
+
+        self.products_tree.delete(*self.products_tree.get_children())
+        for product, count in sorted(counters['type'].items()):
+            self.products_tree.insert('', tk.END, values=(product, count))
+        self.customers_out_tree.delete(*self.customers_out_tree.get_children())
+        for customer_id, count in sorted(counters['customers_out'].items(), key=lambda item: item[1], reverse=True):
+            name = self.customer_names.get(customer_id, f"Customer {customer_id}")
+            self.customers_out_tree.insert('', tk.END, values=(name, count))
+
+    def live_refresh(self):
+        """Re-read the counters periodically while the dashboard is on screen."""
+        if self.winfo_ismapped():
+            try:
+                self.load_counters()
+            except Exception:
+                pass  # Keep polling; a busy database or service will answer next time
+        self.after(LIVE_REFRESH_MS, self.live_refresh)
+
+    def load_dashboard(self):
+        """Load counters, queue statistics, returned cylinders and open batches."""
+        self.customer_names = {customer[0]: customer[1] for customer in get_all_customers()}
+        self.load_counters()
+        for tree in (self.stats_tree, self.daily_tree, self.returned_tree, self.batches_tree):
+            tree.delete(*tree.get_children())
+        for row in get_work_queue_stats():
+            self.stats_tree.insert('', tk.END, values=row)
+        for row in get_work_queue_daily():
+            self.daily_tree.insert('', tk.END, values=row)
+        for cylinder in get_cylinders_by_status('returned'):
+            self.returned_tree.insert('', tk.END, values=(cylinder[0], cylinder[1], cylinder[2], cylinder[4]))
+        for batch_id, stage, notes, created_at, completed_at, count, waiting in get_work_batches():
+            self.batches_tree.insert('', tk.END, values=(batch_id, stage, count, waiting or 0, created_at[:16], notes or ''))
+
+    def show_turnaround(self):
+        """Open the turnaround analytics window."""
+        TurnaroundDialog(self, get_turnaround_report())
+
+    def create_batch(self, stage):
+        """Move the selected returned cylinders into a stage as one batch."""
+        selection = self.returned_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select returned cylinders first")
+            return
+        cylinder_ids = [self.returned_tree.item(item)['values'][0] for item in selection]
+        try:
+            batch_id, moved = create_work_batch(cylinder_ids, stage)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if batch_id is None:
+            messagebox.showwarning("Warning", f"None of the selected cylinders can be sent to {stage}")
+        else:
+            skipped = len(cylinder_ids) - len(moved)
+            message = f"Batch {batch_id}: {len(moved)} cylinder(s) sent to {stage}"
+            if skipped:
+                message += f"\n{skipped} cylinder(s) were skipped because their status changed"
+            messagebox.showinfo("Success", message)
+        self.load_dashboard()
+
+    def complete_batch(self):
+        """Mark the selected batch's waiting cylinders available."""
+        selection = self.batches_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a batch first")
+            return
+        batch_id = self.batches_tree.item(selection[0])['values'][0]
+        try:
+            moved = advance_work_batch(batch_id, 'available')
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        messagebox.showinfo("Success", f"Batch {batch_id}: {len(moved)} cylinder(s) now available")
+        self.load_dashboard()
+
+
+class TurnaroundDialog:
+    """Cycle times per cylinder type and cylinder, and return speed per customer (days)."""
+    def __init__(self, parent, report):
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Turnaround Report")
+        self.dialog.geometry("800x500")
+        self.dialog.transient(parent)
+
+        notebook = ttk.Notebook(self.dialog)
+        notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self._add_tab(notebook, "By Product", ('Product', 'Cycles', 'Avg', 'P50', 'P90', 'Max'),
+                      report['types'])
+        self._add_tab(notebook, "By Cylinder", ('ID', 'Cylinder ID', 'Product', 'Cycles', 'Avg Cycle',
+                                                'Avg Out', 'Avg Refill/Maint.', 'Last Cycle'),
+                      report['cylinders'])
+        self._add_tab(notebook, "Customer Returns", ('Customer ID', 'Customer', 'Returns', 'Avg', 'P50', 'P90', 'Max'),
+                      report['customers'])
+
+        tk.Button(self.dialog, text="Close", font=("Arial", 9, "bold"), bg='#9E9E9E', fg='white',
+                 relief='raised', bd=1, padx=10, pady=3, command=self.dialog.destroy).pack(pady=(0, 10))
+
+    def _add_tab(self, notebook, title, columns, rows):
+        frame = ttk.Frame(notebook)
+        notebook.add(frame, text=title)
+        tree = ttk.Treeview(frame, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=90, anchor='center')
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        for row in rows:
+            tree.insert('', tk.END, values=row)
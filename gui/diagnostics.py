@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+UI diagnostics for Cylinder Management System
+Times every Python callback Tk runs (event bindings, widget commands, after()
+callbacks), measures Tk main-loop stalls with an after() heartbeat and shows
+the worst offenders in a hidden diagnostics window (Ctrl+Shift+D). Time a
+callback spends waiting in a modal dialog (wait_window, message boxes, file
+dialogs) is the user's, not the handler's, and is left out.
+
+    CMS_UI_BUDGET_MS=100    handler budget in milliseconds
+    CMS_UI_PROFILE=1        capture a cProfile of the next call of any handler over budget
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import time
+from collections import deque
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog, commondialog
+from backend import get_catalog_stats, get_replication_status
+
+HANDLER_BUDGET_MS = float(os.environ.get('CMS_UI_BUDGET_MS', '100'))
+PROFILE_SLOW_HANDLERS = os.environ.get('CMS_UI_PROFILE', '') not in ('', '0')
+HEARTBEAT_MS = 50
+HISTORY_SIZE = 200
+PROFILE_LINES = 30
+
+
+class HandlerStats:
+    """Rolling timings for one GUI handler."""
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.over_budget = 0
+        self.recent = deque(maxlen=HISTORY_SIZE)
+        self.profile = None
+
+    def observe(self, elapsed_ms):
+        """Record one call."""
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent.append(elapsed_ms)
+        if elapsed_ms > HANDLER_BUDGET_MS:
+            self.over_budget += 1
+
+    def percentile(self, fraction):
+        """Percentile of the recent calls."""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_dict(self):
+        """Convert to a JSON-serializable dictionary."""
+        return {
+            'handler': self.name,
+            'calls': self.calls,
+            'avg_ms': round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+            'p95_ms': round(self.percentile(0.95), 2),
+            'max_ms': round(self.max_ms, 2),
+            'over_budget': self.over_budget,
+            'profile': self.profile,
+        }
+
+
+class UIProfiler:
+    """Registry of handler timings and main-loop stalls."""
+    def __init__(self):
+        self.handlers = {}
+        self.stalls = deque(maxlen=HISTORY_SIZE)
+        self.max_stall_ms = 0.0
+        self.capture_profiles = PROFILE_SLOW_HANDLERS
+        self.profile_next = set()
+        self.last_handler = None
+        self.last_handler_end = 0.0
+        self._active = []  # modal milliseconds to exclude, one entry per handler running
+        self._profiling = False
+        self._expected_tick = None
+
+    def call(self, name, func, args, kwargs):
+        """Run a handler, timing it without its modal waits and profiling it when it was flagged."""
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats(name)
+
+        profiler = None
+        if name in self.profile_next and not self._profiling:
+            self.profile_next.discard(name)
+            profiler = cProfile.Profile()
+            self._profiling = True
+
+        self._active.append(0.0)
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                return profiler.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            elapsed_ms = (end - start) * 1000 - self._active.pop()
+            stats.observe(elapsed_ms)
+            self.last_handler = name
+            self.last_handler_end = end
+            if profiler is not None:
+                self._profiling = False
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+                stats.profile = output.getvalue()
+            elif self.capture_profiles and elapsed_ms > HANDLER_BUDGET_MS:
+                self.profile_next.add(name)
+
+    def exclude(self, elapsed_ms):
+        """Leave time spent in a modal wait out of the handler that opened it."""
+        if self._active:
+            self._active[-1] += elapsed_ms
+
+    def start_heartbeat(self, root, interval_ms=HEARTBEAT_MS):
+        """Measure main-loop stalls as the lateness of a periodic after() callback."""
+        def tick():
+            now = time.perf_counter()
+            if self._expected_tick is not None:
+                lag_ms = (now - self._expected_tick) * 1000
+                if lag_ms > interval_ms:
+                    culprit = self.last_handler if self.last_handler_end >= self._expected_tick - interval_ms / 1000 else None
+                    self.stalls.append({'at': time.strftime('%H:%M:%S'), 'stall_ms': round(lag_ms, 1),
+                                        'handler': culprit or 'unknown'})
+                    self.max_stall_ms = max(self.max_stall_ms, lag_ms)
+            self._expected_tick = now + interval_ms / 1000
+            root.after(interval_ms, tick)
+        tick.untimed = True
+        root.after(interval_ms, tick)
+
+    def report(self, limit=None):
+        """Handlers ordered from worst to best by maximum duration."""
+        entries = sorted((s.to_dict() for s in self.handlers.values()), key=lambda e: e['max_ms'], reverse=True)
+        return entries[:limit] if limit else entries
+
+    def reset(self):
+        """Forget all timings and stalls."""
+        self.handlers.clear()
+        self.stalls.clear()
+        self.max_stall_ms = 0.0
+        self.profile_next.clear()
+
+    def dump(self, path):
+        """Write the report and recent stalls to a JSON file."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'budget_ms': HANDLER_BUDGET_MS,
+                'max_stall_ms': round(self.max_stall_ms, 1),
+                'handlers': self.report(),
+                'stalls': list(self.stalls),
+            }, f, indent=2)
+
+
+profiler = UIProfiler()
+
+
+def _callback_function(func):
+    """The function behind a Tk callback; after() registers a closure around the function it schedules."""
+    code = getattr(func, '__code__', None)
+    if code is not None and code.co_name == 'callit' and 'func' in code.co_freevars:
+        func = func.__closure__[code.co_freevars.index('func')].cell_contents
+    return getattr(func, '__func__', func)
+
+
+class TimedCallWrapper(tk.CallWrapper):
+    """tkinter.CallWrapper timing the callback in the process-wide profiler, named by its qualified name."""
+    def __init__(self, func, subst, widget):
+        super().__init__(func, subst, widget)
+        function = _callback_function(func)
+        self.name = None if getattr(function, 'untimed', False) else getattr(
+            function, '__qualname__', type(function).__qualname__)
+
+    def __call__(self, *args):
+        if self.name is None:
+            return super().__call__(*args)
+        return profiler.call(self.name, super().__call__, args, {})
+
+
+def _modal(method):
+    """Wrap a blocking dialog method so its wait is excluded from the calling handler."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            profiler.exclude((time.perf_counter() - start) * 1000)
+    wrapper.modal = True
+    return wrapper
+
+
+def instrument_callbacks():
+    """Time every Tk callback registered from now on; call before creating any window."""
+    # tkinter looks CallWrapper up in its module each time a callback is registered
+    tk.CallWrapper = TimedCallWrapper
+    for cls, method in ((tk.Misc, 'wait_window'), (tk.Misc, 'wait_variable'), (tk.Misc, 'wait_visibility'),
+                        (commondialog.Dialog, 'show')):
+        if not getattr(getattr(cls, method), 'modal', False):
+            setattr(cls, method, _modal(getattr(cls, method)))
+
+
+def install_diagnostics(root):
+    """Start the stall heartbeat and bind Ctrl+Shift+D to the diagnostics window."""
+    profiler.start_heartbeat(root)
+    root.bind_all('<Control-Shift-D>', lambda e: DiagnosticsWindow(root))
+
+
+class DiagnosticsWindow:
+    """Window listing the slowest handlers and recent main-loop stalls."""
+    REFRESH_MS = 1000
+
+    def __init__(self, parent):
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("UI Diagnostics")
+        self.dialog.geometry("900x600")
+        self.create_widgets()
+        self.auto_refresh()
+
+    def create_widgets(self):
+        """Create dialog widgets."""
+        self.summary_label = ttk.Label(self.dialog, text="")
+        self.summary_label.pack(fill=tk.X, padx=10, pady=5)
+
+        columns = ('Handler', 'Calls', 'Avg ms', 'P95 ms', 'Max ms', 'Over Budget', 'Profile')
+        self.tree = ttk.Treeview(self.dialog, columns=columns, show='headings', height=12)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=320 if col == 'Handler' else 80, anchor='w' if col == 'Handler' else 'center')
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.tree.bind('<Double-1>', self.show_profile)
+
+        ttk.Label(self.dialog, text="Recent main-loop stalls:").pack(anchor='w', padx=10)
+        self.stalls_list = tk.Listbox(self.dialog, height=8)
+        self.stalls_list.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        button_frame = ttk.Frame(self.dialog)
+        button_frame.pack(pady=5)
+        self.capture_var = tk.BooleanVar(value=profiler.capture_profiles)
+        ttk.Checkbutton(button_frame, text="Profile handlers over budget", variable=self.capture_var,
+                        command=self.toggle_capture).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Dump to File", command=self.dump).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Reset", command=self.reset).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", command=self.dialog.destroy).pack(side=tk.LEFT, padx=5)
+
+    def auto_refresh(self):
+        """Reload the report periodically while the window is open."""
+        if not self.dialog.winfo_exists():
+            return
+        self.refresh()
+        self.dialog.after(self.REFRESH_MS, self.auto_refresh)
+
+    def refresh(self):
+        """Reload the report."""
+        try:
+            catalog = get_catalog_stats()
+            catalog_text = (f"Catalog cache: {catalog['hit_rate'] * 100:.1f}% hits, "
+                            f"{catalog['reloads']} reloads    ")
+        except Exception:
+            catalog_text = ""
+        try:
+            replica_text = "".join(f"Replica: {pending} changes, {lag_seconds:.1f} s behind    "
+                                   for path, applied_seq, pending, lag_seconds, applied_at in get_replication_status())
+        except Exception:
+            replica_text = ""
+        self.summary_label.config(text=f"Handler budget: {HANDLER_BUDGET_MS:.0f} ms    "
+                                       f"Worst main-loop stall: {profiler.max_stall_ms:.1f} ms    "
+                                       f"{catalog_text}{replica_text}"
+                                       f"Double-click a profiled handler to view its profile")
+        for item in self.tree.get_children():
+            self.tree.delete(item)
+        for entry in profiler.report():
+            self.tree.insert('', tk.END, iid=entry['handler'], values=(
+                entry['handler'], entry['calls'], entry['avg_ms'], entry['p95_ms'], entry['max_ms'],
+                entry['over_budget'], 'yes' if entry['profile'] else ''))
+        self.stalls_list.delete(0, tk.END)
+        for stall in reversed(profiler.stalls):
+            self.stalls_list.insert(tk.END, f"{stall['at']}  {stall['stall_ms']} ms  after {stall['handler']}")
+
+    def show_profile(self, event=None):
+        """Show the captured cProfile output of the selected handler."""
+        selection = self.tree.selection()
+        if not selection:
+            return
+        stats = profiler.handlers.get(selection[0])
+        if not stats or not stats.profile:
+            messagebox.showinfo("No Profile", "No profile captured for this handler yet.", parent=self.dialog)
+            return
+        profile_dialog = tk.Toplevel(self.dialog)
+        profile_dialog.title(f"Profile - {stats.name}")
+        profile_dialog.geometry("900x500")
+        text = tk.Text(profile_dialog, wrap=tk.NONE, font=('Courier', 9))
+        text.pack(fill=tk.BOTH, expand=True)
+        text.insert(tk.END, stats.profile)
+        text.config(state=tk.DISABLED)
+
+    def toggle_capture(self):
+        """Enable or disable cProfile capture for handlers over budget."""
+        profiler.capture_profiles = self.capture_var.get()
+
+    def dump(self):
+        """Dump the report to a JSON file."""
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            title="Save UI Diagnostics",
+            initialfile=f"ui_diagnostics_{time.strftime('%Y-%m-%d_%H%M%S')}.json",
+            parent=self.dialog
+        )
+        if file_path:
+            profiler.dump(file_path)
+            messagebox.showinfo("Success", f"Diagnostics saved to {file_path}", parent=self.dialog)
+
+    def reset(self):
+        """Clear collected timings."""
+        profiler.reset()
+        self.refresh()
@@ -7,8 +7,13 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
 import os
-from database import dispatch_cylinders, return_cylinders, get_all_dispatches, get_all_customers, get_cylinders_by_status, get_dispatched_cylinders_by_dc, generate_dc_number, get_connection
+from backend import dispatch_cylinders, return_cylinders, get_all_dispatches, get_all_customers, get_all_cylinders, get_cylinders_by_status, get_dispatched_cylinders_by_dc, generate_dc_number
+from backend import find_cylinder_id, resolve_cylinders, get_open_dispatches_for_cylinders, return_dispatched_cylinders, get_cylinders_with_last_dispatch, get_bill_data_for_dc, get_bill_data_for_company
+from backend import get_cylinder_aging, get_customer_aging_summary, get_rental_rates, set_rental_rate, get_dc_numbers
+from database import AGING_BUCKETS
 from models.dispatch import Dispatch
+from gui.selection import SelectionModel, ListboxView
+from history_index import CylinderHistoryIndex
 from models.customer import Customer
 try:
     from openpyxl import Workbook
@@ -16,15 +21,9 @@ except ImportError:
     messagebox.showerror("Missing Library", "openpyxl is required for Excel export. Please install it with: pip install openpyxl")
     Workbook = None
 
-try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib import colors
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.styles import getSampleStyleSheet
-except ImportError:
+import bills
+if not bills.reportlab_available():
     messagebox.showerror("Missing Library", "reportlab is required for PDF generation. Please install it with: pip install reportlab")
-    SimpleDocTemplate = None
 
 class DispatchTrackingFrame(ttk.Frame):
     def __init__(self, parent):
@@ -32,15 +31,18 @@ class DispatchTrackingFrame(ttk.Frame):
         self.dispatches = []
         self.customers = []
         self.available_cylinders = []
+        self.available_by_id = {}
+        self.selection = SelectionModel()  # Cylinders selected for dispatch, keyed by database ID
         self.selected_items = set()  # For checkbox selection
         self.cyl_history_selected = set()  # For available cylinders history selection
+        self.history_index = CylinderHistoryIndex()  # Filter index for the available cylinders history
         self.available_company_filter_var = tk.StringVar(value="All")
         self.available_dc_filter_var = tk.StringVar(value="All")
         self.load_customers()
         self.load_available_cylinders()
         self.create_widgets()
         self.load_dispatches()
-        self.load_available_cylinders_history()
+        self.refresh_history_index()
 
     def generate_dc_number(self):
         """Generate a unique DC number."""
@@ -113,17 +115,24 @@ class DispatchTrackingFrame(ttk.Frame):
         # Frame for listbox and scrollbar
         cylinder_frame = tk.Frame(dispatch_frame)
         cylinder_frame.grid(row=5, column=1, padx=5, pady=3, sticky="ew")
+        # Bulk selection controls below the listbox
+        select_frame = tk.Frame(cylinder_frame)
+        select_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(3, 0))
+        ttk.Button(select_frame, text="Select All", command=self.select_all_cylinders).pack(side=tk.LEFT)
+        ttk.Button(select_frame, text="Clear", command=self.clear_cylinder_selection).pack(side=tk.LEFT, padx=3)
+        self.select_type_var = tk.StringVar()
+        self.select_type_combo = ttk.Combobox(select_frame, textvariable=self.select_type_var, values=[], state="readonly", width=10)
+        self.select_type_combo.pack(side=tk.LEFT, padx=(6, 0))
+        ttk.Button(select_frame, text="Select Type", command=self.select_cylinders_by_type).pack(side=tk.LEFT, padx=3)
         # Listbox for multiple cylinder selection
-        self.cylinder_listbox = tk.Listbox(cylinder_frame, selectmode=tk.MULTIPLE, height=4, width=32)
+        # exportselection off so clicking elsewhere does not clear the selection
+        self.cylinder_listbox = tk.Listbox(cylinder_frame, selectmode=tk.MULTIPLE, height=4, width=32, exportselection=False)
         self.cylinder_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         cylinder_scrollbar = tk.Scrollbar(cylinder_frame, orient=tk.VERTICAL, command=self.cylinder_listbox.yview)
         self.cylinder_listbox.config(yscrollcommand=cylinder_scrollbar.set)
         cylinder_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.cylinder_listbox.bind('<<ListboxSelect>>', lambda e: self.on_available_cylinder_select())
-        self.cylinder_listbox.bind('<<ListboxUnselect>>', lambda e: self.on_available_cylinder_deselect())
-        # Populate listbox
-        for cylinder in self.available_cylinders:
-            self.cylinder_listbox.insert(tk.END, f"{cylinder[0]} - {cylinder[1]} ({cylinder[2]})")
+        self.available_view = ListboxView(self.cylinder_listbox)
 
         tk.Label(dispatch_frame, text="Manual Cylinder IDs:").grid(row=6, column=0, padx=5, pady=3, sticky="w")
         self.manual_cylinder_entry = tk.Entry(dispatch_frame, width=30)
@@ -141,6 +150,8 @@ class DispatchTrackingFrame(ttk.Frame):
         self.selected_cylinders_listbox.config(yscrollcommand=selected_scrollbar.set)
         selected_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.selected_cylinders_listbox.bind('<Double-1>', self.remove_selected_cylinder)
+        self.selected_view = ListboxView(self.selected_cylinders_listbox)
+        self.show_available_cylinders()
 
         # Configure grid weights for dispatch frame
         dispatch_frame.grid_columnconfigure(1, weight=1)
@@ -167,6 +178,7 @@ class DispatchTrackingFrame(ttk.Frame):
         return_scrollbar = tk.Scrollbar(return_cylinder_frame, orient=tk.VERTICAL, command=self.return_cylinder_listbox.yview)
         self.return_cylinder_listbox.config(yscrollcommand=return_scrollbar.set)
         return_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.return_view = ListboxView(self.return_cylinder_listbox)
 
         tk.Label(return_frame, text="Return Date:").grid(row=2, column=0, padx=5, pady=3, sticky="w")
         self.return_date_entry = tk.Entry(return_frame, width=30)
@@ -216,6 +228,7 @@ class DispatchTrackingFrame(ttk.Frame):
         btn_frame = ttk.Frame(filter_frame)
         btn_frame.pack(side=tk.RIGHT, padx=5)
         ttk.Button(btn_frame, text="Return Selected", command=self.return_selected_cylinders).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(btn_frame, text="Aging Report", command=self.show_aging_report).pack(side=tk.RIGHT, padx=2)
         ttk.Button(btn_frame, text="Generate Bill", command=self.generate_bill).pack(side=tk.RIGHT, padx=2)
         ttk.Button(btn_frame, text="Export to Excel", command=self.export_to_excel).pack(side=tk.RIGHT, padx=2)
         ttk.Button(btn_frame, text="Refresh", command=self.load_dispatches).pack(side=tk.RIGHT, padx=2)
@@ -317,7 +330,7 @@ class DispatchTrackingFrame(ttk.Frame):
         self.available_dc_filter_combo.pack(side=tk.LEFT, padx=5)
         self.available_dc_filter_combo.bind('<<ComboboxSelected>>', self.load_available_cylinders_history)
 
-        ttk.Button(filter_cyl_frame, text="Refresh", command=self.load_available_cylinders_history).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(filter_cyl_frame, text="Refresh", command=lambda: self.refresh_history_index()).pack(side=tk.RIGHT, padx=5)
         
         # Treeview container with scrollbars
         cyl_tree_container = ttk.Frame(available_container)
@@ -391,64 +404,44 @@ class DispatchTrackingFrame(ttk.Frame):
         self.cyl_history_tree.tag_configure('refill', foreground='#6A1B9A')      # Purple
         self.cyl_history_tree.tag_configure('maintenance', foreground='#546E7A') # Gray
 
+    def refresh_history_index(self, cylinder_ids=None):
+        """Rebuild the history filter index, or update only cylinder_ids, and redisplay it."""
+        if cylinder_ids is None:
+            self.history_index.build(get_cylinders_with_last_dispatch())
+        else:
+            cylinder_ids = list(cylinder_ids)
+            self.history_index.update(cylinder_ids, get_cylinders_with_last_dispatch(cylinder_ids=cylinder_ids))
+        self.load_available_cylinders_history()
+
     def load_available_cylinders_history(self, event=None):
-        """Load available cylinders with their dispatch history for reference during dispatch."""
+        """Show the cylinders matching the history filters from the in-memory index."""
         # Check if the filter variable exists (may not exist if called before widgets are created)
         if not hasattr(self, 'available_filter_var'):
             return
+        if not self.history_index.loaded:
+            self.refresh_history_index()
+            return
 
         filter_status = self.available_filter_var.get()
         filter_company = self.available_company_filter_var.get()
         filter_dc = self.available_dc_filter_var.get()
+        cylinders = self.history_index.rows(
+            status=None if filter_status == "All" else filter_status,
+            customer_id=None if filter_company == "All" else int(filter_company.split(' - ')[0]),
+            dc_number=None if filter_dc == "All" else filter_dc)
 
         # Clear current items
-        for item in self.cyl_history_tree.get_children():
-            self.cyl_history_tree.delete(item)
+        self.cyl_history_tree.delete(*self.cyl_history_tree.get_children())
 
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Get all cylinders with their current status
-        if filter_status == "All":
-            cursor.execute("SELECT id, cylinder_id, cylinder_type, status, location FROM cylinders ORDER BY cylinder_id")
-        else:
-            cursor.execute("SELECT id, cylinder_id, cylinder_type, status, location FROM cylinders WHERE status = ? ORDER BY cylinder_id", (filter_status,))
-
-        cylinders = cursor.fetchall()
-
-        for cyl_id, cylinder_id_text, cyl_type, status, location in cylinders:
-            # Get last dispatch history for this cylinder
-            cursor.execute('''
-                SELECT d.dc_number, c.id, c.name, d.dispatch_date, d.return_date, d.grade
-                FROM dispatches d
-                JOIN customers c ON d.customer_id = c.id
-                WHERE d.cylinder_id = ?
-                ORDER BY d.dispatch_date DESC
-                LIMIT 1
-            ''', (cyl_id,))
-            history = cursor.fetchone()
-
-            if history:
-                last_dc, last_customer_id, last_customer, last_dispatch_date, last_return_date, last_grade = history
-            else:
+        for (cyl_id, cylinder_id_text, cyl_type, status, location, last_dc, last_customer_id,
+             last_customer, last_dispatch_date, last_return_date, last_grade) in cylinders:
+            if last_dc is None:
                 last_dc = "N/A"
-                last_customer_id = None
                 last_customer = "N/A"
                 last_dispatch_date = "N/A"
                 last_return_date = "N/A"
                 last_grade = "N/A"
 
-            # Apply company filter
-            if filter_company != "All":
-                company_id = int(filter_company.split(' - ')[0])
-                if last_customer_id != company_id:
-                    continue
-
-            # Apply DC filter
-            if filter_dc != "All":
-                if last_dc != filter_dc:
-                    continue
-
             current_location = location if location else "Warehouse"
 
             # Determine if this cylinder is selected
@@ -471,8 +464,6 @@ class DispatchTrackingFrame(ttk.Frame):
                 last_grade or 'N/A'
             ), tags=(status_tag, cyl_id_str, selection_tag))  # Store status, cyl_id, and selection as tags
 
-        conn.close()
-
     def load_customers(self):
         """Load customers for dispatch combo."""
         self.customers = get_all_customers()
@@ -485,30 +476,43 @@ class DispatchTrackingFrame(ttk.Frame):
     def load_available_cylinders(self):
         """Load available cylinders for dispatch listbox."""
         self.available_cylinders = get_cylinders_by_status('available')
-        # Update the listbox display
-        if hasattr(self, 'cylinder_listbox'):
-            self.cylinder_listbox.delete(0, tk.END)
-            for cylinder in self.available_cylinders:
-                self.cylinder_listbox.insert(tk.END, f"{cylinder[0]} - {cylinder[1]} ({cylinder[2]})")
-        
-        # Remove any dispatched cylinders from the selected cylinders listbox
-        if hasattr(self, 'selected_cylinders_listbox'):
-            # Get currently selected cylinder IDs from the listbox
-            selected_to_remove = []
-            for i in range(self.selected_cylinders_listbox.size()):
-                cylinder_text = self.selected_cylinders_listbox.get(i)
-                cylinder_id = int(cylinder_text.split(' - ')[0])
-                # Check if this cylinder is still available
-                if not any(c[0] == cylinder_id for c in self.available_cylinders):
-                    selected_to_remove.append(i)
-            
-            # Remove in reverse order to preserve indices
-            for index in reversed(selected_to_remove):
-                self.selected_cylinders_listbox.delete(index)
-        
-        # Also refresh the available cylinders history (only if widgets exist)
-        if hasattr(self, 'cyl_history_tree'):
-            self.load_available_cylinders_history()
+        self.available_by_id = {cylinder[0]: cylinder for cylinder in self.available_cylinders}
+        # Drop selected cylinders that are no longer available (e.g. just dispatched)
+        dropped = self.selection.retain(self.available_by_id)
+        if hasattr(self, 'selected_view'):
+            self.selected_view.remove(dropped)
+            self.show_available_cylinders()
+
+    def show_available_cylinders(self):
+        """Fill the available listbox and re-apply the current selection to it."""
+        self.available_view.set_rows(self.available_cylinders)
+        self.available_view.select(self.selection.ids())
+        self.select_type_combo['values'] = sorted({cylinder[2] for cylinder in self.available_cylinders})
+
+    def change_selection(self, add_rows=(), remove_ids=()):
+        """Add and remove cylinders from the dispatch selection, patching only the affected listbox rows."""
+        added = self.selection.add(add_rows)
+        removed = self.selection.remove(remove_ids)
+        self.selected_view.remove(removed)
+        self.selected_view.append(added)
+        self.available_view.deselect(removed)
+        self.available_view.select([row[0] for row in added])
+
+    def select_all_cylinders(self):
+        """Select every available cylinder for dispatch."""
+        self.change_selection(add_rows=self.available_cylinders)
+
+    def select_cylinders_by_type(self):
+        """Select every available cylinder of the chosen type for dispatch."""
+        cylinder_type = self.select_type_var.get()
+        if not cylinder_type:
+            messagebox.showerror("Error", "Please choose a cylinder type.")
+            return
+        self.change_selection(add_rows=[c for c in self.available_cylinders if c[2] == cylinder_type])
+
+    def clear_cylinder_selection(self):
+        """Deselect all cylinders."""
+        self.change_selection(remove_ids=self.selection.ids())
 
     def load_dispatches(self):
         """Load dispatches from database."""
@@ -526,14 +530,11 @@ class DispatchTrackingFrame(ttk.Frame):
                       dispatch.cylinder_type, dispatch.grade or '', dispatch.vehicle_number or '', dispatch.dispatch_date, dispatch.return_date, dispatch.status, delete_text)
             self.tree.insert('', tk.END, values=values, tags=tags)
 
-        # Update DC combo with unique DC numbers that have dispatched cylinders
-        dc_numbers = list(set(d[1] for d in self.dispatches if d[8] == 'dispatched'))
-        dc_numbers.sort(reverse=True)
-        self.dc_combo['values'] = dc_numbers
+        # Update DC combo with DC numbers that have dispatched cylinders
+        self.dc_combo['values'] = get_dc_numbers(open_only=True)
 
         # Update DC filter combo
-        all_dc_numbers = list(set(d[1] for d in self.dispatches))
-        all_dc_numbers.sort(reverse=True)
+        all_dc_numbers = get_dc_numbers()
         self.dc_filter_combo['values'] = ["All"] + all_dc_numbers
         if hasattr(self, 'available_dc_filter_combo'):
             self.available_dc_filter_combo['values'] = ["All"] + all_dc_numbers
@@ -541,10 +542,6 @@ class DispatchTrackingFrame(ttk.Frame):
         # Apply current filters
         self.on_filter_change()
         
-        # Also refresh the available cylinders history (only if widgets exist)
-        if hasattr(self, 'cyl_history_tree'):
-            self.load_available_cylinders_history()
-
     def generate_bill(self):
         """Generate a bill for the selected DC or company."""
         company_selection = self.company_filter_var.get()
@@ -556,8 +553,7 @@ class DispatchTrackingFrame(ttk.Frame):
             if not bill_data:
                 messagebox.showinfo("No Data", f"No dispatches found for DC {dc_selection}.")
                 return
-            customer_name = bill_data['customer_name']
-            bill_title = f"Bill for DC {dc_selection} - {customer_name}"
+            bill_title = bills.dc_bill_title(dc_selection, bill_data)
         elif company_selection != "All":
             # Generate bill for specific company
             customer_id = int(company_selection.split(' - ')[0])
@@ -566,7 +562,7 @@ class DispatchTrackingFrame(ttk.Frame):
             if not bill_data:
                 messagebox.showinfo("No Data", f"No dispatches found for {customer_name}.")
                 return
-            bill_title = f"Bill for {customer_name}"
+            bill_title = bills.company_bill_title(bill_data)
         else:
             messagebox.showerror("Error", "Please select a specific DC or company to generate bill.")
             return
@@ -576,130 +572,25 @@ class DispatchTrackingFrame(ttk.Frame):
 
     def get_bill_data_for_dc(self, dc_number):
         """Get bill data for a specific DC number."""
-        conn = get_connection()
-        cursor = conn.cursor()
-        # Get customer info from dispatches
-        cursor.execute('''
-            SELECT DISTINCT c.id, c.name, c.contact_info, c.address
-            FROM dispatches d
-            JOIN customers c ON d.customer_id = c.id
-            WHERE d.dc_number = ?
-        ''', (dc_number,))
-        customer_row = cursor.fetchone()
-        if not customer_row:
-            conn.close()
-            return None
-        customer_id, customer_name, contact_info, address = customer_row
-
-        # Get dispatches
-        cursor.execute('''
-            SELECT d.dc_number, d.dispatch_date, d.return_date, d.status, cy.cylinder_id, cy.cylinder_type, d.grade, d.vehicle_number, d.dispatch_notes, d.return_notes
-            FROM dispatches d
-            JOIN cylinders cy ON d.cylinder_id = cy.id
-            WHERE d.dc_number = ?
-            ORDER BY d.dispatch_date DESC
-        ''', (dc_number,))
-        dispatches = cursor.fetchall()
-        conn.close()
-
-        return {
-            'customer_id': customer_id,
-            'customer_name': customer_name,
-            'contact_info': contact_info,
-            'address': address,
-            'dispatches': dispatches
-        }
+        return get_bill_data_for_dc(dc_number)
 
     def create_pdf_bill(self, bill_title, bill_data):
         """Create a professional PDF bill."""
-        if SimpleDocTemplate is None:
+        if not bills.reportlab_available():
             messagebox.showerror("Error", "reportlab is not installed. Cannot generate PDF.")
             return
 
-        # Default filename
-        customer_name_clean = bill_data['customer_name'].replace(' ', '_')
-        default_name = f"{customer_name_clean}_Bill_{datetime.now().strftime('%Y-%m-%d')}.pdf"
-
         file_path = filedialog.asksaveasfilename(
             defaultextension=".pdf",
             filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
             title="Save Bill as PDF",
-            initialfile=default_name
+            initialfile=bills.default_filename(bill_data)
         )
         if not file_path:
             return
 
         try:
-            doc = SimpleDocTemplate(file_path, pagesize=letter)
-            styles = getSampleStyleSheet()
-            story = []
-
-            # Title
-            title_style = styles['Heading1']
-            title_style.alignment = 1  # Center
-            story.append(Paragraph(bill_title, title_style))
-            story.append(Spacer(1, 12))
-
-            # Company Title and Subtitle
-            company_title = "SPEC GASES & EQUIPMENTS"
-            company_subtitle = "Door No. 2-4, Plot No. 408, Near Ganesh Kaman, B.N. Reddy Nagar, Cherlapally, Hyderabad - 500 051. Mobile : 98491 28904, 99491 22206 E-mail : spec_equipe@rediffmail.com"
-            story.append(Paragraph(company_title, title_style))
-            story.append(Paragraph(company_subtitle, styles['Normal']))
-            story.append(Spacer(1, 12))
-
-            # Company Header
-            company_info = f"<b>Customer:</b> {bill_data['customer_name']}<br/>"
-            if bill_data['contact_info']:
-                company_info += f"<b>Contact:</b> {bill_data['contact_info']}<br/>"
-            if bill_data['address']:
-                company_info += f"<b>Address:</b> {bill_data['address']}<br/>"
-            story.append(Paragraph(company_info, styles['Normal']))
-            story.append(Spacer(1, 12))
-
-            # Generated on
-            story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-            story.append(Spacer(1, 12))
-
-            # Table data
-            data = [['DC Number', 'Cylinder ID', 'Type', 'Grade', 'Vehicle Number', 'Dispatch Date', 'Return Date', 'Status']]
-            total_cylinders = 0
-            dispatched_count = 0
-            returned_count = 0
-
-            for dc, disp_date, ret_date, status, cyl_id, cyl_type, grade, vehicle_number, disp_notes, ret_notes in bill_data['dispatches']:
-                data.append([dc, cyl_id, cyl_type, grade or '', vehicle_number or '', disp_date, ret_date or '', status])
-                total_cylinders += 1
-                if status == 'dispatched':
-                    dispatched_count += 1
-                elif status == 'returned':
-                    returned_count += 1
-
-            # Create table
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(table)
-            story.append(Spacer(1, 12))
-
-            # Summary
-            summary = f"""
-            <b>Summary:</b><br/>
-            Total Cylinders: {total_cylinders}<br/>
-            Currently Dispatched: {dispatched_count}<br/>
-            Returned: {returned_count}
-            """
-            story.append(Paragraph(summary, styles['Normal']))
-
-            # Build PDF
-            doc.build(story)
+            bills.write_pdf(file_path, bill_title, bill_data)
 
             messagebox.showinfo("Success", f"Bill saved to {file_path}")
 
@@ -723,34 +614,7 @@ class DispatchTrackingFrame(ttk.Frame):
 
     def get_bill_data_for_company(self, customer_id):
         """Get bill data for a specific company."""
-        conn = get_connection()
-        cursor = conn.cursor()
-        # Get customer info
-        cursor.execute('SELECT name, contact_info, address FROM customers WHERE id = ?', (customer_id,))
-        customer_row = cursor.fetchone()
-        if not customer_row:
-            conn.close()
-            return None
-        customer_name, contact_info, address = customer_row
-
-        # Get dispatches
-        cursor.execute('''
-            SELECT d.dc_number, d.dispatch_date, d.return_date, d.status, cy.cylinder_id, cy.cylinder_type, d.grade, d.vehicle_number, d.dispatch_notes, d.return_notes
-            FROM dispatches d
-            JOIN cylinders cy ON d.cylinder_id = cy.id
-            WHERE d.customer_id = ?
-            ORDER BY d.dc_number DESC, d.dispatch_date DESC
-        ''', (customer_id,))
-        dispatches = cursor.fetchall()
-        conn.close()
-
-        return {
-            'customer_id': customer_id,
-            'customer_name': customer_name,
-            'contact_info': contact_info,
-            'address': address,
-            'dispatches': dispatches
-        }
+        return get_bill_data_for_company(customer_id)
 
     def export_to_excel(self):
         """Export the current dispatch history to Excel."""
@@ -797,6 +661,119 @@ class DispatchTrackingFrame(ttk.Frame):
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export: {e}")
 
+    def show_aging_report(self):
+        """Show cylinder holding aging and rental charges per customer."""
+        report_dialog = tk.Toplevel(self)
+        report_dialog.title("Cylinder Aging & Rental Report")
+        report_dialog.geometry("1000x650")
+
+        # As-of date and rate controls
+        controls = ttk.Frame(report_dialog)
+        controls.pack(fill=tk.X, padx=10, pady=5)
+
+        ttk.Label(controls, text="As of (DD-MM-YYYY):").pack(side=tk.LEFT, padx=(0, 5))
+        as_of_entry = tk.Entry(controls, width=12)
+        as_of_entry.insert(0, datetime.now().strftime("%d-%m-%Y"))
+        as_of_entry.pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(controls, text="Rate for Type:").pack(side=tk.LEFT, padx=(20, 5))
+        rate_type_var = tk.StringVar()
+        rate_type_combo = ttk.Combobox(controls, textvariable=rate_type_var, width=18)
+        rate_type_combo.pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Per Day:").pack(side=tk.LEFT, padx=(5, 5))
+        rate_entry = tk.Entry(controls, width=8)
+        rate_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Free Days:").pack(side=tk.LEFT, padx=(5, 5))
+        free_days_entry = tk.Entry(controls, width=5)
+        free_days_entry.pack(side=tk.LEFT, padx=5)
+
+        # Customer summary
+        summary_frame = ttk.LabelFrame(report_dialog, text="Customer Aging (buckets: cylinders held on the as-of date; Total Days and Rental include returned cylinders)", padding=5)
+        summary_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        bucket_labels = [f"{label} days" for label, _, _ in AGING_BUCKETS]
+        summary_columns = ('Customer',) + tuple(bucket_labels) + ('Held', 'Total Days', 'Rental')
+        summary_tree = ttk.Treeview(summary_frame, columns=summary_columns, show='headings', height=8)
+        for col in summary_columns:
+            summary_tree.heading(col, text=col)
+            summary_tree.column(col, width=180 if col == 'Customer' else 90, anchor='w' if col == 'Customer' else 'center')
+        summary_scrollbar = ttk.Scrollbar(summary_frame, orient=tk.VERTICAL, command=summary_tree.yview)
+        summary_tree.configure(yscrollcommand=summary_scrollbar.set)
+        summary_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        summary_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Per-cylinder detail
+        detail_frame = ttk.LabelFrame(report_dialog, text="Cylinder Days Out (select a customer above to filter)", padding=5)
+        detail_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        detail_columns = ('DC Number', 'Customer', 'Cylinder ID', 'Type', 'Dispatch Date', 'Return Date', 'Days Out', 'Bucket', 'Rental')
+        detail_tree = ttk.Treeview(detail_frame, columns=detail_columns, show='headings', height=10)
+        for col in detail_columns:
+            detail_tree.heading(col, text=col)
+            detail_tree.column(col, width=100)
+        detail_scrollbar = ttk.Scrollbar(detail_frame, orient=tk.VERTICAL, command=detail_tree.yview)
+        detail_tree.configure(yscrollcommand=detail_scrollbar.set)
+        detail_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        detail_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        def load_details(event=None):
+            selection = summary_tree.selection()
+            customer_id = int(selection[0]) if selection else None
+            try:
+                rows = get_cylinder_aging(as_of_entry.get().strip(), customer_id=customer_id)
+            except ValueError as e:
+                messagebox.showerror("Validation Error", str(e), parent=report_dialog)
+                return
+            for item in detail_tree.get_children():
+                detail_tree.delete(item)
+            for row in rows:
+                (_, dc, _, customer_name, _, cyl_text, cyl_type, disp_date, ret_date, _, days_out, bucket, charge) = row
+                detail_tree.insert('', tk.END, values=(dc, customer_name, cyl_text, cyl_type, disp_date, ret_date or '',
+                                                       days_out if days_out is not None else 'N/A', bucket or 'N/A',
+                                                       f"{charge or 0:.2f}"))
+
+        def load_report():
+            try:
+                summary = get_customer_aging_summary(as_of_entry.get().strip())
+            except ValueError as e:
+                messagebox.showerror("Validation Error", str(e), parent=report_dialog)
+                return
+            for item in summary_tree.get_children():
+                summary_tree.delete(item)
+            for row in summary:
+                customer_id, customer_name = row[0], row[1]
+                counts = row[2:2 + len(AGING_BUCKETS)]
+                held, total_days, rental = row[2 + len(AGING_BUCKETS):]
+                summary_tree.insert('', tk.END, iid=str(customer_id),
+                                    values=(customer_name,) + tuple(counts) + (held, total_days, f"{rental:.2f}"))
+            rate_type_combo['values'] = sorted({r[0] for r in get_rental_rates()} |
+                                               {c[2] for c in get_all_cylinders()})
+            load_details()
+
+        def on_rate_type_selected(event=None):
+            for cylinder_type, daily_rate, free_days in get_rental_rates():
+                if cylinder_type == rate_type_var.get():
+                    rate_entry.delete(0, tk.END)
+                    rate_entry.insert(0, str(daily_rate))
+                    free_days_entry.delete(0, tk.END)
+                    free_days_entry.insert(0, str(free_days))
+                    break
+
+        def save_rate():
+            try:
+                set_rental_rate(rate_type_var.get().strip(), float(rate_entry.get() or 0),
+                                int(free_days_entry.get() or 0))
+            except ValueError as e:
+                messagebox.showerror("Validation Error", str(e), parent=report_dialog)
+                return
+            load_report()
+
+        rate_type_combo.bind('<<ComboboxSelected>>', on_rate_type_selected)
+        summary_tree.bind('<<TreeviewSelect>>', load_details)
+        ttk.Button(controls, text="Save Rate", command=save_rate).pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls, text="Refresh", command=load_report).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(report_dialog, text="Close", command=report_dialog.destroy).pack(pady=5)
+
+        load_report()
+
     def on_filter_change(self, event=None):
         """Handle filter change."""
         filter_status = self.filter_var.get()
@@ -836,133 +813,38 @@ class DispatchTrackingFrame(ttk.Frame):
         dc_number = self.dc_var.get()
         if dc_number:
             # Load cylinders for this DC number
-            self.return_cylinder_listbox.delete(0, tk.END)
-            dispatched_cylinders = get_dispatched_cylinders_by_dc(dc_number)
-            for cylinder in dispatched_cylinders:
-                # Get cylinder type from database
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT cylinder_type FROM cylinders WHERE id = ?", (cylinder[0],))
-                cylinder_type = cursor.fetchone()[0]
-                conn.close()
-                self.return_cylinder_listbox.insert(tk.END, f"{cylinder[0]} - {cylinder[1]} ({cylinder_type})")
+            self.return_view.set_rows(get_dispatched_cylinders_by_dc(dc_number))
 
     def resolve_cylinder_id(self, input_id):
         """Resolve input to cylinder database ID. Accepts ID or cylinder_id_text."""
-        conn = get_connection()
-        cursor = conn.cursor()
-        try:
-            # Try as integer ID
-            try:
-                cylinder_id = int(input_id)
-                cursor.execute("SELECT id FROM cylinders WHERE id = ?", (cylinder_id,))
-                result = cursor.fetchone()
-                if result:
-                    return cylinder_id
-            except ValueError:
-                pass
-
-            # Try as cylinder_id_text
-            cursor.execute("SELECT id FROM cylinders WHERE cylinder_id = ?", (input_id,))
-            result = cursor.fetchone()
-            if result:
-                return result[0]
-
-            return None
-        finally:
-            conn.close()
+        return find_cylinder_id(input_id)
 
     def on_available_cylinder_select(self):
-        """Handle cylinder selection from available listbox - add to selected list."""
-        selected_indices = self.cylinder_listbox.curselection()
-        
-        # Get all currently selected cylinder IDs
-        selected_cylinder_ids = set()
-        for i in range(self.selected_cylinders_listbox.size()):
-            cylinder_text = self.selected_cylinders_listbox.get(i)
-            cylinder_id = int(cylinder_text.split(' - ')[0])
-            selected_cylinder_ids.add(cylinder_id)
-        
-        # Add newly selected cylinders
-        for index in selected_indices:
-            cylinder_text = self.cylinder_listbox.get(index)
-            cylinder_id = int(cylinder_text.split(' - ')[0])
-            selected_cylinder_ids.add(cylinder_id)
-        
-        # Rebuild selected listbox with all selected cylinders
-        self.selected_cylinders_listbox.delete(0, tk.END)
-        if selected_cylinder_ids:
-            conn = get_connection()
-            cursor = conn.cursor()
-            for cylinder_id in sorted(selected_cylinder_ids):
-                cursor.execute("SELECT cylinder_id, cylinder_type FROM cylinders WHERE id = ? AND status = 'available'", (cylinder_id,))
-                result = cursor.fetchone()
-                if result:
-                    self.selected_cylinders_listbox.insert(tk.END, f"{cylinder_id} - {result[0]} ({result[1]})")
-            conn.close()
-
-    def on_available_cylinder_deselect(self):
-        """Handle cylinder deselection from available listbox - remove from selected list."""
-        # Get currently selected indices in available listbox
-        selected_indices = set(self.cylinder_listbox.curselection())
-        
-        # Get all cylinder IDs that are still selected in available listbox
-        still_selected_ids = set()
-        for index in selected_indices:
-            cylinder_text = self.cylinder_listbox.get(index)
-            cylinder_id = int(cylinder_text.split(' - ')[0])
-            still_selected_ids.add(cylinder_id)
-        
-        # Remove deselected cylinders from selected listbox
-        # Go in reverse order to preserve indices while deleting
-        for i in range(self.selected_cylinders_listbox.size() - 1, -1, -1):
-            cylinder_text = self.selected_cylinders_listbox.get(i)
-            cylinder_id = int(cylinder_text.split(' - ')[0])
-            if cylinder_id not in still_selected_ids:
-                self.selected_cylinders_listbox.delete(i)
+        """Sync the dispatch selection with the rows selected in the available listbox."""
+        listbox_ids = self.available_view.selected_ids()
+        added = [self.available_by_id[cylinder_id] for cylinder_id in sorted(listbox_ids, key=self.available_view.index_of)
+                 if cylinder_id not in self.selection]
+        removed = [cylinder_id for cylinder_id in self.selection.ids()
+                   if cylinder_id in self.available_view and cylinder_id not in listbox_ids]
+        self.change_selection(added, removed)
 
     def update_selected_cylinders(self):
-        """Update the selected cylinders listbox with current selections."""
-        #self.selected_cylinders_listbox.delete(0, tk.END)
-
-        selected_indices = self.cylinder_listbox.curselection()
+        """Add the manually entered cylinder IDs to the selection."""
         manual_cylinders = self.manual_cylinder_entry.get().strip()
+        if not manual_cylinders:
+            return
+        cylinder_ids = [id.strip() for id in manual_cylinders.split(',') if id.strip()]
 
-        cylinder_ids = set()
+        # Resolve everything in one query and check availability
+        rows = {}
         errors = []
-
-        # From listbox
-        for index in selected_indices:
-            cylinder_text = self.cylinder_listbox.get(index)
-            cylinder_id = int(cylinder_text.split(' - ')[0])
-            cylinder_ids.add(cylinder_id)
-
-        # From manual input
-        if manual_cylinders:
-            manual_ids = [id.strip() for id in manual_cylinders.split(',') if id.strip()]
-            for manual_id in manual_ids:
-                resolved_id = self.resolve_cylinder_id(manual_id)
-                if resolved_id is None:
-                    errors.append(f"Invalid cylinder: {manual_id}")
-                else:
-                    cylinder_ids.add(resolved_id)
-
-        # Check all cylinder_ids for availability and existence
-        valid_cylinder_ids = set()
-        conn = get_connection()
-        cursor = conn.cursor()
-        for cylinder_id in cylinder_ids:
-            cursor.execute("SELECT status, cylinder_id FROM cylinders WHERE id = ?", (cylinder_id,))
-            result = cursor.fetchone()
-            if result:
-                status, cyl_id = result
-                if status == 'available':
-                    valid_cylinder_ids.add(cylinder_id)
-                else:
-                    errors.append(f"Cylinder {cyl_id} (ID: {cylinder_id}) is not available (status: {status})")
+        for input_id, cylinder_id, cyl_id, cylinder_type, status in resolve_cylinders(cylinder_ids):
+            if cylinder_id is None:
+                errors.append(f"Invalid cylinder: {input_id}")
+            elif status != 'available':
+                errors.append(f"Cylinder {cyl_id} (ID: {cylinder_id}) is not available (status: {status})")
             else:
-                errors.append(f"Cylinder ID {cylinder_id} not found")
-        conn.close()
+                rows.setdefault(cylinder_id, (cylinder_id, cyl_id, cylinder_type, status))
 
         # Display errors if any
         if errors:
@@ -970,38 +852,18 @@ class DispatchTrackingFrame(ttk.Frame):
             messagebox.showerror("Cylinder Selection Errors", error_msg)
         else:
             # Clear manual input field if added successfully
-            if manual_cylinders:
-                self.manual_cylinder_entry.delete(0, tk.END)
-
-        # Display valid cylinders, avoiding duplicates
-        if valid_cylinder_ids:
-            # Get currently displayed cylinder IDs to avoid duplicates
-            existing_cylinder_ids = set()
-            for i in range(self.selected_cylinders_listbox.size()):
-                cylinder_text = self.selected_cylinders_listbox.get(i)
-                cylinder_id = int(cylinder_text.split(' - ')[0])
-                existing_cylinder_ids.add(cylinder_id)
-            
-            conn = get_connection()
-            cursor = conn.cursor()
-            for cylinder_id in sorted(valid_cylinder_ids):
-                if cylinder_id not in existing_cylinder_ids:
-                    cursor.execute("SELECT cylinder_id, cylinder_type FROM cylinders WHERE id = ?", (cylinder_id,))
-                    result = cursor.fetchone()
-                    if result:
-                        self.selected_cylinders_listbox.insert(tk.END, f"{cylinder_id} - {result[0]} ({result[1]})")
-            conn.close()
+            self.manual_cylinder_entry.delete(0, tk.END)
+
+        self.change_selection(add_rows=rows.values())
 
     def remove_selected_cylinder(self, event):
         """Remove a cylinder from the selected list on double-click."""
         selection = self.selected_cylinders_listbox.curselection()
         if selection:
-            index = selection[0]
-            cylinder_text = self.selected_cylinders_listbox.get(index)
-            cylinder_id = int(cylinder_text.split(' - ')[0])
-            cylinder_display = cylinder_text.split(' - ')[1].split(' (')[0]  # Get the cylinder_id_text
+            cylinder_id = self.selected_view.id_at(selection[0])
+            cylinder_display = self.selection.row(cylinder_id)[1]
             if messagebox.askyesno("Confirm Removal", f"Do you want to remove cylinder {cylinder_display} from the selected list?"):
-                self.selected_cylinders_listbox.delete(index)
+                self.change_selection(remove_ids=[cylinder_id])
 
     def dispatch_cylinders(self):
         """Dispatch selected cylinders to a customer."""
@@ -1023,7 +885,7 @@ class DispatchTrackingFrame(ttk.Frame):
             messagebox.showerror("Error", "Vehicle Number is mandatory. Please enter the vehicle number.")
             return
 
-        if self.selected_cylinders_listbox.size() == 0:
+        if not self.selection:
             messagebox.showerror("Error", "Please select cylinders to dispatch.")
             return
 
@@ -1035,12 +897,7 @@ class DispatchTrackingFrame(ttk.Frame):
             # Extract customer ID
             customer_id = int(customer_selection.split(' - ')[0])
 
-            # Extract cylinder IDs from selected cylinders listbox
-            cylinder_ids = []
-            for i in range(self.selected_cylinders_listbox.size()):
-                cylinder_text = self.selected_cylinders_listbox.get(i)
-                cylinder_id = int(cylinder_text.split(' - ')[0])
-                cylinder_ids.append(cylinder_id)
+            cylinder_ids = self.selection.ids()
 
             dc_number = self.dc_number_var.get().strip()
             if not dc_number:
@@ -1048,13 +905,14 @@ class DispatchTrackingFrame(ttk.Frame):
             dc_number = dispatch_cylinders(customer_id, cylinder_ids, dispatch_date, dispatch_notes, dc_number, grade, vehicle_number)
             self.load_dispatches()
             self.load_available_cylinders()
+            self.refresh_history_index(cylinder_ids)
 
             self.customer_var.set('')
             # Do not clear DC number
             self.manual_cylinder_entry.delete(0, tk.END)
             self.grade_entry.delete(0, tk.END)
             self.vehicle_number_entry.delete(0, tk.END)
-            self.selected_cylinders_listbox.delete(0, tk.END)  # Clear selected cylinders after successful dispatch
+            self.clear_cylinder_selection()  # Clear selected cylinders after successful dispatch
             messagebox.showinfo("Success", f"Cylinders dispatched successfully under DC {dc_number}.")
         except ValueError as e:
             messagebox.showerror("Validation Error", str(e))
@@ -1094,6 +952,7 @@ class DispatchTrackingFrame(ttk.Frame):
                     dispatch = Dispatch(id=dispatch_id)
                     dispatch.delete()
                     self.load_dispatches()
+                    self.refresh_history_index()
                     messagebox.showinfo("Success", "Dispatch record deleted successfully.")
                 except Exception as e:
                     messagebox.showerror("Error", f"Failed to delete dispatch record: {e}")
@@ -1129,48 +988,27 @@ class DispatchTrackingFrame(ttk.Frame):
         return_notes = ""
         
         try:
-            # Group selected cylinders by DC number
-            dc_groups = {}
-            selected_cylinder_ids = []
-            
-            for cyl_id in self.cyl_history_selected:
-                # Get the last dispatch for this cylinder
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT d.dc_number, d.id
-                    FROM dispatches d
-                    WHERE d.cylinder_id = ? AND d.status = 'dispatched'
-                    ORDER BY d.dispatch_date DESC
-                    LIMIT 1
-                ''', (int(cyl_id),))
-                dispatch = cursor.fetchone()
-                conn.close()
-                
-                if dispatch:
-                    dc_number, dispatch_id = dispatch
-                    if dc_number not in dc_groups:
-                        dc_groups[dc_number] = []
-                    dc_groups[dc_number].append(int(cyl_id))
-                    selected_cylinder_ids.append(int(cyl_id))
-                else:
-                    messagebox.showerror("Error", f"Cylinder {cyl_id} is not currently dispatched.")
-                    return
-            
+            # Find the open DC of every selected cylinder in one query
+            selected_cylinder_ids = sorted(int(cyl_id) for cyl_id in self.cyl_history_selected)
+            open_dispatches = get_open_dispatches_for_cylinders(selected_cylinder_ids)
+            not_dispatched = [str(cyl_id) for cyl_id in selected_cylinder_ids if cyl_id not in open_dispatches]
+            if not_dispatched:
+                messagebox.showerror("Error", f"Cylinders not currently dispatched: {', '.join(not_dispatched)}")
+                return
+
             # Confirmation dialog
             cylinder_ids_str = ', '.join(str(cid) for cid in selected_cylinder_ids)
             if not messagebox.askyesno("Confirm Return", f"Confirm return of cylinders: {cylinder_ids_str}?"):
                 return
-            
-            # Now return for each DC
-            for dc, cyl_ids in dc_groups.items():
-                return_cylinders(dc, cyl_ids, return_date, return_notes)
-            
+
+            # Return from all DCs in one transaction
+            return_dispatched_cylinders(selected_cylinder_ids, return_date, return_notes)
+
             # Clear selection
             self.cyl_history_selected.clear()
             self.load_dispatches()
             self.load_available_cylinders()
-            self.load_available_cylinders_history()
+            self.refresh_history_index(selected_cylinder_ids)
             messagebox.showinfo("Success", "Selected cylinders returned successfully.")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to return cylinders: {e}")
@@ -1195,12 +1033,7 @@ class DispatchTrackingFrame(ttk.Frame):
             return
 
         try:
-            # Extract cylinder IDs
-            cylinder_ids = []
-            for index in selected_indices:
-                cylinder_text = self.return_cylinder_listbox.get(index)
-                cylinder_id = int(cylinder_text.split(' - ')[0])
-                cylinder_ids.append(cylinder_id)
+            cylinder_ids = [self.return_view.id_at(index) for index in selected_indices]
 
             # Confirmation dialog
             cylinder_ids_str = ', '.join(str(cid) for cid in cylinder_ids)
@@ -1210,10 +1043,11 @@ class DispatchTrackingFrame(ttk.Frame):
             return_cylinders(dc_number, cylinder_ids, return_date, return_notes)
             self.load_dispatches()
             self.load_available_cylinders()
+            self.refresh_history_index(cylinder_ids)
 
             # Refresh return section
             self.dc_var.set('')
-            self.return_cylinder_listbox.delete(0, tk.END)
+            self.return_view.set_rows([])
             messagebox.showinfo("Success", "Cylinders returned successfully.")
         except ValueError as e:
             messagebox.showerror("Validation Error", str(e))
@@ -1230,35 +1064,26 @@ class DispatchTrackingFrame(ttk.Frame):
         return_notes = ""
 
         try:
-            # Group selected items by DC number
-            dc_groups = {}
-            selected_cylinder_ids = []
-            for item in self.tree.get_children():
-                values = self.tree.item(item, 'values')
-                dispatch_id = values[1]
-                if dispatch_id in self.selected_items:
-                    dc_number = values[2]
-                    for d in self.dispatches:
-                        if d[0] == dispatch_id and d[8] == 'dispatched':  # Only process dispatched cylinders
-                            cylinder_id = d[3]  # d.cylinder_id
-                            if dc_number not in dc_groups:
-                                dc_groups[dc_number] = []
-                            dc_groups[dc_number].append(cylinder_id)
-                            selected_cylinder_ids.append(cylinder_id)
-                            break
+            # Cylinders of the selected dispatches that are still open
+            dispatches = {str(d[0]): d for d in self.dispatches}
+            selected_cylinder_ids = [dispatches[str(dispatch_id)][3] for dispatch_id in self.selected_items
+                                     if str(dispatch_id) in dispatches and dispatches[str(dispatch_id)][8] == 'dispatched']
+            if not selected_cylinder_ids:
+                messagebox.showerror("Error", "None of the selected dispatches are still open.")
+                return
 
             # Confirmation dialog
             cylinder_ids_str = ', '.join(str(cid) for cid in selected_cylinder_ids)
             if not messagebox.askyesno("Confirm Return", f"Confirm return of cylinders: {cylinder_ids_str}?"):
                 return
 
-            # Now return for each DC
-            for dc, cyl_ids in dc_groups.items():
-                return_cylinders(dc, cyl_ids, return_date, return_notes)
+            # Return from all DCs in one transaction
+            return_dispatched_cylinders(selected_cylinder_ids, return_date, return_notes)
 
             self.selected_items.clear()
             self.load_dispatches()
             self.load_available_cylinders()
+            self.refresh_history_index(selected_cylinder_ids)
             messagebox.showinfo("Success", "Selected cylinders returned successfully.")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to return cylinders: {e}")
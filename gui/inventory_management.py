@@ -4,9 +4,10 @@ Inventory Management Frame for Cylinder Management System
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
-from database import add_cylinder, get_all_cylinders, update_cylinder, delete_cylinder, search_cylinders, get_cylinders_by_status
+from tkinter import ttk, messagebox, filedialog
+from backend import get_all_cylinders, update_cylinder, update_cylinder_status, delete_cylinders, search_cylinders, get_cylinders_by_status, get_status_transitions, get_dashboard_counters
 from models.cylinder import Cylinder
+import intake
 
 class InventoryManagementFrame(ttk.Frame):
     def __init__(self, parent):
@@ -50,6 +51,10 @@ class InventoryManagementFrame(ttk.Frame):
                  bg='#4CAF50', fg='white', relief='raised', bd=1, padx=10, pady=3,
                  command=self.add_cylinder).pack(side=tk.LEFT, padx=5)
 
+        tk.Button(buttons_frame, text="Bulk Intake", font=("Arial", 9, "bold"),
+                 bg='#4CAF50', fg='white', relief='raised', bd=1, padx=10, pady=3,
+                 command=self.bulk_intake).pack(side=tk.LEFT, padx=5)
+
         tk.Button(buttons_frame, text="Edit Cylinder", font=("Arial", 9, "bold"),
                  bg='#FF9800', fg='white', relief='raised', bd=1, padx=10, pady=3,
                  command=self.edit_cylinder).pack(side=tk.LEFT, padx=5)
@@ -257,20 +262,24 @@ class InventoryManagementFrame(ttk.Frame):
             if not cylinder_ids or not cylinder_type.strip():
                 messagebox.showerror("Error", "Cylinder ID(s) and Type are required.")
                 return
-            added_count = 0
-            failed_ids = []
-            for cylinder_id in cylinder_ids:
-                if cylinder_id.strip():
-                    try:
-                        add_cylinder(cylinder_id.strip(), cylinder_type, status, location)
-                        added_count += 1
-                    except Exception as e:
-                        failed_ids.append(cylinder_id.strip())
+            rows = [(0, cylinder_id, None, None, None) for cylinder_id in cylinder_ids]
+            try:
+                result = intake.bulk_intake(rows, cylinder_type, status, location)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to add cylinders: {e}")
+                return
+            self.load_cylinders()
+            if result.accepted:
+                messagebox.showinfo("Success", f"{len(result.accepted)} cylinder(s) added successfully.")
+            if result.rejected:
+                reasons = '\n'.join(f"{cylinder_id or '(blank)'}: {reason}" for line, cylinder_id, reason in result.rejected[:20])
+                messagebox.showwarning("Warning", f"Failed to add {len(result.rejected)} cylinder(s):\n{reasons}")
+
+    def bulk_intake(self):
+        """Open the bulk intake dialog for CSV files and scanner dumps."""
+        dialog = BulkIntakeDialog(self)
+        if dialog.result and dialog.result.accepted:
             self.load_cylinders()
-            if added_count > 0:
-                messagebox.showinfo("Success", f"{added_count} cylinder(s) added successfully.")
-            if failed_ids:
-                messagebox.showwarning("Warning", f"Failed to add cylinders: {', '.join(failed_ids)} (may already exist)")
 
     def edit_cylinder(self):
         """Edit selected cylinder."""
@@ -298,30 +307,21 @@ class InventoryManagementFrame(ttk.Frame):
             messagebox.showwarning("Warning", "Please select cylinders to delete.")
             return
 
-        # Get all cylinders to check status
-        all_cylinders = get_all_cylinders()
-        deletable = []
-        for cid in selected_ids:
-            cid_int = int(cid)
-            for row in all_cylinders:
-                if row[0] == cid_int:
-                    cylinder = Cylinder.from_db_row(row)
-                    if cylinder.status.lower() == 'available':
-                        deletable.append(cid_int)
-                    break
-
-        if not deletable:
-            messagebox.showerror("Error", "No selected cylinders are available for deletion.")
-            return
-
-        if not messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {len(deletable)} selected available cylinders?"):
+        if not messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete the selected available cylinders ({len(selected_ids)} selected)?"):
             return
 
         try:
-            for cid in deletable:
-                delete_cylinder(cid)
+            # Only available cylinders are deleted; the rest are left as they are
+            deleted = delete_cylinders([int(cid) for cid in selected_ids])
+            if not deleted:
+                messagebox.showerror("Error", "No selected cylinders are available for deletion.")
+                return
             self.load_cylinders()
-            messagebox.showinfo("Success", f"{len(deletable)} cylinders deleted successfully.")
+            skipped = len(selected_ids) - len(deleted)
+            message = f"{len(deleted)} cylinders deleted successfully."
+            if skipped:
+                message += f"\n{skipped} selected cylinder(s) were not available and were kept."
+            messagebox.showinfo("Success", message)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to delete cylinders: {e}")
 
@@ -332,50 +332,37 @@ class InventoryManagementFrame(ttk.Frame):
             messagebox.showwarning("Warning", "Please select cylinders to update status.")
             return
 
-        # Get all cylinders from database to search through (not just filtered ones)
-        all_cylinders = get_all_cylinders()
-        
-        # Filter to cylinders with 'refill' or 'returned' status
-        valid_ids = []
-        for cid in selected_ids:
-            # Convert cid to int since treeview values are strings
-            cid_int = int(cid)
-            for row in all_cylinders:
-                if row[0] == cid_int:
-                    cylinder = Cylinder.from_db_row(row)
-                    if cylinder.status in ['refill', 'returned', 'Refill', 'Returned']:
-                        valid_ids.append(cid)
-                    break
-
-        if not valid_ids:
-            messagebox.showerror("Error", "Only cylinders with 'refill' or 'returned' status can be updated.")
-            return
+        # Offer the statuses reachable outside the dispatch and return screens and depot transfers
+        transitions = get_status_transitions()
+        status_options = sorted({to_status for from_status, targets in transitions.items() if from_status != 'new'
+                                 for to_status in targets
+                                 if to_status not in ('dispatched', 'returned', 'in_transit', 'transferred')})
 
         # Show status selection dialog
-        dialog = StatusUpdateDialog(self, len(valid_ids))
+        dialog = StatusUpdateDialog(self, len(selected_ids), status_options)
         if not dialog.result:
             return
 
         new_status = dialog.result
 
         # Confirm update
-        if not messagebox.askyesno("Confirm Update", f"Update status to '{new_status}' for {len(valid_ids)} selected cylinders?"):
+        if not messagebox.askyesno("Confirm Update", f"Update status to '{new_status}' for {len(selected_ids)} selected cylinders?"):
             return
 
         try:
-            updated_count = 0
-            for cid in valid_ids:
-                # Convert cid to int since treeview values are strings
-                cid_int = int(cid)
-                # Find cylinder data from all cylinders
-                for row in all_cylinders:
-                    if row[0] == cid_int:
-                        cylinder = Cylinder.from_db_row(row)
-                        update_cylinder(cid_int, cylinder.cylinder_type, new_status, cylinder.location)
-                        updated_count += 1
-                        break
+            # Only cylinders allowed to move to the new status are changed
+            updated = update_cylinder_status([int(cid) for cid in selected_ids], new_status)
+            allowed_from = [from_status for from_status, targets in transitions.items()
+                            if from_status != 'new' and new_status in targets]
+            if not updated:
+                messagebox.showerror("Error", f"Only cylinders with status {', '.join(allowed_from)} can be set to '{new_status}'.")
+                return
             self.load_cylinders()
-            messagebox.showinfo("Success", f"Status updated to '{new_status}' for {updated_count} cylinders.")
+            skipped = len(selected_ids) - len(updated)
+            message = f"Status updated to '{new_status}' for {len(updated)} cylinders."
+            if skipped:
+                message += f"\n{skipped} selected cylinder(s) were not in status {', '.join(allowed_from)} and were skipped."
+            messagebox.showinfo("Success", message)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to update status: {e}")
 
@@ -418,19 +405,11 @@ class InventoryManagementFrame(ttk.Frame):
 
     def generate_report(self):
         """Generate basic inventory report."""
-        # Count cylinders by status
-        status_counts = {}
-        for status in self.status_options:
-            status_counts[status] = len(get_cylinders_by_status(status))
-
-        total_cylinders = len(get_all_cylinders())
-
-        # Count cylinders by product
-        product_counts = {}
-        for row in get_all_cylinders():
-            cylinder = Cylinder.from_db_row(row)
-            product = cylinder.cylinder_type
-            product_counts[product] = product_counts.get(product, 0) + 1
+        # Read the materialized counters instead of scanning the inventory
+        counters = get_dashboard_counters()
+        status_counts = {status: counters['status'].get(status, 0) for status in self.status_options}
+        total_cylinders = counters['total']
+        product_counts = counters['type']
 
         # Create report dialog
         report_dialog = tk.Toplevel(self)
@@ -459,10 +438,11 @@ class InventoryManagementFrame(ttk.Frame):
 
 class CylinderDialog:
     """Dialog for adding/editing cylinders."""
+    product_options = ['Oxygen', 'Nitrogen', 'Argon', 'Hydrogen', 'Carbon dioxide', 'Zero air', 'Helium', 'Dissolved Acetylene', 'Liquid nitrogen', 'Nitrous oxide', 'Mixtures', 'Medical Oxygen']
+
     def __init__(self, parent, title, cylinder=None):
         self.result = None
         self.status_options = ['available', 'dispatched', 'returned', 'refill', 'maintenance']
-        self.product_options = ['Oxygen', 'Nitrogen', 'Argon', 'Hydrogen', 'Carbon dioxide', 'Zero air', 'Helium', 'Dissolved Acetylene', 'Liquid nitrogen', 'Nitrous oxide', 'Mixtures', 'Medical Oxygen']
         self.dialog = tk.Toplevel(parent)
         self.dialog.title(title)
         self.title = title
@@ -532,11 +512,127 @@ class CylinderDialog:
         self.dialog.destroy()
 
 
+class BulkIntakeDialog:
+    """Dialog for adding cylinders in bulk from a CSV file, scanner dump or pasted scans."""
+    def __init__(self, parent):
+        self.result = None
+        self.file_path = None
+        self.product_options = CylinderDialog.product_options
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Bulk Cylinder Intake")
+        self.dialog.geometry("700x600")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+
+        self.create_widgets()
+        self.dialog.wait_window()
+
+    def create_widgets(self):
+        """Create dialog widgets."""
+        source_frame = ttk.LabelFrame(self.dialog, text="Source", padding=5)
+        source_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(source_frame, text="Choose File...", command=self.choose_file).grid(row=0, column=0, padx=5, pady=3, sticky="w")
+        self.file_label = ttk.Label(source_frame, text="No file chosen - or scan/paste IDs below, one per line")
+        self.file_label.grid(row=0, column=1, padx=5, pady=3, sticky="w")
+        self.scan_text = tk.Text(source_frame, height=8, width=60)
+        self.scan_text.grid(row=1, column=0, columnspan=2, padx=5, pady=3, sticky="ew")
+        source_frame.columnconfigure(1, weight=1)
+
+        defaults_frame = ttk.LabelFrame(self.dialog, text="Defaults for rows without a value", padding=5)
+        defaults_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(defaults_frame, text="Product:").grid(row=0, column=0, padx=5, pady=3, sticky="w")
+        self.product_var = tk.StringVar()
+        ttk.Combobox(defaults_frame, textvariable=self.product_var, values=self.product_options,
+                     state="readonly", width=20).grid(row=0, column=1, padx=5, pady=3)
+        ttk.Label(defaults_frame, text="Status:").grid(row=0, column=2, padx=5, pady=3, sticky="w")
+        self.status_var = tk.StringVar(value='available')
+        ttk.Combobox(defaults_frame, textvariable=self.status_var, values=intake.INTAKE_STATUSES,
+                     state="readonly", width=12).grid(row=0, column=3, padx=5, pady=3)
+        ttk.Label(defaults_frame, text="Location:").grid(row=0, column=4, padx=5, pady=3, sticky="w")
+        self.location_entry = ttk.Entry(defaults_frame, width=15)
+        self.location_entry.grid(row=0, column=5, padx=5, pady=3)
+
+        button_frame = ttk.Frame(self.dialog)
+        button_frame.pack(pady=5)
+        ttk.Button(button_frame, text="Import", command=self.run_intake).pack(side=tk.LEFT, padx=5)
+        self.save_rejects_button = ttk.Button(button_frame, text="Save Rejected...", command=self.save_rejects, state=tk.DISABLED)
+        self.save_rejects_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", command=self.dialog.destroy).pack(side=tk.LEFT, padx=5)
+
+        self.status_label = ttk.Label(self.dialog, text="")
+        self.status_label.pack(fill=tk.X, padx=10)
+
+        columns = ('Line', 'Cylinder ID', 'Reason')
+        self.rejected_tree = ttk.Treeview(self.dialog, columns=columns, show='headings', height=10)
+        for col in columns:
+            self.rejected_tree.heading(col, text=col)
+            self.rejected_tree.column(col, width=60 if col == 'Line' else 200)
+        self.rejected_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+    def choose_file(self):
+        """Choose a CSV file or scanner dump."""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("CSV and text files", "*.csv *.txt"), ("All files", "*.*")],
+            title="Choose Cylinder File",
+            parent=self.dialog
+        )
+        if file_path:
+            self.file_path = file_path
+            self.file_label.config(text=file_path)
+
+    def show_progress(self, processed):
+        """Show the number of rows processed so far."""
+        self.status_label.config(text=f"Processed {processed} row(s)...")
+        self.dialog.update_idletasks()
+
+    def run_intake(self):
+        """Import the chosen file or the scanned IDs."""
+        if self.file_path:
+            rows = intake.read_file(self.file_path)
+        else:
+            text = self.scan_text.get("1.0", tk.END).strip()
+            if not text:
+                messagebox.showerror("Error", "Choose a file or scan some cylinder IDs.", parent=self.dialog)
+                return
+            rows = intake.read_text(text)
+
+        try:
+            self.result = intake.bulk_intake(rows, self.product_var.get(), self.status_var.get(),
+                                             self.location_entry.get().strip(), progress=self.show_progress)
+        except Exception as e:
+            messagebox.showerror("Error", f"Bulk intake failed: {e}", parent=self.dialog)
+            return
+
+        self.status_label.config(text=self.result.summary())
+        for item in self.rejected_tree.get_children():
+            self.rejected_tree.delete(item)
+        for line, cylinder_id, reason in self.result.rejected:
+            self.rejected_tree.insert('', tk.END, values=(line or '', cylinder_id, reason))
+        self.save_rejects_button.config(state=tk.NORMAL if self.result.rejected else tk.DISABLED)
+        # Start over from the scan box after a file import
+        self.file_path = None
+        self.file_label.config(text="No file chosen - or scan/paste IDs below, one per line")
+        self.scan_text.delete("1.0", tk.END)
+
+    def save_rejects(self):
+        """Save the rejected rows with their reasons to a CSV file."""
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            title="Save Rejected Rows",
+            initialfile="rejected_cylinders.csv",
+            parent=self.dialog
+        )
+        if file_path:
+            intake.write_rejects(self.result, file_path)
+            messagebox.showinfo("Success", f"Rejected rows saved to {file_path}", parent=self.dialog)
+
+
 class StatusUpdateDialog:
     """Dialog for selecting new status for cylinders."""
-    def __init__(self, parent, cylinder_count):
+    def __init__(self, parent, cylinder_count, status_options):
         self.result = None
-        self.status_options = ['refill', 'available']
+        self.status_options = status_options
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Update Cylinder Status")
         self.dialog.geometry("300x150")
@@ -555,7 +651,8 @@ class StatusUpdateDialog:
         self.status_combo = ttk.Combobox(self.dialog, textvariable=self.status_var,
                                         values=self.status_options, state="readonly", width=20)
         self.status_combo.pack(pady=5)
-        self.status_combo.set('available')  # Default selection
+        if 'available' in self.status_options:
+            self.status_combo.set('available')  # Default selection
 
         # Buttons
         button_frame = ttk.Frame(self.dialog)
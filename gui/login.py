@@ -5,7 +5,7 @@ Login screen for Cylinder Management System
 
 import tkinter as tk
 from tkinter import messagebox
-from database import authenticate_user
+from backend import authenticate_user
 
 class LoginWindow:
     def __init__(self, on_login_success):
@@ -10,6 +10,8 @@ from gui.login import LoginWindow
 from gui.customer_management import CustomerManagementFrame
 from gui.inventory_management import InventoryManagementFrame
 from gui.dispatch_tracking import DispatchTrackingFrame
+from gui.dashboard import DashboardFrame
+from gui.diagnostics import install_diagnostics
 
 class MainWindow:
     def __init__(self):
@@ -19,6 +21,7 @@ class MainWindow:
         self.customer_frame = None
         self.inventory_frame = None
         self.dispatch_frame = None
+        self.dashboard_frame = None
 
     def show_login(self):
         """Show login window."""
@@ -63,6 +66,7 @@ class MainWindow:
         self.create_customer_tab()
         self.create_inventory_tab()
         self.create_dispatch_tab()
+        self.create_dashboard_tab()
 
         # Bind tab change event to refresh data
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
@@ -70,6 +74,9 @@ class MainWindow:
         # Bind close event
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+        # Measure main-loop stalls; Ctrl+Shift+D opens the diagnostics window
+        install_diagnostics(self.root)
+
     def create_menu_bar(self):
         """Create menu bar with logout option."""
         menubar = tk.Menu(self.root)
@@ -105,6 +112,14 @@ class MainWindow:
         self.dispatch_frame = DispatchTrackingFrame(frame)
         self.dispatch_frame.pack(fill=tk.BOTH, expand=True)
 
+    def create_dashboard_tab(self):
+        """Create refill and maintenance dashboard tab."""
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text="Dashboard")
+
+        self.dashboard_frame = DashboardFrame(frame)
+        self.dashboard_frame.pack(fill=tk.BOTH, expand=True)
+
     def logout(self):
         """Handle logout."""
         if messagebox.askyesno("Logout", "Are you sure you want to logout?"):
@@ -126,6 +141,9 @@ class MainWindow:
             self.dispatch_frame.load_customers()
             self.dispatch_frame.load_available_cylinders()
             self.dispatch_frame.load_dispatches()
+            self.dispatch_frame.refresh_history_index()
+        elif tab_text == "Dashboard" and self.dashboard_frame:
+            self.dashboard_frame.load_dashboard()
 
     def on_closing(self):
         """Handle window close event."""
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Selection model for Cylinder Management System
+Keeps selected cylinders as an id-keyed ordered set and mirrors id lists into
+Tk listboxes, patching only the rows that changed instead of rebuilding the
+listbox and parsing ids back out of its display strings.
+"""
+
+import tkinter as tk
+
+
+def cylinder_label(row):
+    """Listbox text for a (id, cylinder_id, cylinder_type, ...) row."""
+    return f"{row[0]} - {row[1]} ({row[2]})"
+
+
+class SelectionModel:
+    """Ordered set of selected rows keyed by database ID."""
+    def __init__(self):
+        self._rows = {}
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def ids(self):
+        """Selected IDs in selection order."""
+        return list(self._rows)
+
+    def row(self, item_id):
+        """The row stored for a selected ID."""
+        return self._rows[item_id]
+
+    def add(self, rows):
+        """Select rows (keyed by row[0]); returns the rows that were not selected yet."""
+        added = []
+        for row in rows:
+            if row[0] not in self._rows:
+                self._rows[row[0]] = row
+                added.append(row)
+        return added
+
+    def remove(self, item_ids):
+        """Deselect IDs; returns the IDs that were selected."""
+        return [item_id for item_id in item_ids if self._rows.pop(item_id, None) is not None]
+
+    def retain(self, item_ids):
+        """Keep only the selected IDs in item_ids; returns the IDs that were dropped."""
+        keep = set(item_ids)
+        return self.remove([item_id for item_id in self._rows if item_id not in keep])
+
+    def clear(self):
+        """Deselect everything; returns the IDs that were selected."""
+        removed = list(self._rows)
+        self._rows.clear()
+        return removed
+
+
+class ListboxView:
+    """A Listbox showing rows by ID, with index lookups in both directions."""
+    def __init__(self, listbox, label=cylinder_label):
+        self.listbox = listbox
+        self.label = label
+        self._ids = []
+        self._index = {}
+
+    def __contains__(self, item_id):
+        return item_id in self._index
+
+    def ids(self):
+        """IDs in display order."""
+        return list(self._ids)
+
+    def id_at(self, index):
+        """ID shown at a listbox index."""
+        return self._ids[index]
+
+    def index_of(self, item_id):
+        """Listbox index of an ID, or None."""
+        return self._index.get(item_id)
+
+    def set_rows(self, rows):
+        """Replace every row with one Tk call."""
+        self.listbox.delete(0, tk.END)
+        self._ids = [row[0] for row in rows]
+        self._index = {item_id: index for index, item_id in enumerate(self._ids)}
+        if rows:
+            self.listbox.insert(tk.END, *[self.label(row) for row in rows])
+
+    def append(self, rows):
+        """Add rows at the end with one Tk call."""
+        rows = [row for row in rows if row[0] not in self._index]
+        if not rows:
+            return
+        for row in rows:
+            self._index[row[0]] = len(self._ids)
+            self._ids.append(row[0])
+        self.listbox.insert(tk.END, *[self.label(row) for row in rows])
+
+    def remove(self, item_ids):
+        """Delete the rows of the given IDs, leaving the other rows untouched."""
+        indices = sorted((self._index[item_id] for item_id in item_ids if item_id in self._index), reverse=True)
+        if not indices:
+            return
+        for index in indices:
+            self.listbox.delete(index)
+            del self._index[self._ids[index]]
+            del self._ids[index]
+        # Only rows after the first deleted one moved up
+        for index in range(indices[-1], len(self._ids)):
+            self._index[self._ids[index]] = index
+
+    def selected_ids(self):
+        """IDs of the rows selected in the listbox."""
+        return {self._ids[index] for index in self.listbox.curselection()}
+
+    def _runs(self, item_ids):
+        """Listbox indices of the given IDs as (first, last) runs of adjacent rows."""
+        runs = []
+        for index in sorted(self._index[item_id] for item_id in item_ids if item_id in self._index):
+            if runs and index == runs[-1][1] + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        return runs
+
+    def select(self, item_ids):
+        """Select the rows of the given IDs in the listbox, one Tk call per run of adjacent rows."""
+        for first, last in self._runs(item_ids):
+            self.listbox.selection_set(first, last)
+
+    def deselect(self, item_ids):
+        """Clear the listbox selection of the given IDs, one Tk call per run of adjacent rows."""
+        for first, last in self._runs(item_ids):
+            self.listbox.selection_clear(first, last)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Filter index for the available-cylinders history panel
+Keeps the rows of database.get_cylinders_with_last_dispatch() in memory with
+inverted indexes from status, last customer and last DC to sets of cylinder
+IDs, so any filter combination is a set intersection instead of a query.
+
+The dispatch tab builds the index once, updates the rows of the cylinders it
+dispatches or returns, and rebuilds it when the tab is shown again.
+"""
+
+# Row positions in get_cylinders_with_last_dispatch() rows
+ID, CYLINDER_ID, STATUS, LAST_DC, LAST_CUSTOMER_ID = 0, 1, 3, 5, 6
+
+
+class CylinderHistoryIndex:
+    """Cylinder history rows keyed by database ID, indexed by status, customer and DC."""
+    def __init__(self):
+        self.loaded = False
+        self._rows = {}
+        self._by_status = {}
+        self._by_customer = {}
+        self._by_dc = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def build(self, rows):
+        """Replace the whole index."""
+        self._rows.clear()
+        self._by_status.clear()
+        self._by_customer.clear()
+        self._by_dc.clear()
+        for row in rows:
+            self._add(row)
+        self.loaded = True
+
+    def update(self, cylinder_ids, rows):
+        """Replace the rows of cylinder_ids with rows; IDs without a row are dropped (deleted)."""
+        for cylinder_id in cylinder_ids:
+            self._remove(cylinder_id)
+        for row in rows:
+            self._add(row)
+
+    def _add(self, row):
+        self._remove(row[ID])
+        self._rows[row[ID]] = row
+        self._by_status.setdefault(row[STATUS], set()).add(row[ID])
+        if row[LAST_CUSTOMER_ID] is not None:
+            self._by_customer.setdefault(row[LAST_CUSTOMER_ID], set()).add(row[ID])
+        if row[LAST_DC] is not None:
+            self._by_dc.setdefault(row[LAST_DC], set()).add(row[ID])
+
+    def _remove(self, cylinder_id):
+        row = self._rows.pop(cylinder_id, None)
+        if row is None:
+            return
+        for index, key in ((self._by_status, row[STATUS]), (self._by_customer, row[LAST_CUSTOMER_ID]),
+                           (self._by_dc, row[LAST_DC])):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(cylinder_id)
+                if not ids:
+                    del index[key]
+
+    def ids(self, status=None, customer_id=None, dc_number=None):
+        """Set of cylinder IDs matching every given filter (None means no filter)."""
+        sets = [index.get(key, set()) for index, key in ((self._by_status, status), (self._by_customer, customer_id),
+                                                          (self._by_dc, dc_number)) if key is not None]
+        if not sets:
+            return set(self._rows)
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def rows(self, status=None, customer_id=None, dc_number=None):
+        """Matching rows ordered by cylinder_id."""
+        return sorted((self._rows[cylinder_id] for cylinder_id in self.ids(status, customer_id, dc_number)),
+                      key=lambda row: row[CYLINDER_ID])
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Query instrumentation for Cylinder Management System
+Records per-statement latency histograms, row counts and call sites, and logs
+slow statements together with their EXPLAIN QUERY PLAN. The histograms time
+execute calls; time spent fetching the rows afterwards is kept as a separate
+total per statement, while the slow statement check uses both.
+
+Instrumentation is off unless the CMS_QUERY_STATS environment variable is set,
+in which case database.get_connection() hands out instrumented connections:
+
+    CMS_QUERY_STATS=1             enable instrumentation
+    CMS_SLOW_QUERY_MS=100         slow statement threshold in milliseconds
+    CMS_SLOW_QUERY_LOG=path       append slow statements to this file (default stderr)
+    CMS_QUERY_STATS_FILE=path     export stats at exit (.json, otherwise Prometheus text)
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+ENABLED = os.environ.get('CMS_QUERY_STATS', '') not in ('', '0')
+SLOW_QUERY_MS = float(os.environ.get('CMS_SLOW_QUERY_MS', '100'))
+EXPORT_FILE = os.environ.get('CMS_QUERY_STATS_FILE', '')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+MAX_CALL_SITES = 20
+EXPLAINABLE_PREFIXES = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+logger = logging.getLogger('cms.slow_query')
+if os.environ.get('CMS_SLOW_QUERY_LOG'):
+    _handler = logging.FileHandler(os.environ['CMS_SLOW_QUERY_LOG'])
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(_handler)
+
+_lock = threading.Lock()
+_stats = {}
+_this_file = os.path.normcase(os.path.abspath(__file__))
+
+
+class StatementStats:
+    """Accumulated timings for one normalized SQL statement."""
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total_ms = 0.0
+        self.fetch_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow_count = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.call_sites = {}
+
+    def observe(self, elapsed_ms, call_site):
+        """Record one execution."""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        if call_site in self.call_sites or len(self.call_sites) < MAX_CALL_SITES:
+            self.call_sites[call_site] = self.call_sites.get(call_site, 0) + 1
+
+    def to_dict(self):
+        """Convert to a JSON-serializable dictionary."""
+        return {
+            'sql': self.sql,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'fetch_ms': round(self.fetch_ms, 3),
+            'rows': self.rows,
+            'slow_count': self.slow_count,
+            'histogram_ms': dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ['+Inf'], self.buckets)),
+            'call_sites': self.call_sites,
+        }
+
+
+def _normalize(sql):
+    """Collapse whitespace so the same statement always maps to one entry."""
+    return ' '.join(sql.split())
+
+
+def _call_site():
+    """Describe the innermost frame outside this module as 'file:line function'."""
+    frame = sys._getframe(2)
+    while frame is not None and os.path.normcase(os.path.abspath(frame.f_code.co_filename)) == _this_file:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+
+def _stats_for(sql):
+    key = _normalize(sql)
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = StatementStats(key)
+    return stats
+
+
+def _log_slow(connection, sql, parameters, elapsed_ms, call_site):
+    """Log a slow statement with its query plan."""
+    plan = []
+    if _normalize(sql).upper().startswith(EXPLAINABLE_PREFIXES):
+        try:
+            explain = sqlite3.Cursor(connection)
+            explain.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+            plan = [row[-1] for row in explain.fetchall()]
+        except sqlite3.Error as e:
+            plan = [f"(plan unavailable: {e})"]
+    logger.warning("slow query %.1f ms at %s: %s | plan: %s",
+                   elapsed_ms, call_site, _normalize(sql), '; '.join(plan) or 'n/a')
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times every execute and fetch call."""
+    def _observe(self, sql, parameters, elapsed_ms, rows):
+        call_site = _call_site()
+        with _lock:
+            stats = _stats_for(sql)
+            stats.observe(elapsed_ms, call_site)
+            stats.rows += rows
+            if elapsed_ms >= SLOW_QUERY_MS:
+                stats.slow_count += 1
+        self._stat_sql = sql
+        self._stat_parameters = parameters
+        self._stat_elapsed_ms = elapsed_ms
+        self._stat_logged = elapsed_ms >= SLOW_QUERY_MS
+        if self._stat_logged:
+            _log_slow(self.connection, sql, parameters, elapsed_ms, call_site)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._observe(sql, parameters, elapsed_ms, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._observe(sql, (), elapsed_ms, max(self.rowcount, 0))
+
+    def _fetched(self, start, rows):
+        """Add fetch time and rows to the statement this cursor last executed (not to its histogram)."""
+        sql = getattr(self, '_stat_sql', None)
+        if sql is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stat_elapsed_ms += elapsed_ms
+        with _lock:
+            stats = _stats_for(sql)
+            stats.fetch_ms += elapsed_ms
+            stats.rows += rows
+        if not self._stat_logged and self._stat_elapsed_ms >= SLOW_QUERY_MS:
+            self._stat_logged = True
+            with _lock:
+                stats.slow_count += 1
+            _log_slow(self.connection, sql, self._stat_parameters, self._stat_elapsed_ms, _call_site())
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are instrumented."""
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(database, **kwargs):
+    """Open an instrumented SQLite connection."""
+    return sqlite3.connect(database, factory=InstrumentedConnection, **kwargs)
+
+
+def snapshot():
+    """Get current statistics as a list of dictionaries, slowest total first."""
+    with _lock:
+        entries = [stats.to_dict() for stats in _stats.values()]
+    return sorted(entries, key=lambda entry: entry['total_ms'] + entry['fetch_ms'], reverse=True)
+
+
+def reset():
+    """Clear all collected statistics."""
+    with _lock:
+        _stats.clear()
+
+
+def _prometheus_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')[:200]
+
+
+def to_prometheus():
+    """Render statistics in the Prometheus text exposition format."""
+    lines = [
+        '# HELP cms_query_duration_seconds SQLite statement execute latency.',
+        '# TYPE cms_query_duration_seconds histogram',
+    ]
+    entries = snapshot()
+    for entry in entries:
+        label = _prometheus_label(entry['sql'])
+        cumulative = 0
+        for bound, count in entry['histogram_ms'].items():
+            cumulative += count
+            le = '+Inf' if bound == '+Inf' else repr(float(bound) / 1000)
+            lines.append(f'cms_query_duration_seconds_bucket{{statement="{label}",le="{le}"}} {cumulative}')
+        lines.append(f'cms_query_duration_seconds_sum{{statement="{label}"}} {entry["total_ms"] / 1000}')
+        lines.append(f'cms_query_duration_seconds_count{{statement="{label}"}} {entry["count"]}')
+    lines.append('# HELP cms_query_fetch_seconds_total Time spent fetching result rows per statement.')
+    lines.append('# TYPE cms_query_fetch_seconds_total counter')
+    for entry in entries:
+        lines.append(f'cms_query_fetch_seconds_total{{statement="{_prometheus_label(entry["sql"])}"}} {entry["fetch_ms"] / 1000}')
+    lines.append('# HELP cms_query_rows_total Rows returned or changed per statement.')
+    lines.append('# TYPE cms_query_rows_total counter')
+    for entry in entries:
+        lines.append(f'cms_query_rows_total{{statement="{_prometheus_label(entry["sql"])}"}} {entry["rows"]}')
+    lines.append('# HELP cms_query_slow_total Executions over the slow query threshold.')
+    lines.append('# TYPE cms_query_slow_total counter')
+    for entry in entries:
+        lines.append(f'cms_query_slow_total{{statement="{_prometheus_label(entry["sql"])}"}} {entry["slow_count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export(path):
+    """Write statistics to path as JSON (.json) or Prometheus text (anything else)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            json.dump({'slow_query_ms': SLOW_QUERY_MS, 'statements': snapshot()}, f, indent=2)
+        else:
+            f.write(to_prometheus())
+
+
+if ENABLED and EXPORT_FILE:
+    atexit.register(export, EXPORT_FILE)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Bulk cylinder intake for Cylinder Management System
+Reads cylinder IDs from CSV files or barcode scanner dumps, checks them against
+an in-memory set of existing cylinder IDs and adds the accepted ones in chunked
+transactions. Every input row ends up either accepted or rejected with a reason.
+
+CSV files need a header row with a cylinder ID column (cylinder_id, cylinder id,
+id, barcode or code) and may have product/type, status and location columns;
+missing values fall back to the defaults given for the intake. Any other file
+is treated as a scanner dump: one barcode per line, taking the first
+comma-separated field.
+"""
+
+import csv
+import io
+
+from backend import add_cylinders, get_cylinder_ids
+
+CHUNK_SIZE = 500
+INTAKE_STATUSES = ['available', 'returned', 'refill', 'maintenance']
+
+ID_COLUMNS = ('cylinder_id', 'cylinder id', 'id', 'barcode', 'code')
+TYPE_COLUMNS = ('cylinder_type', 'cylinder type', 'product', 'type')
+STATUS_COLUMNS = ('status',)
+LOCATION_COLUMNS = ('location',)
+
+
+class IntakeResult:
+    """Accepted and rejected rows of one intake."""
+    def __init__(self):
+        self.accepted = []  # (line, cylinder_id)
+        self.rejected = []  # (line, cylinder_id, reason)
+
+    def reject(self, line, cylinder_id, reason):
+        self.rejected.append((line, cylinder_id, reason))
+
+    def summary(self):
+        """One-line description of the outcome."""
+        return f"{len(self.accepted)} cylinder(s) added, {len(self.rejected)} rejected"
+
+
+def find_column(header, names):
+    """Index of the first header column named one of names (case-insensitive), or None."""
+    for index, column in enumerate(header):
+        if column.strip().lower() in names:
+            return index
+    return None
+
+
+def read_rows(lines):
+    """Parse CSV or scanner lines into (line, cylinder_id, cylinder_type, status, location).
+
+    Type, status and location are None when the input does not provide them.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    id_column = find_column(header, ID_COLUMNS)
+
+    if id_column is None:
+        # Scanner dump: the first line is already a barcode
+        if header and header[0].strip():
+            yield (1, header[0].strip(), None, None, None)
+        for line_number, row in enumerate(reader, start=2):
+            if row and row[0].strip():
+                yield (line_number, row[0].strip(), None, None, None)
+        return
+
+    type_column = find_column(header, TYPE_COLUMNS)
+    status_column = find_column(header, STATUS_COLUMNS)
+    location_column = find_column(header, LOCATION_COLUMNS)
+
+    def value(row, column):
+        if column is None or column >= len(row):
+            return None
+        return row[column].strip() or None
+
+    for line_number, row in enumerate(reader, start=2):
+        if not any(field.strip() for field in row):
+            continue
+        yield (line_number, value(row, id_column) or '', value(row, type_column),
+               value(row, status_column), value(row, location_column))
+
+
+def read_file(path):
+    """Parse a CSV file or scanner dump from disk, streaming its rows."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from read_rows(f)
+
+
+def read_text(text):
+    """Parse pasted CSV or scanner text."""
+    return read_rows(io.StringIO(text))
+
+
+def _validate(rows, existing_ids, default_type, default_status, default_location, result):
+    """Yield insertable rows, rejecting the rest into result."""
+    seen_ids = set()
+    for line, cylinder_id, cylinder_type, status, location in rows:
+        cylinder_type = cylinder_type or default_type
+        status = (status or default_status or 'available').lower()
+        location = location if location is not None else default_location
+        if not cylinder_id:
+            result.reject(line, cylinder_id, "missing cylinder ID")
+        elif cylinder_id in seen_ids:
+            result.reject(line, cylinder_id, "duplicate in input")
+        elif cylinder_id in existing_ids:
+            result.reject(line, cylinder_id, "cylinder ID already exists")
+        elif not cylinder_type:
+            result.reject(line, cylinder_id, "missing product")
+        elif status not in INTAKE_STATUSES:
+            result.reject(line, cylinder_id, f"invalid status '{status}'")
+        else:
+            seen_ids.add(cylinder_id)
+            yield line, (cylinder_id, cylinder_type, status, location or '')
+
+
+def bulk_intake(rows, default_type='', default_status='available', default_location='',
+                chunk_size=CHUNK_SIZE, progress=None):
+    """Add cylinders from parsed rows in chunks of chunk_size, one transaction per chunk.
+
+    progress, when given, is called as progress(processed_rows) after each chunk.
+    Returns an IntakeResult.
+    """
+    result = IntakeResult()
+    existing_ids = set(get_cylinder_ids())
+    chunk = []
+
+    def flush():
+        try:
+            add_cylinders([row for line, row in chunk])
+            result.accepted.extend((line, row[0]) for line, row in chunk)
+        except ValueError:
+            # Another terminal added some of these IDs since the set was loaded
+            current_ids = set(get_cylinder_ids())
+            remaining = []
+            for line, row in chunk:
+                if row[0] in current_ids:
+                    result.reject(line, row[0], "cylinder ID already exists")
+                else:
+                    remaining.append((line, row))
+            if remaining:
+                add_cylinders([row for line, row in remaining])
+                result.accepted.extend((line, row[0]) for line, row in remaining)
+        chunk.clear()
+        if progress:
+            progress(len(result.accepted) + len(result.rejected))
+
+    for line, row in _validate(rows, existing_ids, default_type, default_status, default_location, result):
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return result
+
+
+def write_rejects(result, path):
+    """Write rejected rows to a CSV file."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['line', 'cylinder_id', 'reason'])
+        writer.writerows(result.rejected)
@@ -7,13 +7,17 @@ A desktop application for tracking cylinders, customers, and dispatches.
 import sys
 import os
 from gui.main_window import MainWindow
-from database import init_database
+from gui.diagnostics import instrument_callbacks
+from backend import init_backend
 
 def main():
     """Main application entry point."""
     try:
-        # Initialize database
-        init_database()
+        # Initialize database, or check the service in client mode
+        init_backend()
+
+        # Time every Tk callback for the diagnostics window (Ctrl+Shift+D)
+        instrument_callbacks()
 
         # Create and run the main window
         app = MainWindow()
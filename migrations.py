@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for Cylinder Management System
+The schema version is kept in PRAGMA user_version. Migration steps are
+(version, description, apply) tuples in ascending version order; migrate()
+applies the steps newer than the database, each in its own IMMEDIATE
+transaction together with the version bump, so a second process starting at
+the same time waits and then skips the steps already applied.
+
+A database that is already current costs one pragma read. Databases created
+before versioning start at version 0 and run every step, so steps must be
+idempotent (CREATE ... IF NOT EXISTS, existence checks before seeding).
+
+Long data backfills use backfill(), which commits every chunk. Its WHERE
+clause must stop matching rows once they are updated; an interrupted
+backfill then resumes where it stopped the next time the step runs.
+"""
+
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def schema_version(conn):
+    """The database's schema version (PRAGMA user_version)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending(conn, steps):
+    """True when the database is older than the last step."""
+    return schema_version(conn) < steps[-1][0]
+
+
+def migrate(conn, steps):
+    """Apply the steps newer than the database in order; returns the versions applied."""
+    applied = []
+    if not pending(conn, steps):
+        return applied
+    for version, description, apply in steps:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) >= version:
+                conn.commit()  # applied already, possibly by another process
+                continue
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def backfill(conn, table, assignments, condition, chunk_size=BACKFILL_CHUNK_SIZE):
+    """UPDATE table SET assignments WHERE condition, chunk_size rows per committed transaction.
+
+    Returns the number of rows updated. condition must be false for updated rows.
+    """
+    total = 0
+    while True:
+        cursor = conn.execute(f'''
+            UPDATE {table} SET {assignments}
+            WHERE rowid IN (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)
+        ''', (chunk_size,))
+        conn.commit()
+        total += cursor.rowcount
+        if cursor.rowcount < chunk_size:
+            return total
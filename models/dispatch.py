@@ -3,7 +3,7 @@
 Dispatch model for Cylinder Management System
 """
 
-from database import get_connection
+from backend import delete_dispatch
 
 class Dispatch:
     def __init__(self, id=None, dc_number="", customer_id=None, cylinder_id=None, dispatch_date=None, return_date=None,
@@ -65,8 +65,4 @@ class Dispatch:
 
     def delete(self):
         """Delete this dispatch record from the database."""
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM dispatches WHERE id = ?", (self.id,))
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        delete_dispatch(self.id)
\ No newline at end of file
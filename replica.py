@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Reporting replica for Cylinder Management System
+Keeps a copy of the database in a second SQLite file so bills, aging and
+turnaround reports read from it instead of contending with live dispatching.
+
+While a replica is registered in the replicas table, triggers log the primary
+key of every changed row in change_log (see database._capture_changes).
+ship() reads a batch of log entries together with the current version of
+those rows in one read transaction on the primary, then replaces the rows in
+the replica and records the last applied sequence number in the same replica
+transaction, so an interrupted ship is simply repeated. The replica's position
+is acknowledged on the primary at most every ACK_INTERVAL_SECONDS; entries
+every replica has applied are trimmed then. Acknowledging is a commit on the
+primary, which makes other processes reload their cylinder catalog, so it is
+kept rare.
+
+A replica is seeded with an online copy through the backup API, and seeded
+again when the primary's schema version changes or the replica is no longer
+registered. Its triggers are dropped since it only receives rows.
+
+    python replica.py ship [--db FILE] [--replica FILE] [--follow] [--interval 1]
+    python replica.py status [--db FILE]
+    python replica.py drop [--db FILE] [--replica FILE]
+
+With CMS_REPLICA_FILE set, the GUI reads its reports from that replica and
+ships it in the background; the service does the same with --replica FILE.
+"""
+
+import argparse
+import functools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import backup
+import database
+
+REPLICA_FILE = os.environ.get('CMS_REPLICA_FILE', '')
+SHIP_BATCH = 5000
+SHIP_INTERVAL_SECONDS = 1.0
+ACK_INTERVAL_SECONDS = 30.0
+
+# Reads served from the replica when one is configured
+REPORT_OPERATIONS = (
+    'get_bill_data_for_dc', 'get_bill_data_for_company',
+    'get_cylinder_aging', 'get_customer_aging_summary',
+    'get_turnaround_report', 'get_dispatch_history',
+)
+
+
+def _key(path):
+    """The replica's name in the replicas table."""
+    return os.path.abspath(path)
+
+
+def connect(path=None):
+    """Open a query-only connection to the replica."""
+    conn = sqlite3.connect(path or REPLICA_FILE)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def reporting(func, path=None):
+    """Wrap a database read so it runs on the replica (on the primary until the replica is seeded)."""
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        replica_path = path or REPLICA_FILE
+        if not os.path.exists(replica_path):
+            return func(*args, **kwargs)
+        conn = connect(replica_path)
+        try:
+            return func(*args, conn=conn, **kwargs)
+        finally:
+            conn.close()
+    return call
+
+
+def _primary():
+    conn = database.get_connection()
+    conn.isolation_level = None
+    return conn
+
+
+def _applied_seq(replica, source):
+    """The replica's applied sequence number, or None when it must be seeded."""
+    try:
+        row = replica.execute("SELECT applied_seq FROM replica_state").fetchone()
+        version = replica.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.Error:
+        return None
+    if row is None or version != source.execute("PRAGMA user_version").fetchone()[0]:
+        return None
+    return row[0]
+
+
+def seed(source, path):
+    """Copy the primary into path online and prepare it as a replica; returns the copy's sequence number."""
+    source.execute("INSERT INTO replicas (path) VALUES (?) ON CONFLICT (path) DO NOTHING", (_key(path),))
+    backup.copy_database(source, path)
+    replica = sqlite3.connect(path, isolation_level=None)
+    try:
+        replica.execute("PRAGMA journal_mode = WAL")
+        replica.execute("BEGIN IMMEDIATE")
+        triggers = replica.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+        for (name,) in triggers:
+            replica.execute(f"DROP TRIGGER {name}")
+        row = replica.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        applied_seq = row[0] if row else 0
+        replica.execute("DELETE FROM change_log")
+        replica.execute("DELETE FROM replicas")
+        replica.execute('''
+            CREATE TABLE IF NOT EXISTS replica_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                primary_file TEXT NOT NULL,
+                applied_seq INTEGER NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        replica.execute("INSERT OR REPLACE INTO replica_state (id, primary_file, applied_seq) VALUES (1, ?, ?)",
+                        (os.path.abspath(database.DATABASE_FILE), applied_seq))
+        replica.execute("COMMIT")
+    finally:
+        replica.close()
+    acknowledge(source, path, applied_seq)
+    return applied_seq
+
+
+def acknowledge(source, path, applied_seq):
+    """Record the replica's position on the primary and trim the entries every replica has applied."""
+    source.execute("BEGIN IMMEDIATE")
+    try:
+        source.execute("UPDATE replicas SET applied_seq = MAX(applied_seq, ?), shipped_at = CURRENT_TIMESTAMP WHERE path = ?",
+                       (applied_seq, _key(path)))
+        source.execute("DELETE FROM change_log WHERE seq <= (SELECT MIN(applied_seq) FROM replicas)")
+        source.execute("COMMIT")
+    except BaseException:
+        source.execute("ROLLBACK")
+        raise
+
+
+def _columns(conn, table):
+    """(columns, primary key columns) of table."""
+    info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    keys = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+    return [row[1] for row in info], keys
+
+
+def _key_chunks(keys, width):
+    """Split keys into chunks of at most RESOLVE_CHUNK_SIZE bound parameters, with their VALUES list."""
+    size = max(1, database.RESOLVE_CHUNK_SIZE // width)
+    row = f"({', '.join('?' * width)})"
+    for start in range(0, len(keys), size):
+        chunk = keys[start:start + size]
+        yield ', '.join([row] * len(chunk)), [value for key in chunk for value in key]
+
+
+def _read_changes(source, applied_seq, batch):
+    """Read up to batch log entries after applied_seq and the current rows they name, in one snapshot.
+
+    Returns (last_seq, entry count, {table: (columns, keys, changed_keys, rows)}).
+    """
+    source.execute("BEGIN")
+    try:
+        entries = source.execute("SELECT seq, table_name, row_key FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                                 (applied_seq, batch)).fetchall()
+        changed = {}
+        for _, table, row_key in entries:
+            changed.setdefault(table, {})[tuple(json.loads(row_key))] = None
+        tables = {}
+        for table, table_keys in changed.items():
+            columns, keys = _columns(source, table)
+            table_keys = list(table_keys)
+            rows = []
+            for values_sql, params in _key_chunks(table_keys, len(keys)):
+                rows.extend(source.execute(f"SELECT {', '.join(columns)} FROM {table} "
+                                           f"WHERE ({', '.join(keys)}) IN (VALUES {values_sql})", params).fetchall())
+            tables[table] = (columns, keys, table_keys, rows)
+    finally:
+        source.execute("ROLLBACK")
+    return (entries[-1][0] if entries else applied_seq), len(entries), tables
+
+
+def _apply(replica, applied_seq, last_seq, tables):
+    """Replace the changed rows in the replica; False when another shipper got there first."""
+    replica.execute("BEGIN IMMEDIATE")
+    try:
+        if replica.execute("SELECT applied_seq FROM replica_state").fetchone()[0] != applied_seq:
+            replica.execute("ROLLBACK")
+            return False
+        for table, (columns, keys, changed_keys, rows) in tables.items():
+            for values_sql, params in _key_chunks(changed_keys, len(keys)):
+                replica.execute(f"DELETE FROM {table} WHERE ({', '.join(keys)}) IN (VALUES {values_sql})", params)
+            replica.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                rows)
+        replica.execute("UPDATE replica_state SET applied_seq = ?, applied_at = CURRENT_TIMESTAMP", (last_seq,))
+        replica.execute("COMMIT")
+    except BaseException:
+        replica.execute("ROLLBACK")
+        raise
+    return True
+
+
+def ship(path=None, batch=SHIP_BATCH, ack=True):
+    """Apply the changes logged since the last ship to the replica, seeding it when needed.
+
+    Returns the number of log entries applied. The position is acknowledged on
+    the primary when ack is true.
+    """
+    path = path or REPLICA_FILE
+    source = _primary()
+    try:
+        registered = source.execute("SELECT applied_seq FROM replicas WHERE path = ?", (_key(path),)).fetchone()
+        applied_seq = None
+        if registered and os.path.exists(path):
+            replica = sqlite3.connect(path)
+            try:
+                applied_seq = _applied_seq(replica, source)
+            finally:
+                replica.close()
+        if applied_seq is None:
+            applied_seq = seed(source, path)
+
+        shipped = 0
+        replica = sqlite3.connect(path, isolation_level=None)
+        try:
+            while True:
+                last_seq, count, tables = _read_changes(source, applied_seq, batch)
+                if not count or not _apply(replica, applied_seq, last_seq, tables):
+                    break
+                shipped += count
+                applied_seq = last_seq
+                if count < batch:
+                    break
+        finally:
+            replica.close()
+        if ack and (shipped or (registered and registered[0] < applied_seq)):
+            acknowledge(source, path, applied_seq)
+        return shipped
+    finally:
+        source.close()
+
+
+def drop(path=None):
+    """Unregister the replica and trim the log entries no other replica needs; the file is left in place."""
+    source = _primary()
+    try:
+        source.execute("BEGIN IMMEDIATE")
+        source.execute("DELETE FROM replicas WHERE path = ?", (_key(path or REPLICA_FILE),))
+        source.execute('''
+            DELETE FROM change_log
+            WHERE seq <= COALESCE((SELECT MIN(applied_seq) FROM replicas), (SELECT MAX(seq) FROM change_log))
+        ''')
+        source.execute("COMMIT")
+    finally:
+        source.close()
+
+
+class ReplicaShipper:
+    """Background thread shipping the replica every interval seconds."""
+    def __init__(self, path=None, interval=SHIP_INTERVAL_SECONDS):
+        self.path = path or REPLICA_FILE
+        self.interval = interval
+        self.shipped = 0
+        self.last_error = None
+        self._acked_at = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cms-replica', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                ack = time.monotonic() - self._acked_at >= ACK_INTERVAL_SECONDS
+                self.shipped += ship(self.path, ack=ack)
+                if ack:
+                    self._acked_at = time.monotonic()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Replica shipping failed: {self.last_error}", file=sys.stderr)
+            if self._stop.wait(self.interval):
+                return
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Cylinder Management System reporting replica")
+    parser.add_argument('--db', default=database.DATABASE_FILE, help="primary database file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ship_parser = commands.add_parser('ship', help="seed the replica or apply the logged changes")
+    ship_parser.add_argument('--replica', default=REPLICA_FILE or 'reporting_replica.db', help="replica file")
+    ship_parser.add_argument('--follow', action='store_true', help="keep shipping until interrupted")
+    ship_parser.add_argument('--interval', type=float, default=SHIP_INTERVAL_SECONDS, help="seconds between ships")
+    commands.add_parser('status', help="show each replica's position and lag")
+    drop_parser = commands.add_parser('drop', help="stop capturing changes for a replica")
+    drop_parser.add_argument('--replica', default=REPLICA_FILE or 'reporting_replica.db', help="replica file")
+    args = parser.parse_args(argv)
+
+    database.DATABASE_FILE = args.db
+    database.init_database()
+    if args.command == 'ship':
+        if not args.follow:
+            print(f"Applied {ship(args.replica)} changes to {args.replica}")
+            return 0
+        shipper = ReplicaShipper(args.replica, args.interval).start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            shipper.stop()
+        print(f"Applied {shipper.shipped} changes to {args.replica}")
+    elif args.command == 'status':
+        rows = database.get_replication_status()
+        if not rows:
+            print("No replicas registered")
+        for path, applied_seq, pending, lag_seconds, applied_at in rows:
+            print(f"{path}  applied #{applied_seq} at {applied_at or '-'}  {pending} pending  {lag_seconds:.1f} s behind")
+    elif args.command == 'drop':
+        drop(args.replica)
+        print(f"Stopped capturing changes for {args.replica}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Headless service for Cylinder Management System
+Serves the dispatch, return, inventory and customer operations over a local
+HTTP/JSON API so several terminals share one process instead of each opening
+the database file for writing.
+
+Reads run concurrently on their own connections (the database is switched to
+WAL mode so they do not wait for the writer). Writes go through a single
+writer connection that commits operations arriving close together in one
+transaction (see write_queue.py).
+
+    python service.py [--db FILE | --depot NAME] [--host 127.0.0.1] [--port 8765] [--batch-window-ms 5]
+                      [--backup-interval MINUTES] [--backup-dir backups] [--backup-keep 14]
+                      [--replica FILE]
+
+API:
+    GET  /health                  {"status": "ok", "database": ..., "schema_version": ...}
+    GET  /metrics                 write queue, catalog cache (and query) metrics, Prometheus text
+    GET  /metrics.json            write queue, catalog cache, last backup and replica lag as JSON
+    POST /api/<operation>         body {"args": [...], "kwargs": {...}}
+                                  reply {"result": ...} or {"error": ..., "type": ...}
+
+With --replica FILE the bill, aging and turnaround reports are read from a
+reporting replica kept current in the background (see replica.py).
+
+Terminals use the service by starting main.py with CMS_SERVICE_URL set to
+the service address, e.g. CMS_SERVICE_URL=http://127.0.0.1:8765.
+"""
+
+import argparse
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import backup
+import database
+import depots
+import instrumentation
+import replica
+from backend import READ_OPERATIONS, WRITE_OPERATIONS
+from service_client import dumps, loads
+from write_queue import WriteQueue, BATCH_WINDOW_MS
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """Dispatches API requests to database functions."""
+    server_version = 'CMSService/1.0'
+    quiet = True
+
+    def send_json(self, status, body):
+        data = dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_text(self, status, text):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        write_queue = self.server.write_queue
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'database': database.DATABASE_FILE,
+                                 'schema_version': database.get_schema_version()[0]})
+        elif self.path == '/metrics':
+            text = write_queue.metrics.to_prometheus()
+            text += f'# TYPE cms_write_queue_depth gauge\ncms_write_queue_depth {write_queue.queue_depth()}\n'
+            if database.CATALOG_ENABLED:
+                text += database.cylinder_catalog.to_prometheus()
+            if instrumentation.ENABLED:
+                text += instrumentation.to_prometheus()
+            self.send_text(200, text)
+        elif self.path == '/metrics.json':
+            metrics = write_queue.metrics.snapshot()
+            metrics['queue_depth'] = write_queue.queue_depth()
+            metrics['catalog'] = database.cylinder_catalog.stats()
+            scheduler = self.server.backup_scheduler
+            if scheduler is not None:
+                metrics['backup'] = {'last': scheduler.last, 'last_error': scheduler.last_error}
+            shipper = self.server.replica_shipper
+            if shipper is not None:
+                metrics['replica'] = {'path': shipper.path, 'shipped': shipper.shipped, 'last_error': shipper.last_error,
+                                      'status': database.get_replication_status()}
+            self.send_json(200, metrics)
+        else:
+            self.send_json(404, {'error': f"Unknown path {self.path}", 'type': 'NotFound'})
+
+    def do_POST(self):
+        if not self.path.startswith('/api/'):
+            self.send_json(404, {'error': f"Unknown path {self.path}", 'type': 'NotFound'})
+            return
+        operation = self.path[len('/api/'):]
+        if operation not in READ_OPERATIONS and operation not in WRITE_OPERATIONS:
+            self.send_json(404, {'error': f"Unknown operation {operation}", 'type': 'NotFound'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = loads(self.rfile.read(length)) if length else {}
+            args = request.get('args', [])
+            kwargs = request.get('kwargs', {})
+        except (ValueError, AttributeError) as e:
+            self.send_json(400, {'error': f"Invalid request body: {e}", 'type': 'BadRequest'})
+            return
+
+        func = self.server.report_operations.get(operation) or getattr(database, operation)
+        try:
+            if operation in WRITE_OPERATIONS:
+                result = self.server.write_queue.call(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e), 'type': 'ValueError'})
+        except Exception as e:
+            self.send_json(500, {'error': str(e), 'type': type(e).__name__})
+        else:
+            self.send_json(200, {'result': result})
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """Threaded HTTP server with room for many terminals connecting at once."""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, batch_window_ms=BATCH_WINDOW_MS):
+    """Prepare the database and create a server with a running write queue."""
+    database.init_database()
+    database.enable_wal()
+
+    server = ServiceServer((host, port), ServiceRequestHandler)
+    server.write_queue = WriteQueue(batch_window_ms).start()
+    server.backup_scheduler = None
+    server.replica_shipper = None
+    server.report_operations = {}
+    return server
+
+
+def main(argv=None):
+    """Run the service until interrupted."""
+    parser = argparse.ArgumentParser(description="Cylinder Management System service")
+    parser.add_argument('--db', default=database.DATABASE_FILE, help="database file")
+    parser.add_argument('--depot', help="serve this depot's database from the depot registry")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument('--batch-window-ms', type=float, default=BATCH_WINDOW_MS,
+                        help="how long to gather writes into one transaction")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    parser.add_argument('--backup-interval', type=float, default=0,
+                        help="minutes between online snapshots (0 disables them)")
+    parser.add_argument('--backup-dir', default=backup.BACKUP_DIR, help="snapshot directory")
+    parser.add_argument('--backup-keep', type=int, default=backup.KEEP, help="snapshots to retain")
+    parser.add_argument('--replica', default='', help="serve reports from this reporting replica")
+    args = parser.parse_args(argv)
+
+    if args.depot:
+        args.db = depots.depot_file(args.depot)
+    database.DATABASE_FILE = args.db
+    ServiceRequestHandler.quiet = not args.verbose
+    server = create_server(args.host, args.port, args.batch_window_ms)
+    if args.backup_interval > 0:
+        server.backup_scheduler = backup.BackupScheduler(args.backup_interval * 60, args.backup_dir, args.backup_keep).start()
+    if args.replica:
+        server.replica_shipper = replica.ReplicaShipper(args.replica).start()
+        server.report_operations = {name: replica.reporting(getattr(database, name), args.replica)
+                                    for name in replica.REPORT_OPERATIONS}
+    print(f"Serving {args.db} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.write_queue.stop()
+        if server.backup_scheduler is not None:
+            server.backup_scheduler.stop()
+        if server.replica_shipper is not None:
+            server.replica_shipper.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
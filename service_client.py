@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Client for the Cylinder Management System service
+Calls the operations served by service.py over its local HTTP/JSON API.
+"""
+
+import json
+import urllib.error
+import urllib.request
+
+
+class ServiceError(Exception):
+    """Unexpected error reported by the service."""
+
+
+def _encode_value(value):
+    """Make dictionaries with non-string keys (e.g. customer IDs) survive JSON."""
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {key: _encode_value(item) for key, item in value.items()}
+        return {'__items__': [[key, _encode_value(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _decode_object(obj):
+    if set(obj) == {'__items__'}:
+        return {key: value for key, value in obj['__items__']}
+    return obj
+
+
+def dumps(value):
+    """Serialize a request or response body."""
+    return json.dumps(_encode_value(value)).encode('utf-8')
+
+
+def loads(data):
+    """Deserialize a request or response body."""
+    return json.loads(data.decode('utf-8'), object_hook=_decode_object)
+
+
+class ServiceClient:
+    """Proxy exposing the service operations as plain functions."""
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def call(self, operation, *args, **kwargs):
+        """Run an operation on the service and return its result."""
+        request = urllib.request.Request(
+            f"{self.url}/api/{operation}",
+            data=dumps({'args': args, 'kwargs': kwargs}),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = loads(response.read())
+        except urllib.error.HTTPError as e:
+            body = loads(e.read())
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Cannot reach service at {self.url}: {e.reason}")
+
+        if 'error' in body:
+            # Validation errors keep their type so callers handle them as before
+            if body.get('type') == 'ValueError':
+                raise ValueError(body['error'])
+            raise ServiceError(f"{body.get('type', 'Error')}: {body['error']}")
+        return body['result']
+
+    def health(self):
+        """Get the service status, raising ConnectionError when it is down."""
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=self.timeout) as response:
+                return loads(response.read())
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Cannot reach service at {self.url}: {e.reason}")
+
+    def operation(self, name):
+        """Get a function calling the named operation."""
+        def call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        call.__name__ = name
+        return call
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Turnaround analytics for Cylinder Management System
+Computes how fast cylinders cycle from dispatch through return and refill or
+maintenance back to available. Cycle times come from one pass over the
+cylinder status event log ordered by cylinder; customer return speed comes
+from the dispatch history (open and archived DCs).
+
+database.get_turnaround_report() feeds the rows in and caches the report
+until status events, dispatches, cylinder types or customer names change.
+"""
+
+import math
+import threading
+
+PERCENTILES = (50, 90)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * pct / 100))
+    return ordered[rank - 1]
+
+
+def _summary(values):
+    """(count, average, p50, p90, max) of a list of day counts, rounded to 0.01 day."""
+    if not values:
+        return (0, 0.0, 0.0, 0.0, 0.0)
+    return (len(values), round(sum(values) / len(values), 2),
+            *(round(percentile(values, pct), 2) for pct in PERCENTILES), round(max(values), 2))
+
+
+def cylinder_cycles(events):
+    """Collect completed cycles from (cylinder_id, to_status, julian_day) events.
+
+    Events must be ordered by cylinder and then by time. A cycle starts when a
+    cylinder is dispatched and ends when it is next available again. Returns
+    {cylinder_id: [(cycle_days, out_days, processing_days), ...]}.
+    """
+    cycles = {}
+    current = None
+    dispatched_at = returned_at = None
+    for cylinder_id, to_status, at in events:
+        if cylinder_id != current:
+            current = cylinder_id
+            dispatched_at = returned_at = None
+        if to_status == 'dispatched':
+            dispatched_at, returned_at = at, None
+        elif to_status == 'returned' and dispatched_at is not None:
+            returned_at = at
+        elif to_status == 'available' and returned_at is not None:
+            cycles.setdefault(cylinder_id, []).append(
+                (at - dispatched_at, returned_at - dispatched_at, at - returned_at))
+            dispatched_at = returned_at = None
+    return cycles
+
+
+def build_report(events, cylinders, returns):
+    """Build the turnaround report.
+
+    events: (cylinder_id, to_status, julian_day) ordered by cylinder and time
+    cylinders: {cylinder_id: (cylinder_id_text, cylinder_type)}
+    returns: (customer_id, customer_name, days_out) per returned dispatch row
+
+    Returns a dictionary with 'cylinders' rows (id, cylinder_id_text, type,
+    cycles, avg_cycle_days, avg_out_days, avg_processing_days, last_cycle_days),
+    'types' rows (type, cycles, avg, p50, p90, max cycle days) and 'customers'
+    rows (customer_id, name, returns, avg, p50, p90, max days out).
+    """
+    cylinder_rows = []
+    by_type = {}
+    for cylinder_id, history in cylinder_cycles(events).items():
+        if cylinder_id not in cylinders:
+            continue  # deleted since
+        cylinder_id_text, cylinder_type = cylinders[cylinder_id]
+        cycle_days = [cycle for cycle, out, processing in history]
+        by_type.setdefault(cylinder_type, []).extend(cycle_days)
+        cylinder_rows.append((
+            cylinder_id, cylinder_id_text, cylinder_type, len(history),
+            round(sum(cycle_days) / len(history), 2),
+            round(sum(out for cycle, out, processing in history) / len(history), 2),
+            round(sum(processing for cycle, out, processing in history) / len(history), 2),
+            round(cycle_days[-1], 2),
+        ))
+    cylinder_rows.sort(key=lambda row: row[4], reverse=True)
+
+    by_customer = {}
+    names = {}
+    for customer_id, name, days_out in returns:
+        names[customer_id] = name
+        by_customer.setdefault(customer_id, []).append(days_out)
+
+    return {
+        'cylinders': cylinder_rows,
+        'types': sorted((cylinder_type, *_summary(values)) for cylinder_type, values in by_type.items()),
+        'customers': sorted(((customer_id, names[customer_id], *_summary(values))
+                             for customer_id, values in by_customer.items()),
+                            key=lambda row: row[3], reverse=True),
+    }
+
+
+class ReportCache:
+    """Keeps the last report per database until its version key changes."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reports = {}
+
+    def get(self, database_file, version, build):
+        """Return the cached report for database_file at version, or build() and cache it."""
+        with self._lock:
+            cached = self._reports.get(database_file)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        report = build()
+        with self._lock:
+            self._reports[database_file] = (version, report)
+        return report
+
+    def clear(self):
+        """Forget all cached reports."""
+        with self._lock:
+            self._reports.clear()
+
+
+report_cache = ReportCache()
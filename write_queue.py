@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Write queue for Cylinder Management System
+Runs database write operations on one dedicated writer connection. Operations
+that arrive within a short window are committed together in one transaction,
+each inside its own savepoint so a failing operation only rolls back itself
+and its caller still gets its own result or exception.
+
+Each queue keeps metrics on batch sizes, queue wait and commit latency
+(WriteQueue.metrics.snapshot() or to_prometheus()).
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import database
+
+BATCH_WINDOW_MS = 5
+MAX_BATCH_SIZE = 100
+HISTORY_SIZE = 1000
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class WriteQueueMetrics:
+    """Batch size, queue wait and commit latency of one write queue."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all collected metrics."""
+        with self._lock:
+            self.batches = 0
+            self.operations = 0
+            self.failed_operations = 0
+            self.failed_batches = 0
+            self.max_batch_size = 0
+            self.batch_size_buckets = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+            self.queue_wait_ms_total = 0.0
+            self.batch_ms_total = 0.0
+            self.commit_ms_total = 0.0
+            self.max_commit_ms = 0.0
+            self.recent_commit_ms = deque(maxlen=HISTORY_SIZE)
+
+    def observe(self, batch_size, failed, queue_wait_ms, batch_ms, commit_ms, committed):
+        """Record one batch."""
+        with self._lock:
+            self.batches += 1
+            self.operations += batch_size
+            self.failed_operations += failed
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            for index, bound in enumerate(BATCH_SIZE_BUCKETS):
+                if batch_size <= bound:
+                    self.batch_size_buckets[index] += 1
+                    break
+            else:
+                self.batch_size_buckets[-1] += 1
+            self.queue_wait_ms_total += queue_wait_ms
+            self.batch_ms_total += batch_ms
+            if committed:
+                self.commit_ms_total += commit_ms
+                self.max_commit_ms = max(self.max_commit_ms, commit_ms)
+                self.recent_commit_ms.append(commit_ms)
+            else:
+                self.failed_batches += 1
+
+    def snapshot(self):
+        """Get the metrics as a JSON-serializable dictionary."""
+        with self._lock:
+            committed = self.batches - self.failed_batches
+            return {
+                'batches': self.batches,
+                'operations': self.operations,
+                'failed_operations': self.failed_operations,
+                'failed_batches': self.failed_batches,
+                'avg_batch_size': round(self.operations / self.batches, 2) if self.batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'batch_size_histogram': dict(zip([str(b) for b in BATCH_SIZE_BUCKETS] + ['+Inf'], self.batch_size_buckets)),
+                'avg_queue_wait_ms': round(self.queue_wait_ms_total / self.operations, 3) if self.operations else 0.0,
+                'avg_batch_ms': round(self.batch_ms_total / self.batches, 3) if self.batches else 0.0,
+                'avg_commit_ms': round(self.commit_ms_total / committed, 3) if committed else 0.0,
+                'p95_commit_ms': round(_percentile(self.recent_commit_ms, 0.95), 3),
+                'max_commit_ms': round(self.max_commit_ms, 3),
+            }
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            committed = self.batches - self.failed_batches
+            lines = [
+                '# HELP cms_write_batch_size Operations committed per write queue transaction.',
+                '# TYPE cms_write_batch_size histogram',
+            ]
+            cumulative = 0
+            for bound, count in zip([str(b) for b in BATCH_SIZE_BUCKETS] + ['+Inf'], self.batch_size_buckets):
+                cumulative += count
+                lines.append(f'cms_write_batch_size_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'cms_write_batch_size_sum {self.operations}')
+            lines.append(f'cms_write_batch_size_count {self.batches}')
+            lines.append('# HELP cms_write_commit_seconds Time spent in COMMIT per write queue transaction.')
+            lines.append('# TYPE cms_write_commit_seconds summary')
+            lines.append(f'cms_write_commit_seconds_sum {self.commit_ms_total / 1000}')
+            lines.append(f'cms_write_commit_seconds_count {committed}')
+            lines.append('# HELP cms_write_queue_wait_seconds_total Time operations waited before their batch started.')
+            lines.append('# TYPE cms_write_queue_wait_seconds_total counter')
+            lines.append(f'cms_write_queue_wait_seconds_total {self.queue_wait_ms_total / 1000}')
+            lines.append('# HELP cms_write_failed_operations_total Operations rolled back to their savepoint.')
+            lines.append('# TYPE cms_write_failed_operations_total counter')
+            lines.append(f'cms_write_failed_operations_total {self.failed_operations}')
+            lines.append('# HELP cms_write_failed_batches_total Transactions that failed to commit.')
+            lines.append('# TYPE cms_write_failed_batches_total counter')
+            lines.append(f'cms_write_failed_batches_total {self.failed_batches}')
+        return '\n'.join(lines) + '\n'
+
+
+class WriteQueue:
+    """Single writer thread that group-commits queued write operations.
+
+    Every queued function must accept a ``conn`` keyword argument and do its
+    work on that connection without committing, like the write functions in
+    database.py.
+    """
+    def __init__(self, batch_window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self.metrics = WriteQueueMetrics()
+
+    def start(self):
+        """Start the writer thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cms-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Finish the queued operations and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, conn=..., **kwargs) and return a Future of its result."""
+        if self._thread is None:
+            raise RuntimeError("Write queue is not running")
+        future = Future()
+        self._queue.put((future, func, args, kwargs, time.perf_counter()))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """Queue a write and wait for its result, re-raising its exception."""
+        return self.submit(func, *args, **kwargs).result()
+
+    def _connect(self):
+        """Open the writer connection with manual transaction control."""
+        conn = database.get_connection()
+        conn.isolation_level = None
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _next_batch(self, first):
+        """Collect operations arriving within the batch window after the first one."""
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_window_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop marker back so the loop ends after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                self._commit_batch(conn, self._next_batch(item))
+        finally:
+            conn.close()
+
+    def queue_depth(self):
+        """Number of operations waiting for the writer."""
+        return self._queue.qsize()
+
+    def _commit_batch(self, conn, batch):
+        """Run a batch in one transaction with a savepoint per operation."""
+        outcomes = []
+        start = time.perf_counter()
+        queue_wait_ms = sum((start - queued_at) * 1000 for *_, queued_at in batch)
+        commit_ms = 0.0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, func, args, kwargs, queued_at in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT operation")
+                callback_mark = database.commit_callback_mark(conn)
+                try:
+                    result = func(*args, conn=conn, **kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operation")
+                    conn.execute("RELEASE operation")
+                    database.discard_commit_callbacks(conn, callback_mark)
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE operation")
+                    outcomes.append((future, result, None))
+            commit_start = time.perf_counter()
+            conn.execute("COMMIT")
+            commit_ms = (time.perf_counter() - commit_start) * 1000
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            database.discard_commit_callbacks(conn)
+            for future, func, args, kwargs, queued_at in batch:
+                if not future.done() and (future.running() or future.set_running_or_notify_cancel()):
+                    future.set_exception(e)
+            self.metrics.observe(len(batch), len(batch), queue_wait_ms,
+                                 (time.perf_counter() - start) * 1000, 0.0, committed=False)
+            return
+
+        self.metrics.observe(len(batch), sum(1 for outcome in outcomes if outcome[2] is not None), queue_wait_ms,
+                             (time.perf_counter() - start) * 1000, commit_ms, committed=True)
+
+        # Let caches see the committed writes before their callers do
+        database.run_commit_callbacks(conn)
+
+        # Report results only once the whole batch is durable
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_default_queue = None
+_default_lock = threading.Lock()
+
+
+def default_queue():
+    """Get the process-wide write queue, starting it on first use."""
+    global _default_queue
+    with _default_lock:
+        if _default_queue is None:
+            _default_queue = WriteQueue().start()
+        return _default_queue
+
+
+def group_committed(func):
+    """Wrap a database write function so calls go through the process-wide write queue."""
+    def call(*args, **kwargs):
+        return default_queue().call(func, *args, **kwargs)
+    call.__name__ = func.__name__
+    call.__doc__ = func.__doc__
+    return call